@@ -1,66 +1,173 @@
+import os
 import signal
 import sys
+import tempfile
+import time
 import netpype.env as env
 
-from multiprocessing import Process, Value
+from netpype.affinity import pin
+from netpype.control import ControlBlock, STATE_NEW, STATE_RUNNING
+from netpype.control import STATE_STOPPED, STATE_DRAINING, STATE, PID
+from netpype.control import GENERATION, ITERATIONS, DEFAULT_DRAIN_TIMEOUT
+from netpype.control import REQUEST, REQUEST_STOP, REQUEST_DRAIN
+from multiprocessing import Process
 
 _LOG = env.get_logger('netpype')
 _PROFILE_ENABLED = env.get('PROFILE', False)
+# PROFILE=cprofile profiles the whole loop, any other value samples handlers,
+# see netpype.profiler
+_CPROFILE_ENABLED = _PROFILE_ENABLED == 'cprofile'
+
+# Workers keep looping in these states
+_LIVE_STATES = (STATE_RUNNING, STATE_DRAINING)
 
 # Enable profiling
 if _PROFILE_ENABLED:
     _LOG.warn("""Warning! You have enabled profiling. To shut profiling off
         please unset the environment variable PROFILE.""")
+if _CPROFILE_ENABLED:
     import cProfile
 
-# Process states
-_STATE_NEW = 0
-_STATE_RUNNING = 1
-_STATE_STOPPED = 2
+
+class WorkerStateError(Exception):
+    pass
 
 
 class PersistentProcess(object):
 
-    def __init__(self, name, **kwargs):
+    def __init__(self, name, cpus=None, **kwargs):
         self._name = name
-        self._state = Value('i', _STATE_NEW)
+        # The worker pins itself to these CPUs when it starts
+        self._cpus = tuple(cpus) if cpus else None
+        self._control = ControlBlock()
 
-        if not _PROFILE_ENABLED:
+        if not _CPROFILE_ENABLED:
             self._process = Process(
-                target=self._run, kwargs={'state': self._state})
+                target=self._run, kwargs={'control': self._control})
         else:
             self._process = Process(
-                target=self._run_profiled, kwargs={'state': self._state})
-        signal.signal(signal.SIGINT, self._on_signal)
+                target=self._run_profiled, kwargs={'control': self._control})
 
     def _on_signal(self, signal, frame):
-        self._state.value = _STATE_STOPPED
-        self.on_halt()
+        # The loop halts the worker once the poll it is blocked in returns
+        self._control.set_state(STATE_STOPPED)
+        self._control.wake()
 
     def stop(self):
-        self._state.value = _STATE_STOPPED
-        self._process.join()
+        self._control.request_stop()
+        self.join()
         self.on_halt()
 
+    def interrupt(self):
+        """
+        Flags the worker as stopped without waiting for it. The worker is
+        woken through its control block so that a poll blocked in the worker
+        process returns.
+        """
+        self._control.request_stop()
+
+    def drain(self, timeout=DEFAULT_DRAIN_TIMEOUT):
+        """
+        Asks the worker to finish its work within timeout seconds and exit,
+        without waiting for it. See on_drain.
+        """
+        self._control.request_drain(time.time() + timeout)
+
+    def reload(self):
+        """
+        Starts a new reload generation, which the worker is woken up to pass
+        to on_reload.
+        """
+        self._control.request_reload()
+
+    def heartbeat(self):
+        return self._control.heartbeat()
+
+    def stats(self):
+        return self._control.stats[:]
+
+    def wakeup_fileno(self):
+        """
+        The descriptor that becomes readable when the worker is asked to stop
+        or reload. Workers that block in a poll should poll it too and call
+        _on_control when it is readable.
+        """
+        return self._control.wakeup_fileno()
+
+    def join(self, timeout=None):
+        """
+        Waits up to timeout seconds for the worker to exit and returns
+        whether it has. The control block is closed once it has.
+        """
+        self._process.join(timeout)
+        if self._process.is_alive():
+            return False
+        self._control.close()
+        return True
+
+    def terminate(self):
+        self._process.terminate()
+        self.join()
+
+    def is_alive(self):
+        return self._process.is_alive()
+
+    def exitcode(self):
+        return self._process.exitcode
+
+    def pid(self):
+        return self._process.pid
+
     def start(self):
-        if self._state.value != _STATE_NEW:
+        if self._control.state() != STATE_NEW:
             raise WorkerStateError('Worker has been started once already.')
 
-        self._state.value = _STATE_NEW
+        self._control.set_state(STATE_RUNNING)
         self._process.start()
 
-    def _run_profiled(self, state):
-        cProfile.runctx('self._run(state)', globals(), locals())
-
-    def _run(self, state):
+    def _run_profiled(self, control):
+        profile = cProfile.Profile()
+        try:
+            profile.runctx('self._run(control)', globals(), locals())
+        finally:
+            path = os.path.join(
+                env.get('PROFILE_DIR', tempfile.gettempdir()),
+                'netpype-{}.prof'.format(os.getpid()))
+            profile.dump_stats(path)
+            _LOG.warn('Wrote profile {}.'.format(path))
+
+    def _run(self, control):
+        # Only the worker process should react to interrupts on its behalf
+        signal.signal(signal.SIGINT, self._on_signal)
+        words = control.words
+        words[PID] = os.getpid()
+        pin(self._cpus)
         self.on_start()
-        ## TODO: Fix to state Running
-        while state.value == _STATE_NEW:
+        generation = words[GENERATION]
+        draining = False
+        while words[STATE] in _LIVE_STATES:
+            control.beat(time.time())
+            words[ITERATIONS] += 1
+            request = words[REQUEST]
+            if request == REQUEST_STOP:
+                control.set_state(STATE_STOPPED)
+                break
+            if words[GENERATION] != generation:
+                generation = words[GENERATION]
+                self.on_reload(generation)
+            if request == REQUEST_DRAIN and not draining:
+                draining = True
+                control.set_state(STATE_DRAINING)
+                self.on_drain(control.drain_deadline())
             try:
                 self.process()
             except Exception as ex:
-                self._state.value = _STATE_STOPPED
+                control.set_state(STATE_STOPPED)
                 _LOG.exception(ex)
+        self.on_halt()
+
+    def _on_control(self):
+        self._control.clear_wakeups()
 
     def process(self):
         raise NotImplementedError
@@ -68,5 +175,17 @@ class PersistentProcess(object):
     def on_start(self):
         pass
 
+    def on_reload(self, generation):
+        pass
+
+    def on_drain(self, deadline):
+        """
+        Called in the worker when it is asked to drain. Workers that have
+        work to finish keep processing until it is done or the deadline, in
+        seconds since the epoch, passes and then set their state to stopped.
+        Everyone else stops straight away.
+        """
+        self._control.set_state(STATE_STOPPED)
+
     def on_halt(self):
         pass
@@ -0,0 +1,168 @@
+import os
+import re
+import socket
+import netpype.env as env
+
+from multiprocessing import cpu_count
+
+
+_LOG = env.get_logger('netpype.affinity')
+
+NODE_ROOT = '/sys/devices/system/node'
+INTERRUPTS = '/proc/interrupts'
+IRQ_ROOT = '/proc/irq'
+
+# Cluster layouts
+LAYOUT_NUMA = 'numa'
+
+# The Linux value for socket modules that don't export it
+SO_INCOMING_CPU = getattr(socket, 'SO_INCOMING_CPU', 49)
+
+_NODE_NAME = re.compile(r'node(\d+)$')
+_RX_QUEUE = re.compile(r'rx', re.IGNORECASE)
+
+
+def parse_cpu_list(text):
+    """
+    Parses a kernel CPU list such as 0-3,8,10-11 into a list of CPUs.
+    """
+    cpus = list()
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def allowed_cpus():
+    # The CPUs this process may run on, which cpu_count() ignores
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(cpu_count()))
+
+
+def pin(cpus):
+    """
+    Restricts the calling process, or thread on Linux, to the given CPUs.
+    """
+    if not cpus:
+        return
+    try:
+        os.sched_setaffinity(0, cpus)
+    except AttributeError:
+        _LOG.warn('CPU affinity is not supported on this platform.')
+
+
+def set_incoming_cpu(sock, cpu):
+    """
+    Tells the kernel which CPU serves a socket. Among the SO_REUSEPORT
+    sockets of an address, new connections and datagrams are steered to the
+    one whose CPU received them, keeping a worker on the CPU of its RX queue.
+    """
+    sock.setsockopt(socket.SOL_SOCKET, SO_INCOMING_CPU, cpu)
+
+
+def numa_nodes(root=NODE_ROOT):
+    """
+    Returns the CPUs of every NUMA node this process may run on as a dict of
+    node numbers to CPU lists. Machines without NUMA information are one
+    node.
+    """
+    allowed = allowed_cpus()
+    try:
+        names = os.listdir(root)
+    except OSError:
+        names = list()
+
+    nodes = dict()
+    for name in names:
+        match = _NODE_NAME.match(name)
+        if match is None:
+            continue
+        try:
+            with open(os.path.join(root, name, 'cpulist')) as cpulist:
+                cpus = parse_cpu_list(cpulist.read())
+        except IOError:
+            continue
+        cpus = [cpu for cpu in cpus if cpu in allowed]
+        if cpus:
+            nodes[int(match.group(1))] = cpus
+    return nodes or {0: allowed}
+
+
+def node_cpus(cpus, nodes=None):
+    """
+    Returns every CPU on the NUMA nodes that the given CPUs belong to.
+    """
+    nodes = nodes or numa_nodes()
+    wanted = set(cpus)
+    local = list()
+    for node in sorted(nodes):
+        if wanted.intersection(nodes[node]):
+            local.extend(nodes[node])
+    return local or list(cpus)
+
+
+def default_layout(workers, nodes=None):
+    """
+    Returns the CPUs of each of the given number of workers, one CPU apiece
+    taken from every NUMA node in turn so that workers spread evenly across
+    sockets. CPUs are shared once every one has a worker.
+    """
+    nodes = nodes or numa_nodes()
+    columns = [nodes[node] for node in sorted(nodes)]
+    order = list()
+    for index in range(max(len(column) for column in columns)):
+        for column in columns:
+            if index < len(column):
+                order.append(column[index])
+    return [(order[worker % len(order)],) for worker in range(workers)]
+
+
+def rx_queue_cpus(interface, interrupts=INTERRUPTS, irq_root=IRQ_ROOT):
+    """
+    Returns the CPU that handles each receive queue of a network interface,
+    in queue order, from the affinity of the interface's interrupts. Queue
+    interrupts are found by name, like eth0-TxRx-0 or eth0-rx-0.
+    """
+    cpus = list()
+    try:
+        with open(interrupts) as interrupt_table:
+            lines = interrupt_table.readlines()
+    except IOError:
+        return cpus
+
+    for line in lines:
+        fields = line.split()
+        if not fields or not fields[0].rstrip(':').isdigit():
+            continue
+        name = fields[-1]
+        if not name.startswith(interface + '-') or not _RX_QUEUE.search(
+                name[len(interface):]):
+            continue
+        irq = fields[0].rstrip(':')
+        for affinity in ('effective_affinity_list', 'smp_affinity_list'):
+            try:
+                with open(os.path.join(irq_root, irq, affinity)) as irq_cpus:
+                    listed = parse_cpu_list(irq_cpus.read())
+            except IOError:
+                continue
+            if listed:
+                cpus.append(listed[0])
+                break
+    return cpus
+
+
+def rx_queue_layout(interface, interrupts=INTERRUPTS, irq_root=IRQ_ROOT):
+    """
+    Returns the CPUs of one worker per receive queue of an interface, each
+    on the CPU that handles its queue.
+    """
+    allowed = allowed_cpus()
+    return [(cpu,) for cpu in rx_queue_cpus(interface, interrupts, irq_root)
+            if cpu in allowed]
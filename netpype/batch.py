@@ -0,0 +1,257 @@
+from array import array
+
+
+# Message fields
+PRIORITY = 0
+VERSION = 1
+TIMESTAMP = 2
+HOSTNAME = 3
+APPNAME = 4
+PROCESSID = 5
+MESSAGEID = 6
+MESSAGE = 7
+
+FIELD_COUNT = 8
+FIELD_NAMES = ('priority', 'version', 'timestamp', 'hostname', 'appname',
+               'processid', 'messageid', 'message')
+
+# Fields are stored as offset and length pairs
+_FIELD_WIDTH = 2 * FIELD_COUNT
+
+# SD elements are stored as name offset, name length, first field and field
+# count while SD fields are name offset, name length, value offset and value
+# length
+_ELEMENT_WIDTH = 4
+_SD_FIELD_WIDTH = 4
+
+_UNSET = -1
+_EMPTY_FIELDS = array('i', [0, _UNSET] * FIELD_COUNT)
+
+
+class SyslogMessageView(object):
+
+    __slots__ = ('_batch', '_index')
+
+    def __init__(self, batch, index):
+        self._batch = batch
+        self._index = index
+
+    def field(self, field):
+        return self._batch.field(self._index, field)
+
+    def view(self, field):
+        return self._batch.view(self._index, field)
+
+    @property
+    def priority(self):
+        return self._batch.field(self._index, PRIORITY)
+
+    @property
+    def version(self):
+        return self._batch.field(self._index, VERSION)
+
+    @property
+    def timestamp(self):
+        return self._batch.field(self._index, TIMESTAMP)
+
+    @property
+    def hostname(self):
+        return self._batch.field(self._index, HOSTNAME)
+
+    @property
+    def appname(self):
+        return self._batch.field(self._index, APPNAME)
+
+    @property
+    def processid(self):
+        return self._batch.field(self._index, PROCESSID)
+
+    @property
+    def messageid(self):
+        return self._batch.field(self._index, MESSAGEID)
+
+    @property
+    def message(self):
+        return self._batch.field(self._index, MESSAGE)
+
+    @property
+    def sd(self):
+        return self._batch.sd(self._index)
+
+    def __repr__(self):
+        return 'Syslog message {} of {}'.format(self._index, self._batch)
+
+
+"""
+A SyslogBatch holds many syslog messages in a handful of flat arrays instead
+of an object, a dict and a string per field of every message. Message bytes
+are copied into one shared arena and every field, SD element and SD field is
+kept as an offset and length pair into it. Strings are only made when a field
+is read, and fields that are never read cost eight bytes.
+
+Lexers fill a batch one message at a time. A message is begun, its bytes are
+copied or put into the arena and its fields are set, either from the offsets
+of the copied bytes or by putting each token as it is read. A message that
+turns out to be malformed is rolled back.
+
+Messages are read back by index or through light SyslogMessageView objects
+handed out by iterating the batch. Views, and the memoryviews that view()
+returns, are only good until the batch is cleared; memoryviews must also be
+released before more messages are added since the arena can not grow while
+they are held.
+"""
+
+
+class SyslogBatch(object):
+
+    def __init__(self):
+        self.arena = bytearray()
+        self._fields = array('i')
+        self._sd_elements = array('i')
+        self._sd_fields = array('i')
+        self._sd_index = array('i')
+        self._marks = None
+
+    def __len__(self):
+        return len(self._sd_index) // 2
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Message index out of range: {}.'.format(index))
+        return SyslogMessageView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield SyslogMessageView(self, index)
+
+    def __repr__(self):
+        return 'SyslogBatch of {} messages in {} bytes'.format(
+            len(self), len(self.arena))
+
+    def clear(self):
+        del self.arena[:]
+        del self._fields[:]
+        del self._sd_elements[:]
+        del self._sd_fields[:]
+        del self._sd_index[:]
+        self._marks = None
+
+    def begin(self):
+        """
+        Begins a new message and returns its index. Every field starts out
+        unset.
+        """
+        self._marks = (len(self.arena), len(self._sd_elements),
+                       len(self._sd_fields))
+        self._fields.extend(_EMPTY_FIELDS)
+        self._sd_index.append(len(self._sd_elements) // _ELEMENT_WIDTH)
+        self._sd_index.append(0)
+        return len(self) - 1
+
+    def rollback(self):
+        """
+        Drops the message begun last along with everything added for it.
+        """
+        if self._marks is None:
+            raise ValueError('No message to roll back.')
+        arena_length, elements_length, sd_fields_length = self._marks
+        del self.arena[arena_length:]
+        del self._sd_elements[elements_length:]
+        del self._sd_fields[sd_fields_length:]
+        del self._fields[-_FIELD_WIDTH:]
+        del self._sd_index[-2:]
+        self._marks = None
+
+    def copy(self, data):
+        """
+        Copies data into the arena and returns the offset it starts at.
+        """
+        offset = len(self.arena)
+        self.arena += data
+        return offset
+
+    def set_field(self, field, offset, length):
+        index = len(self._fields) - _FIELD_WIDTH + 2 * field
+        self._fields[index] = offset
+        self._fields[index + 1] = length
+
+    def set_fields(self, bounds):
+        """
+        Sets every field of the current message from a sequence of offset and
+        length pairs in field order.
+        """
+        self._fields[-_FIELD_WIDTH:] = array('i', bounds)
+
+    def put_field(self, field, data):
+        self.set_field(field, self.copy(data), len(data))
+
+    def add_sd_element(self, offset, length):
+        self._sd_elements.extend((
+            offset, length, len(self._sd_fields) // _SD_FIELD_WIDTH, 0))
+        self._sd_index[-1] += 1
+
+    def put_sd_element(self, name):
+        self.add_sd_element(self.copy(name), len(name))
+
+    def add_sd_field(self, name_offset, name_length, value_offset,
+                     value_length):
+        if self._marks is None or len(self._sd_elements) == self._marks[1]:
+            raise ValueError('SD fields require an SD element.')
+        self._sd_fields.extend((
+            name_offset, name_length, value_offset, value_length))
+        self._sd_elements[-1] += 1
+
+    def put_sd_field(self, name, value):
+        name_offset = self.copy(name)
+        self.add_sd_field(name_offset, len(name), self.copy(value), len(value))
+
+    def field(self, index, field):
+        """
+        Returns the bytes of a message field or None when it was never set.
+        """
+        position = index * _FIELD_WIDTH + 2 * field
+        length = self._fields[position + 1]
+        if length == _UNSET:
+            return None
+        offset = self._fields[position]
+        return bytes(self.arena[offset:offset + length])
+
+    def view(self, index, field):
+        """
+        Returns a memoryview of a message field without copying it or None
+        when it was never set.
+        """
+        position = index * _FIELD_WIDTH + 2 * field
+        length = self._fields[position + 1]
+        if length == _UNSET:
+            return None
+        offset = self._fields[position]
+        return memoryview(self.arena)[offset:offset + length]
+
+    def sd(self, index):
+        """
+        Builds the structured data of a message as a dict of SD element names
+        to dicts of their fields.
+        """
+        arena = self.arena
+        elements = self._sd_elements
+        sd_fields = self._sd_fields
+        first_element, element_count = self._sd_index[2 * index:2 * index + 2]
+
+        sd = dict()
+        for element in range(first_element, first_element + element_count):
+            position = element * _ELEMENT_WIDTH
+            name_offset, name_length, first_field, field_count = (
+                elements[position:position + _ELEMENT_WIDTH])
+            fields = dict()
+            for sd_field in range(first_field, first_field + field_count):
+                position = sd_field * _SD_FIELD_WIDTH
+                field_offset, field_length, value_offset, value_length = (
+                    sd_fields[position:position + _SD_FIELD_WIDTH])
+                name = bytes(arena[field_offset:field_offset + field_length])
+                fields[name] = bytes(
+                    arena[value_offset:value_offset + value_length])
+            sd[bytes(arena[name_offset:name_offset + name_length])] = fields
+        return sd
@@ -0,0 +1,4 @@
+from netpype.bench.suite import go
+
+
+go()
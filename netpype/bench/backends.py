@@ -0,0 +1,44 @@
+import netpype.env as env
+
+from netpype.selector import PollSelectorServer, EPollSelectorServer
+from netpype.selector import EdgeTriggeredEPollSelectorServer
+from netpype.selector import AsyncioSelectorServer
+from netpype.channel import CyclicBuffer
+
+try:
+    from netpype.cutil import CyclicBuffer as NativeCyclicBuffer
+except ImportError:
+    NativeCyclicBuffer = None
+
+
+_LOG = env.get_logger('netpype.bench.backends')
+
+
+# Selector backends by name
+BACKENDS = [
+    ('poll', PollSelectorServer),
+    ('epoll', EPollSelectorServer),
+    ('epoll-et', EdgeTriggeredEPollSelectorServer),
+]
+if AsyncioSelectorServer is not None:
+    BACKENDS.append(('asyncio', AsyncioSelectorServer))
+
+# Buffer implementations by name
+BUFFERS = [
+    ('python', CyclicBuffer),
+]
+if NativeCyclicBuffer is not None:
+    BUFFERS.append(('native', NativeCyclicBuffer))
+else:
+    _LOG.info('C extensions not built, benchmarking python buffers only.')
+
+
+def select(registry, names=None):
+    if not names:
+        return list(registry)
+    known = dict(registry)
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        raise ValueError('Unknown names: {}. Pick from {}.'.format(
+            ', '.join(unknown), ', '.join(name for name, _ in registry)))
+    return [(name, known[name]) for name in names]
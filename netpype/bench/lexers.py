@@ -0,0 +1,154 @@
+import argparse
+import sys
+import time
+import netpype.env as env
+
+from netpype.batch import SyslogBatch
+from netpype.bench.backends import select
+from netpype.bench.load import DEFAULT_SYSLOG_MESSAGE
+from netpype.examples.syslog import SyslogLexer as PythonSyslogLexer
+from netpype.examples.syslog import lexer_states
+
+try:
+    from netpype.syslog import SyslogLexer as NativeSyslogLexer
+except ImportError:
+    NativeSyslogLexer = None
+
+try:
+    from netpype.csyslog import SyslogBulkParser
+except ImportError:
+    SyslogBulkParser = None
+
+
+_LOG = env.get_logger('netpype.bench.lexers')
+
+DEFAULT_MESSAGES = 20000
+DEFAULT_READ_SIZE = 4096
+DEFAULT_ROUNDS = 3
+
+_BETWEEN_FRAMES = (lexer_states.START, lexer_states.READ_OCTET)
+
+
+"""
+Every lexer is built by a function that returns a reader. A reader is called
+with each read of the stream and consumes the messages the read completed the
+way a pipeline would, releasing pooled messages and clearing batches.
+"""
+
+
+def _python_reader():
+    return PythonSyslogLexer().on_read
+
+
+def _python_batch_reader():
+    batch = SyslogBatch()
+    lexer = PythonSyslogLexer(batch)
+
+    def read(data):
+        lexer.on_read(data)
+        # Messages are appended as they are lexed, so the batch can only be
+        # cleared between frames
+        if lexer.get_state() in _BETWEEN_FRAMES:
+            batch.clear()
+    return read
+
+
+def _native_reader():
+    lexer = NativeSyslogLexer()
+
+    def read(data):
+        for message in lexer.on_read(data):
+            lexer.release(message)
+    return read
+
+
+def _bulk_reader():
+    return SyslogBulkParser().parse
+
+
+def _bulk_batch_reader():
+    batch = SyslogBatch()
+    parser = SyslogBulkParser()
+
+    def read(data):
+        parser.parse_into(batch, data)
+        batch.clear()
+    return read
+
+
+# Lexers by name
+LEXERS = [
+    ('python', _python_reader),
+    ('python-batch', _python_batch_reader),
+]
+if NativeSyslogLexer is not None:
+    LEXERS.append(('native', _native_reader))
+if SyslogBulkParser is not None:
+    LEXERS.append(('bulk', _bulk_reader))
+    LEXERS.append(('bulk-batch', _bulk_batch_reader))
+if len(LEXERS) == 2:
+    _LOG.info('C extensions not built, benchmarking python lexers only.')
+
+
+def octet_stream(message=DEFAULT_SYSLOG_MESSAGE, count=DEFAULT_MESSAGES):
+    return (str(len(message)).encode() + b' ' + message) * count
+
+
+def reads(data, read_size=DEFAULT_READ_SIZE):
+    return [bytearray(data[offset:offset + read_size])
+            for offset in range(0, len(data), read_size)]
+
+
+def run(lexers=LEXERS, messages=DEFAULT_MESSAGES,
+        read_size=DEFAULT_READ_SIZE, rounds=DEFAULT_ROUNDS):
+    """
+    Feeds the same octet counted stream through every lexer and keeps the
+    best of a number of rounds, each on a fresh lexer.
+    """
+    data = octet_stream(count=messages)
+    chunks = reads(data, read_size)
+    results = list()
+    for name, reader_factory in lexers:
+        best = None
+        for _ in range(rounds):
+            read = reader_factory()
+            then = time.time()
+            for chunk in chunks:
+                read(chunk)
+            elapsed = time.time() - then
+            if best is None or elapsed < best:
+                best = elapsed
+        best = max(best, 1e-9)
+        results.append({
+            'lexer': name,
+            'messages_per_sec': messages / best,
+            'mb_per_sec': len(data) / best / 1000000,
+        })
+    return results
+
+
+def report(results, out=sys.stdout):
+    out.write('{:<13} {:>12} {:>9}\n'.format('lexer', 'msgs/s', 'MB/s'))
+    for result in results:
+        out.write('{:<13} {:>12.0f} {:>9.1f}\n'.format(
+            result['lexer'], result['messages_per_sec'],
+            result['mb_per_sec']))
+
+
+def go(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m netpype.bench.lexers',
+        description='Syslog lexer throughput benchmarks.')
+    parser.add_argument('--lexers', help='comma separated lexers')
+    parser.add_argument('--messages', type=int, default=DEFAULT_MESSAGES)
+    parser.add_argument('--read-size', type=int, default=DEFAULT_READ_SIZE)
+    parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS)
+    args = parser.parse_args(argv)
+
+    names = [name for name in (args.lexers or '').split(',') if name]
+    report(run(select(LEXERS, names), args.messages, args.read_size,
+               args.rounds))
+
+
+if __name__ == '__main__':
+    go()
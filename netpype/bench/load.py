@@ -0,0 +1,205 @@
+import os
+import selectors
+import socket
+import time
+
+from netpype.bench.pipelines import EchoPipelineFactory
+from netpype.bench.pipelines import SyslogAckPipelineFactory
+
+
+DEFAULT_CONNECTIONS = 32
+DEFAULT_DURATION = 5.0
+DEFAULT_CONNECT_DURATION = 1.0
+
+DEFAULT_ECHO_PAYLOAD = b'x' * 64
+DEFAULT_SYSLOG_BATCH = 16
+DEFAULT_SYSLOG_MESSAGE = (
+    b'<46>1 2012-12-11T15:48:23.217459-06:00 tohru rsyslogd 6611 12512 '
+    b'[origin software="rsyslogd" swVersion="7.2.2" x-pid="12297" '
+    b'x-info="http://www.rsyslog.com"] start')
+
+_RECV_SIZE = 65536
+
+try:
+    _CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+except (AttributeError, ValueError, OSError):
+    _CLOCK_TICKS = None
+
+
+"""
+A workload describes the traffic a load generator sends. Every request is sent
+in one piece, carries a number of messages and is complete once the server has
+answered with the expected number of bytes.
+"""
+
+
+class EchoWorkload(object):
+
+    name = 'echo'
+
+    def __init__(self, payload=DEFAULT_ECHO_PAYLOAD):
+        self.request = payload
+        self.messages = 1
+        self.response_size = len(payload)
+
+    def pipeline_factory(self, buffer_class):
+        return EchoPipelineFactory()
+
+
+class SyslogWorkload(object):
+
+    name = 'syslog'
+
+    def __init__(self, message=DEFAULT_SYSLOG_MESSAGE,
+                 batch=DEFAULT_SYSLOG_BATCH):
+        frame = str(len(message)).encode('ascii') + b' ' + message
+        self.request = frame * batch
+        self.messages = batch
+        self.response_size = batch
+
+    def pipeline_factory(self, buffer_class):
+        return SyslogAckPipelineFactory(buffer_class)
+
+
+WORKLOADS = [
+    ('echo', EchoWorkload),
+    ('syslog', SyslogWorkload),
+]
+
+
+def percentile(samples, fraction):
+    """
+    Returns the nearest rank percentile of already sorted samples.
+    """
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def process_cpu(pid):
+    """
+    Returns the user and system CPU seconds used by a process so far or None
+    where /proc is not available.
+    """
+    if _CLOCK_TICKS is None:
+        return None
+    try:
+        with open('/proc/{}/stat'.format(pid)) as stat:
+            # The command name may hold spaces but is wrapped in parentheses
+            fields = stat.read().rsplit(')', 1)[1].split()
+    except (IOError, OSError):
+        return None
+    return (int(fields[11]) + int(fields[12])) / float(_CLOCK_TICKS)
+
+
+def connect(port, attempts=50):
+    for _ in range(attempts):
+        try:
+            client = socket.create_connection(('127.0.0.1', port))
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return client
+        except socket.error:
+            time.sleep(0.1)
+    raise IOError('Unable to connect to the server on port {}.'.format(port))
+
+
+def _complete(client, response_size):
+    received = 0
+    while received < response_size:
+        read = client.recv(_RECV_SIZE)
+        if not read:
+            raise IOError('Server closed the connection.')
+        received += len(read)
+
+
+def connection_rate(port, workload, duration=DEFAULT_CONNECT_DURATION):
+    """
+    Opens connections one after the other, completing a single request on
+    each, for the given duration. Returns connections per second.
+    """
+    connections = 0
+    started = time.time()
+    deadline = started + duration
+    while time.time() < deadline:
+        client = connect(port)
+        try:
+            client.sendall(workload.request)
+            _complete(client, workload.response_size)
+        finally:
+            client.close()
+        connections += 1
+    return connections / (time.time() - started)
+
+
+class _Connection(object):
+
+    __slots__ = ('client', 'received', 'sent_at')
+
+    def __init__(self, client):
+        self.client = client
+        self.received = 0
+        self.sent_at = 0
+
+
+def throughput(port, workload, connections=DEFAULT_CONNECTIONS,
+               duration=DEFAULT_DURATION, server_pid=None):
+    """
+    Keeps one request in flight on every connection for the given duration.
+    Returns the messages completed, the seconds it took, the sorted request
+    latencies in seconds and the server CPU seconds spent, if the server
+    process is known.
+    """
+    selector = selectors.DefaultSelector()
+    request = workload.request
+    response_size = workload.response_size
+    latencies = list()
+    completed = 0
+
+    opened = list()
+    for _ in range(connections):
+        connection = _Connection(connect(port))
+        connection.client.setblocking(0)
+        selector.register(
+            connection.client, selectors.EVENT_READ, connection)
+        opened.append(connection)
+
+    cpu_before = process_cpu(server_pid) if server_pid else None
+    started = time.time()
+    for connection in opened:
+        connection.sent_at = time.time()
+        connection.client.sendall(request)
+
+    deadline = started + duration
+    while True:
+        now = time.time()
+        if now >= deadline:
+            break
+        for key, _ in selector.select(deadline - now):
+            connection = key.data
+            try:
+                read = connection.client.recv(_RECV_SIZE)
+            except socket.error:
+                continue
+            if not read:
+                raise IOError('Server closed the connection.')
+            connection.received += len(read)
+            if connection.received >= response_size:
+                now = time.time()
+                latencies.append(now - connection.sent_at)
+                completed += 1
+                connection.received -= response_size
+                connection.sent_at = now
+                connection.client.sendall(request)
+    elapsed = time.time() - started
+    cpu_after = process_cpu(server_pid) if server_pid else None
+
+    for connection in opened:
+        selector.unregister(connection.client)
+        connection.client.close()
+    selector.close()
+
+    cpu = None
+    if cpu_before is not None and cpu_after is not None:
+        cpu = cpu_after - cpu_before
+    latencies.sort()
+    return completed * workload.messages, elapsed, latencies, cpu
@@ -0,0 +1,87 @@
+from netpype.selector import events as selection_events
+from netpype.channel import NetworkEventHandler, PipelineFactory
+
+
+_FRAME_DELIM = b' '
+_ACK = b'.'
+
+
+class EchoHandler(NetworkEventHandler):
+
+    def on_connect(self, message):
+        return (selection_events.REQUEST_READ, None)
+
+    def on_read(self, message):
+        return (selection_events.REQUEST_WRITE, bytes(message))
+
+    def on_write(self, message):
+        return None
+
+    def on_timeout(self, message):
+        return None
+
+
+class EchoPipelineFactory(PipelineFactory):
+
+    def upstream_pipeline(self):
+        return [EchoHandler()]
+
+    def downstream_pipeline(self):
+        return [EchoHandler()]
+
+
+"""
+The SyslogAckHandler accumulates octet framed syslog traffic in a cyclic
+buffer of the given implementation, skips over every complete frame and writes
+back one acknowledgement byte per frame so that the load generator can time
+whole messages.
+"""
+
+
+class SyslogAckHandler(NetworkEventHandler):
+
+    def __init__(self, buffer_class):
+        self._accumulator = buffer_class(size_hint=4096)
+        self._lookaside = bytearray(16)
+        self._remaining = 0
+
+    def on_connect(self, message):
+        return (selection_events.REQUEST_READ, None)
+
+    def on_read(self, message):
+        accumulator = self._accumulator
+        accumulator.put(message)
+        completed = 0
+
+        while True:
+            if self._remaining == 0:
+                read = accumulator.get_until(_FRAME_DELIM, self._lookaside)
+                if read < 0:
+                    break
+                accumulator.skip(1)
+                self._remaining = int(self._lookaside[:read])
+            self._remaining -= accumulator.skip(self._remaining)
+            if self._remaining > 0:
+                break
+            completed += 1
+
+        if completed > 0:
+            return (selection_events.REQUEST_WRITE, _ACK * completed)
+
+    def on_write(self, message):
+        return None
+
+    def on_timeout(self, message):
+        return None
+
+
+class SyslogAckPipelineFactory(PipelineFactory):
+
+    def __init__(self, buffer_class):
+        self._buffer_class = buffer_class
+
+    def upstream_pipeline(self):
+        return [SyslogAckHandler(self._buffer_class)]
+
+    def downstream_pipeline(self):
+        return [SyslogAckHandler(self._buffer_class)]
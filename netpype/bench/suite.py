@@ -0,0 +1,188 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import netpype.env as env
+
+from netpype.bench import backends, load
+from netpype.channel import SocketINet4Address
+
+
+_LOG = env.get_logger('netpype.bench.suite')
+
+DEFAULT_PORT = 9400
+RESULTS_FORMAT = 1
+
+# Workloads whose server pipeline buffers with each buffer implementation
+_BUFFERED_WORKLOADS = ('syslog',)
+
+
+def _cases(workloads, selected_backends, buffers):
+    for workload_name, workload_class in workloads:
+        if workload_name in _BUFFERED_WORKLOADS:
+            case_buffers = buffers
+        else:
+            case_buffers = [(None, buffers[0][1])]
+        for buffer_name, buffer_class in case_buffers:
+            for backend_name, server_class in selected_backends:
+                yield (workload_class(), backend_name, server_class,
+                       buffer_name, buffer_class)
+
+
+def run_case(workload, server_class, buffer_class, port,
+             connections=load.DEFAULT_CONNECTIONS,
+             duration=load.DEFAULT_DURATION,
+             connect_duration=load.DEFAULT_CONNECT_DURATION,
+             **server_kwargs):
+    server = server_class(
+        SocketINet4Address('127.0.0.1', port),
+        workload.pipeline_factory(buffer_class),
+        **server_kwargs)
+    server.start()
+    try:
+        connections_per_sec = load.connection_rate(
+            port, workload, connect_duration)
+        messages, elapsed, latencies, cpu = load.throughput(
+            port, workload, connections, duration, server.pid())
+    finally:
+        server.interrupt()
+        if not server.join(5):
+            server.terminate()
+
+    result = {
+        'connections_per_sec': connections_per_sec,
+        'messages_per_sec': messages / elapsed,
+        'latency_p50_ms': None,
+        'latency_p99_ms': None,
+        'cpu_us_per_message': None,
+    }
+    if latencies:
+        result['latency_p50_ms'] = load.percentile(latencies, 0.5) * 1000
+        result['latency_p99_ms'] = load.percentile(latencies, 0.99) * 1000
+    if cpu is not None and messages > 0:
+        result['cpu_us_per_message'] = cpu * 1000000 / messages
+    return result
+
+
+def run(workloads=load.WORKLOADS, selected_backends=backends.BACKENDS,
+        buffers=backends.BUFFERS, port=DEFAULT_PORT, **kwargs):
+    """
+    Runs every workload against every backend, and every buffer
+    implementation for workloads that buffer, each on a fresh server.
+    """
+    results = list()
+    cases = _cases(workloads, selected_backends, buffers)
+    for offset, case in enumerate(cases):
+        workload, backend_name, server_class, buffer_name, buffer_class = case
+        _LOG.info('Running {} on {} with {} buffers.'.format(
+            workload.name, backend_name, buffer_name))
+        result = {
+            'workload': workload.name,
+            'backend': backend_name,
+            'buffer': buffer_name,
+        }
+        # A fresh port per case keeps lingering sockets out of the way
+        result.update(run_case(
+            workload, server_class, buffer_class, port + offset, **kwargs))
+        results.append(result)
+    return results
+
+
+def _key(result):
+    return (result['workload'], result['backend'], result['buffer'])
+
+
+def report(results, baseline=None, out=sys.stdout):
+    previous = dict()
+    if baseline:
+        previous = dict((_key(result), result)
+                        for result in baseline['results'])
+
+    out.write('{:<8} {:<9} {:<7} {:>10} {:>12} {:>8} {:>8} {:>9}\n'.format(
+        'workload', 'backend', 'buffer', 'conns/s', 'msgs/s',
+        'p50 ms', 'p99 ms', 'cpu us'))
+    for result in results:
+        line = '{:<8} {:<9} {:<7} {:>10.0f} {:>12.0f} {:>8} {:>8} {:>9}'.format(
+            result['workload'], result['backend'], result['buffer'] or '-',
+            result['connections_per_sec'], result['messages_per_sec'],
+            _format(result['latency_p50_ms']),
+            _format(result['latency_p99_ms']),
+            _format(result['cpu_us_per_message']))
+        before = previous.get(_key(result))
+        if before and before['messages_per_sec']:
+            change = (result['messages_per_sec'] /
+                      before['messages_per_sec'] - 1) * 100
+            line += ' {:+.1f}%'.format(change)
+        out.write(line + '\n')
+
+
+def _format(value):
+    return '-' if value is None else '{:.2f}'.format(value)
+
+
+def write_results(path, results, settings):
+    document = {
+        'format': RESULTS_FORMAT,
+        'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'settings': settings,
+        'results': results,
+    }
+    with open(path, 'w') as output:
+        json.dump(document, output, indent=2, sort_keys=True)
+
+
+def _names(value):
+    return [name for name in value.split(',') if name] if value else None
+
+
+def go(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m netpype.bench',
+        description='Loopback throughput and latency benchmarks.')
+    parser.add_argument('--workloads', help='comma separated workloads')
+    parser.add_argument('--backends', help='comma separated backends')
+    parser.add_argument('--buffers', help='comma separated buffers')
+    parser.add_argument('--connections', type=int,
+                        default=load.DEFAULT_CONNECTIONS)
+    parser.add_argument('--duration', type=float,
+                        default=load.DEFAULT_DURATION)
+    parser.add_argument('--connect-duration', type=float,
+                        default=load.DEFAULT_CONNECT_DURATION)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--zero-copy', action='store_true')
+    parser.add_argument('--output', help='write results as JSON to a file')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    args = parser.parse_args(argv)
+
+    settings = {
+        'connections': args.connections,
+        'duration': args.duration,
+        'connect_duration': args.connect_duration,
+        'zero_copy': args.zero_copy,
+    }
+    results = run(
+        workloads=backends.select(load.WORKLOADS, _names(args.workloads)),
+        selected_backends=backends.select(
+            backends.BACKENDS, _names(args.backends)),
+        buffers=backends.select(backends.BUFFERS, _names(args.buffers)),
+        port=args.port,
+        connections=args.connections,
+        duration=args.duration,
+        connect_duration=args.connect_duration,
+        zero_copy=args.zero_copy)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as previous:
+            baseline = json.load(previous)
+    report(results, baseline)
+    if args.output:
+        write_results(args.output, results, settings)
+
+
+if __name__ == '__main__':
+    go()
@@ -1,44 +1,240 @@
+import errno
+import os
 import socket
 import select
+import stat
+import sys
 import netpype.env as env
 
+from collections import deque
+from itertools import islice
+from netpype.dispatch import DispatchPool, PROCESS_POOL
+
 _LOG = env.get_logger('netpype.channel')
 
+# Seek results when no delimiter is found
+SEEK_NOT_FOUND = -1
+SEEK_LIMIT_REACHED = -2
+
+
+def _find_any(delims, source, start, end):
+    best = -1
+    for index in range(len(delims)):
+        if end <= start:
+            break
+        found = source.find(delims[index:index + 1], start, end)
+        if found >= 0:
+            best = end = found
+    return best
+
+
 try:
     from netpype.cutil import buffer_seek as seek
 except ImportError:
     _LOG.warn('Unable to find C extensions. Falling back on python impl.')
-    def seek(delim, source, size, read_index, available):
-        seek_offset = 0
-        seek_index = read_index
-        while seek_offset <= available:
-                if source[seek_index] == delim:
-                    return seek_offset
-        
-                if seek_index + 1 >= size:
-                    seek_index = 0
-                else:
-                    seek_index += 1
-                seek_offset += 1
-        return -1
+    def seek(delims, source, size, read_index, available, limit=-1):
+        scan = available
+        if 0 <= limit < available:
+            scan = limit
+        end = read_index + scan
+
+        found = _find_any(delims, source, read_index, min(end, size))
+        if found >= 0:
+            return found - read_index
+        if end > size:
+            found = _find_any(delims, source, 0, end - size)
+            if found >= 0:
+                return size - read_index + found
+        if 0 <= limit <= available:
+            return SEEK_LIMIT_REACHED
+        return SEEK_NOT_FOUND
+
+
+def _as_delims(delims):
+    if isinstance(delims, bytes):
+        return delims
+    if isinstance(delims, int):
+        return bytes(bytearray((delims,)))
+    return delims.encode('latin-1')
 
 _EMPTY_BUFFER = bytearray()
+_HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
 
 UNIX_SOCK = socket.AF_UNIX
 IPv4_SOCK = socket.AF_INET
 IPv6_SOCK = socket.AF_INET6
 
-
-def server_socket(socket_inet_addr):
+# Older Python builds do not export SO_REUSEPORT even though Linux has
+# supported it since 3.9
+if hasattr(socket, 'SO_REUSEPORT'):
+    SO_REUSEPORT = socket.SO_REUSEPORT
+elif sys.platform.startswith('linux'):
+    SO_REUSEPORT = 15
+else:
+    SO_REUSEPORT = None
+
+
+# Listener defaults
+DEFAULT_BACKLOG = socket.SOMAXCONN
+DEFAULT_ACCEPT_BATCH = 64
+
+# Upstream connection pool defaults
+DEFAULT_PIPELINING = 64
+DEFAULT_UPSTREAM_BACKLOG = 65536
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_MIN_BACKOFF = 0.1
+DEFAULT_MAX_BACKOFF = 30.0
+
+# Datagram defaults
+DEFAULT_DATAGRAM_BATCH = 32
+DEFAULT_MAX_DATAGRAM = 65535
+
+# Receive sizing defaults
+DEFAULT_RECV_SIZE = 1024
+DEFAULT_MIN_RECV_SIZE = 512
+DEFAULT_MAX_RECV_SIZE = 65536
+
+# Write queue watermarks
+DEFAULT_HIGH_WATERMARK = 65536
+DEFAULT_LOW_WATERMARK = 32768
+
+# Read side watermarks for the bytes a pipeline holds
+DEFAULT_READ_HIGH_WATERMARK = 1048576
+DEFAULT_READ_LOW_WATERMARK = 262144
+
+# Reasons for reads on a channel to be paused
+PAUSED_BY_WRITE_QUEUE = 1
+PAUSED_BY_DISPATCH = 2
+PAUSED_BY_READ_BUFFER = 4
+PAUSED_BY_MEMORY = 8
+PAUSE_REASONS = (PAUSED_BY_WRITE_QUEUE, PAUSED_BY_DISPATCH,
+                 PAUSED_BY_READ_BUFFER, PAUSED_BY_MEMORY)
+
+
+def server_socket(socket_inet_addr, reuse_port=False, rcvbuf=None,
+                  sndbuf=None, backlog=DEFAULT_BACKLOG):
     ssock = socket.socket(socket_inet_addr.type, socket.SOCK_STREAM)
     ssock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    ssock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-    ssock.bind((socket_inet_addr.address, socket_inet_addr.port))
+    if reuse_port:
+        if socket_inet_addr.type == UNIX_SOCK:
+            raise IOError('Unix sockets can not share their path.')
+        if SO_REUSEPORT is None:
+            raise IOError('SO_REUSEPORT is not supported on this platform.')
+        ssock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+    # Accepted sockets inherit these so they must be set before listen
+    if rcvbuf:
+        ssock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    if sndbuf:
+        ssock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    if socket_inet_addr.type != UNIX_SOCK:
+        ssock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    bind_socket(ssock, socket_inet_addr)
     ssock.setblocking(0)
-    ssock.listen(100)
+    ssock.listen(backlog)
     return ssock
 
 
+def datagram_socket(socket_inet_addr, reuse_port=False, rcvbuf=None,
+                    sndbuf=None):
+    dsock = socket.socket(socket_inet_addr.type, socket.SOCK_DGRAM)
+    dsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        if socket_inet_addr.type == UNIX_SOCK:
+            raise IOError('Unix sockets can not share their path.')
+        if SO_REUSEPORT is None:
+            raise IOError('SO_REUSEPORT is not supported on this platform.')
+        dsock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+    # Datagrams that arrive while the receive buffer is full are dropped
+    if rcvbuf:
+        dsock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    if sndbuf:
+        dsock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    bind_socket(dsock, socket_inet_addr)
+    dsock.setblocking(0)
+    return dsock
+
+
+def client_socket(socket_addr, rcvbuf=None, sndbuf=None):
+    """
+    Starts a non-blocking connect to socket_addr and returns the socket. The
+    connect is complete once the socket polls writable.
+    """
+    csock = socket.socket(socket_addr.type, socket.SOCK_STREAM)
+    if rcvbuf:
+        csock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    if sndbuf:
+        csock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    if socket_addr.type != UNIX_SOCK:
+        csock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        csock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    csock.setblocking(0)
+    error = csock.connect_ex(socket_addr.sockaddr())
+    if error not in (0, errno.EINPROGRESS):
+        csock.close()
+        raise IOError(error, os.strerror(error))
+    return csock
+
+
+def bind_socket(sock, socket_addr):
+    if socket_addr.type != UNIX_SOCK:
+        sock.bind(socket_addr.sockaddr())
+        return
+
+    path = socket_addr.address
+    if socket_addr.on_filesystem():
+        _remove_stale(path, sock.type)
+    sock.bind(path)
+    if socket_addr.mode is not None and socket_addr.on_filesystem():
+        os.chmod(path, socket_addr.mode)
+
+
+def _remove_stale(path, socket_type):
+    """
+    Removes a socket file left behind by a process that is gone. A socket
+    that still has a listener refuses to be replaced.
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except OSError as ose:
+        if ose.errno == errno.ENOENT:
+            return
+        raise
+    if not stat.S_ISSOCK(mode):
+        raise IOError(errno.EADDRINUSE,
+                      '{} exists and is not a socket.'.format(path))
+    probe = socket.socket(UNIX_SOCK, socket_type)
+    try:
+        probe.connect(path)
+    except socket.error as se:
+        if se.errno != errno.ECONNREFUSED:
+            raise
+        _LOG.info('Removing stale socket {}.'.format(path))
+        os.unlink(path)
+    else:
+        raise IOError(errno.EADDRINUSE,
+                      'Socket {} is in use.'.format(path))
+    finally:
+        probe.close()
+
+
+def close_socket(sock, socket_addr):
+    """
+    Closes a bound socket and removes the file of a unix socket.
+    """
+    sock.close()
+    if socket_addr.type == UNIX_SOCK and socket_addr.on_filesystem():
+        try:
+            os.unlink(socket_addr.address)
+        except OSError as ose:
+            if ose.errno != errno.ENOENT:
+                raise
+
+
 class SocketAddress(object):
 
     def __init__(self, type, address, port):
@@ -46,6 +242,9 @@ class SocketAddress(object):
         self.address = address
         self.port = port
 
+    def sockaddr(self):
+        return (self.address, self.port)
+
     def __repr__(self):
         return '{} socket {}:{}'.format(self.type, self.address, self.port)
 
@@ -62,21 +261,156 @@ class SocketINet6Address(SocketAddress):
         super(SocketINet6Address, self).__init__(IPv6_SOCK, address, port)
 
 
+"""
+A SocketUnixAddress is a unix domain socket path. It serves streams through
+the selector servers and datagrams through the datagram server, depending on
+which of them it is given to. A socket file left behind by a process that is
+gone is removed when binding and mode, when given, sets the permissions of
+the socket file. Paths that start with a NUL byte are in Linux's abstract
+namespace and have no file at all.
+"""
+
+
+class SocketUnixAddress(SocketAddress):
+
+    def __init__(self, path, mode=None):
+        super(SocketUnixAddress, self).__init__(UNIX_SOCK, path, None)
+        self.mode = mode
+
+    def sockaddr(self):
+        return self.address
+
+    def on_filesystem(self):
+        return not self.address.startswith('\0')
+
+    def __repr__(self):
+        return '{} socket {}'.format(self.type, self.address)
+
+
+# Handler methods by the pipeline their events run through
+_DOWNSTREAM_FUNCTIONS = ('on_connect', 'on_read', 'on_close', 'on_timeout')
+_UPSTREAM_FUNCTIONS = ('on_write',)
+
+
+def bind_handlers(pipeline, function):
+    """
+    Returns the bound methods that an event calls on a pipeline. Handlers
+    that leave the method as NetworkEventHandler defines it, or don't have
+    it at all, are left out.
+    """
+    default = getattr(NetworkEventHandler, function)
+    default = getattr(default, '__func__', default)
+    methods = list()
+    for handler in pipeline:
+        method = getattr(handler, function, None)
+        if method is None or getattr(method, '__func__', None) is default:
+            continue
+        methods.append(method)
+    return tuple(methods)
+
+
+"""
+A HandlerPipeline holds the upstream and downstream handlers of a channel
+along with the bound methods every event calls, by handler method name, which
+are looked up once when the channel is made. Changes to the handler lists
+after that are not seen by events.
+"""
+
+
 class HandlerPipeline(object):
 
     def __init__(self, pipeline_factory):
         self.upstream = pipeline_factory.upstream_pipeline()
         self.downstream = pipeline_factory.downstream_pipeline()
+        self.methods = dict()
+        for function in _DOWNSTREAM_FUNCTIONS:
+            self.methods[function] = bind_handlers(self.downstream, function)
+        for function in _UPSTREAM_FUNCTIONS:
+            self.methods[function] = bind_handlers(self.upstream, function)
+
+
+"""
+A ReceiveSizer decides how many bytes the next read on a channel asks for. The
+size doubles, up to the maximum, whenever a read fills the requested size and
+halves, down to the minimum, after two reads in a row that used less than half
+of it.
+"""
+
+
+class ReceiveSizer(object):
+
+    def __init__(self, initial=DEFAULT_RECV_SIZE,
+                 minimum=DEFAULT_MIN_RECV_SIZE,
+                 maximum=DEFAULT_MAX_RECV_SIZE):
+        if not minimum <= initial <= maximum:
+            raise ValueError(
+                'Receive size {} is not within {} and {}.'.format(
+                    initial, minimum, maximum))
+        self.size = initial
+        self._minimum = minimum
+        self._maximum = maximum
+        self._shrink_pending = False
+
+    def record(self, read):
+        if read >= self.size:
+            self._shrink_pending = False
+            if self.size < self._maximum:
+                self.size = min(self.size * 2, self._maximum)
+        elif read <= self.size // 2:
+            if self._shrink_pending:
+                self._shrink_pending = False
+                self.size = max(self.size // 2, self._minimum)
+            else:
+                self._shrink_pending = True
+        else:
+            self._shrink_pending = False
 
 
 class ChannelPipeline(object):
 
-    def __init__(self, channel, pipeline, client_addr):
+    def __init__(self, channel, pipeline, client_addr, recv_sizer=None,
+                 write_buffer=None):
         self.channel = channel
         self.fileno = channel.fileno()
         self.client_addr = client_addr
         self.pipeline = pipeline
-        self.write_buffer = ChannelBuffer()
+        self.recv_sizer = recv_sizer or ReceiveSizer()
+        self.write_buffer = write_buffer or ChannelBuffer()
+        self.read_buffer = NativeCyclicBuffer(self.recv_sizer.size)
+        # What the last zero copy read handed to the pipeline is a view over
+        self.read_source = None
+        self.read_interest = False
+        self.write_interest = False
+        self.read_paused = 0
+        self.event_mask = 0
+        self.dispatch_backlog = 0
+        # Tasks submitted to the dispatch pool that have yet to complete
+        self.dispatched = 0
+        self.last_read = 0
+        self.last_write = 0
+        self.idle_timer = None
+        self.read_timer = None
+        self.write_timer = None
+        self.timers = set()
+        # Outbound channels are connecting until they first poll writable
+        self.connecting = False
+        self.pool = None
+        # Handlers that hold on to bytes say how many through buffered()
+        self.read_gauges = [handler.buffered for handler in pipeline.downstream
+                            if hasattr(handler, 'buffered')]
+        self.buffered = 0
+
+    def reading(self):
+        return self.read_interest and not self.read_paused
+
+    def pause_reads(self, reason):
+        self.read_paused |= reason
+
+    def resume_reads(self, reason):
+        self.read_paused &= ~reason
+
+    def paused_by(self, reason):
+        return self.read_paused & reason != 0
 
 
 def array_copy(source, src_offset, destination, dest_offset, length):
@@ -98,16 +432,16 @@ class CyclicBuffer(object):
             self._current_size = size_hint
             self.clear()
 
-    def skip_until(self, delim, limit=-1):
-        seek_offset = seek(ord(delim), self._buffer, 
-            self._current_size, self._read_index, self._available)
+    def skip_until(self, delims, limit=-1):
+        seek_offset = seek(_as_delims(delims), self._buffer,
+            self._current_size, self._read_index, self._available, limit)
         if seek_offset > 0:
             return self.skip(seek_offset)
         return seek_offset
 
-    def get_until(self, delim, data, offset=0, limit=-1):
-        seek_offset = seek(ord(delim), self._buffer, 
-            self._current_size, self._read_index, self._available)
+    def get_until(self, delims, data, offset=0, limit=-1):
+        seek_offset = seek(_as_delims(delims), self._buffer,
+            self._current_size, self._read_index, self._available, limit)
         if seek_offset > 0:
             return self.get(data, offset, seek_offset)
         return seek_offset
@@ -171,8 +505,8 @@ class CyclicBuffer(object):
                 if self._read_index + length < self._current_size:
                     self._read_index += length
                 else:
-                    self._read_index = length - self._current_size
-                    self._read_index -= self._read_index
+                    self._read_index = length - (
+                        self._current_size - self._read_index)
             self._available -= bytes_skipped
         return bytes_skipped
 
@@ -185,6 +519,7 @@ class CyclicBuffer(object):
         self._current_size = new_size
         self._read_index = 0
         self._write_index = read
+        self._available = read
 
     def available(self):
         return self._available
@@ -192,6 +527,45 @@ class CyclicBuffer(object):
     def remaining(self):
         return self._current_size - self._available
 
+    def writable_view(self, min_length=1):
+        """
+        Returns a memoryview over the contiguous free space that follows the
+        write index, growing the buffer until that space is at least
+        min_length bytes long. Bytes written into the view are made readable
+        by calling commit.
+        """
+        if self._available == 0:
+            self.clear()
+        if self._contiguous_writable() < min_length:
+            self.grow(min_length)
+        return memoryview(self._buffer)[
+            self._write_index:
+            self._write_index + self._contiguous_writable()]
+
+    def commit(self, length):
+        self._write_index += length
+        if self._write_index >= self._current_size:
+            self._write_index -= self._current_size
+        self._available += length
+
+    def readable_view(self):
+        """
+        Returns a memoryview over the contiguous readable bytes that follow
+        the read index. When the readable bytes wrap around the end of the
+        buffer only the bytes up to the end are covered.
+        """
+        readable = min(self._available,
+                       self._current_size - self._read_index)
+        return memoryview(self._buffer)[
+            self._read_index:self._read_index + readable]
+
+    def _contiguous_writable(self):
+        if self._available == self._current_size:
+            return 0
+        if self._write_index >= self._read_index:
+            return self._current_size - self._write_index
+        return self._read_index - self._write_index
+
     def __repr__(self):
         readable = self._available
         data = bytearray(readable)        
@@ -213,33 +587,93 @@ class CyclicBuffer(object):
         self._available = 0
 
 
+try:
+    from netpype.cutil import CyclicBuffer as NativeCyclicBuffer
+except ImportError:
+    NativeCyclicBuffer = CyclicBuffer
+
+
 """
-This is a simple read buffer idiom to prevent buffer manipulation operations
-while reading data.
+A ChannelBuffer queues the buffers waiting to be written to a channel. The
+queued buffers are held as memoryviews so that partial sends only move an
+offset instead of copying the unsent tail, and the whole queue can be handed to
+a single gather send.
+
+Once the queued bytes reach the high watermark the channel is considered
+backed up and stays that way until the queue drains down to the low watermark.
 """
 
 
 class ChannelBuffer(object):
 
-    def __init__(self, initial_buffer=b''):
+    def __init__(self, initial_buffer=b'',
+                 high_watermark=DEFAULT_HIGH_WATERMARK,
+                 low_watermark=DEFAULT_LOW_WATERMARK):
+        if low_watermark > high_watermark:
+            raise ValueError(
+                'Low watermark {} is above the high watermark {}.'.format(
+                    low_watermark, high_watermark))
+        self._buffers = deque()
+        self._size = 0
+        self._high_watermark = high_watermark
+        self._low_watermark = low_watermark
         self.set_buffer(initial_buffer)
 
     def set_buffer(self, new_buffer):
-        self._buffer = new_buffer
-        self._position = 0
-        self._size = len(new_buffer)
+        self.clear()
+        self.put(new_buffer)
+
+    def put(self, new_buffer):
+        length = len(new_buffer)
+        if length > 0:
+            self._buffers.append(memoryview(new_buffer))
+            self._size += length
+
+    def clear(self):
+        self._buffers.clear()
+        self._size = 0
 
     def size(self):
         return self._size
 
     def empty(self):
-        return self._position >= self._size
+        return self._size == 0
+
+    def above_high_watermark(self):
+        return self._size >= self._high_watermark
+
+    def below_low_watermark(self):
+        return self._size <= self._low_watermark
 
     def remaining(self):
-        return self._buffer[self._position:]
+        if self._buffers:
+            return self._buffers[0]
+        return memoryview(_EMPTY_BUFFER)
+
+    def buffers(self, limit=IOV_MAX):
+        return list(islice(self._buffers, limit))
 
     def sent(self, bytes_read):
-        self._position += bytes_read
+        self._size -= bytes_read
+        while bytes_read > 0:
+            head = self._buffers[0]
+            if len(head) > bytes_read:
+                self._buffers[0] = head[bytes_read:]
+                break
+            bytes_read -= len(head)
+            self._buffers.popleft()
+
+    def send(self, channel):
+        """
+        Sends as much of the queue as the channel takes in one call. Several
+        queued buffers are gathered into a single sendmsg where supported.
+        """
+        if len(self._buffers) > 1 and _HAS_SENDMSG:
+            sent = channel.sendmsg(self.buffers())
+        else:
+            sent = channel.send(self.remaining())
+        self.sent(sent)
+        return sent
 
 
 """
@@ -258,6 +692,71 @@ class PipelineFactory(object):
     def downstream_pipeline(self):
         raise NotImplementedError
 
+    """
+    Builds the netpype.dispatch.DispatchPool that DISPATCH payloads from this
+    factory's pipelines are handed to. This is called once, from within the
+    server process, the first time a pipeline dispatches. Override this to
+    choose between a process and a thread pool or to size the pool.
+    """
+    def dispatch_pool(self):
+        return DispatchPool(PROCESS_POOL)
+
+    """
+    Names the upstreams that pipelines from this factory send to with
+    netpype.selector.SEND_UPSTREAM as a dict of names to Upstream objects.
+    This is called once, from within the server process, when it starts.
+    """
+    def upstreams(self):
+        return dict()
+
+
+"""
+An Upstream describes a remote address that the server keeps a pool of
+outbound connections to. Connections are opened as messages need them, up to
+the given number, and are kept open and reused. A connection takes up to
+pipelining messages before its writes have drained, after which messages go to
+another connection or wait in the pool's backlog. The backlog holds at most
+backlog messages and drops its oldest ones beyond that.
+
+A failed connection is retried after a backoff that starts at min_backoff and
+doubles, up to max_backoff, for every failure in a row. With keepalive set,
+connections that have not written for that many seconds are closed.
+
+The pipelines of the pool's connections are built by pipeline_factory, which
+by default builds pipelines that ignore whatever the upstream sends.
+"""
+
+
+class Upstream(object):
+
+    def __init__(self, socket_addr, pipeline_factory=None, connections=1,
+                 pipelining=DEFAULT_PIPELINING,
+                 backlog=DEFAULT_UPSTREAM_BACKLOG,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 min_backoff=DEFAULT_MIN_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF, keepalive=None,
+                 rcvbuf=None, sndbuf=None):
+        if connections < 1 or pipelining < 1 or backlog < 1:
+            raise ValueError('Upstreams need at least one connection, '
+                             'message in flight and backlog entry.')
+        if not 0 < min_backoff <= max_backoff:
+            raise ValueError('Backoff must be positive and at most {}.'.format(
+                max_backoff))
+        self.socket_addr = socket_addr
+        self.pipeline_factory = pipeline_factory
+        self.connections = connections
+        self.pipelining = pipelining
+        self.backlog = backlog
+        self.connect_timeout = connect_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.keepalive = keepalive
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
+
+    def __repr__(self):
+        return 'Upstream {}'.format(self.socket_addr)
+
 
 """
 A NetworkEventHandler is a pipeline object that will both send and recieve
@@ -269,6 +768,31 @@ that the method will either return None or return a tuple containing an event
 signal and, if present, a message payload. There is also the expectation that
 the evente methods will return in a timely fashion, otherwise the handler risks
 holding up the I/O polling loop.
+
+A netpype.selector.REQUEST_WRITE queues its message behind any writes that have
+not been sent yet. Reading carries on while the queue drains unless the queue
+backs up past its high watermark, and the pipeline receives a write event once
+the queue is empty.
+
+A netpype.selector.DISPATCH hands its message, a tuple of a function and the
+message to call it with, to the pipeline factory's dispatch pool so that slow
+work runs away from the I/O loop. The function returns what a handler method
+would and its result is acted upon for the channel once the pool is done.
+
+A netpype.selector.SCHEDULE_TIMER takes a tuple of a delay in seconds and a
+message. Once the delay has passed the pipeline receives a timeout event with
+that message, unless the channel has closed by then.
+
+A netpype.selector.SEND_UPSTREAM takes a tuple of the name of one of the
+pipeline factory's upstreams and a message, which is written to a pooled
+connection to that upstream without leaving the polling loop.
+
+A handler that holds on to bytes between reads, such as a lexer with a partial
+message, may define a buffered method that returns how many it holds. After
+every event the server sums these for the channel and stops reading from it
+once they pass its read high watermark, until an event finds them at or below
+the read low watermark. The high watermark must be above the largest message a
+handler would hold while waiting for the rest of it.
 """
 
 
@@ -314,6 +838,13 @@ class NetworkEventHandler(object):
     will be a buffer containing the, otherwise the message may be of any type
     and should be interpreted by the handler.
 
+    When the server reads with zero copy enabled, the buffer given by the
+    source is a memoryview over the channel's read buffer. The view is only
+    valid until on_read returns so handlers must copy anything they keep.
+    Views returned as the message of netpype.selector.REQUEST_WRITE,
+    netpype.selector.DISPATCH, netpype.selector.SCHEDULE_TIMER or
+    netpype.selector.SEND_UPSTREAM are copied by the server.
+
     A handler may forward an event to the following handler by returning using
     the netpype.selector.FORWARD signal. The argument is passed to the next
     handler as its message.
@@ -350,3 +881,27 @@ class NetworkEventHandler(object):
     """
     def on_write(self, message):
         return REQUEST_CLOSE, None
+
+    """
+    A NetworkEventHandler may recieve an event describing that a deadline on
+    the channel has passed. The message argument of this method is either one
+    of netpype.selector.IDLE_TIMEOUT, netpype.selector.READ_TIMEOUT and
+    netpype.selector.WRITE_TIMEOUT for the deadlines the server was configured
+    with, or the message of a timer the pipeline scheduled itself.
+
+    Server deadlines keep firing, once per period, for as long as the channel
+    stays idle, unread or backed up. When no handler in the pipeline defines
+    this method the server closes the channel at its first deadline instead.
+
+    A handler may forward an event to the following handler by returning using
+    the netpype.selector.FORWARD signal. The argument is passed to the next
+    handler as its message.
+
+    The following socket events are allowed:
+        * netpype.selector.REQUEST_WRITE
+        * netpype.selector.REQUEST_READ
+        * netpype.selector.REQUEST_CLOSE
+        * netpype.selector.SCHEDULE_TIMER
+    """
+    def on_timeout(self, message):
+        return None
@@ -0,0 +1,177 @@
+import errno
+import fcntl
+import os
+import socket
+
+from multiprocessing import reduction
+from multiprocessing.sharedctypes import RawArray
+
+
+# Process states
+STATE_NEW = 0
+STATE_RUNNING = 1
+STATE_STOPPED = 2
+STATE_DRAINING = 3
+
+# Supervisor requests
+REQUEST_NONE = 0
+REQUEST_STOP = 1
+REQUEST_DRAIN = 2
+
+# Control words
+STATE = 0
+HEARTBEAT = 1
+GENERATION = 2
+PID = 3
+ITERATIONS = 4
+DRAIN_DEADLINE = 5
+HANDOFF = 6
+REQUEST = 7
+_CONTROL_WORDS = 8
+
+DEFAULT_STATS_SLOTS = 8
+# Seconds a worker may sit in a poll before it beats again
+DEFAULT_HEARTBEAT_INTERVAL = 1.0
+# Seconds a draining worker has to finish its channels
+DEFAULT_DRAIN_TIMEOUT = 30.0
+# Seconds a supervisor waits for a worker to hand off its listener
+DEFAULT_HANDOFF_TIMEOUT = 5.0
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK)
+
+
+def _nonblocking(fileno):
+    flags = fcntl.fcntl(fileno, fcntl.F_GETFL)
+    fcntl.fcntl(fileno, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+"""
+A ControlBlock is the memory a supervisor shares with one worker process. The
+worker writes its state, the time of its last heartbeat in microseconds, its
+pid, a count of its loop iterations and a few stats slots it may publish
+numbers in. The supervisor writes its latest request, a reload generation and
+the deadline of a drain, and sets the state only before the worker starts.
+Every word has one writer and words are aligned 64 bit integers, so neither
+side needs a lock.
+
+A stop, drain or reload request is written to the block and then signalled
+through a pipe whose read end the worker polls alongside its sockets, so that
+a worker blocked in a poll wakes up straight away. The worker acts on it by
+changing its own state. A draining worker that is asked to hand off sends its
+listening socket to the supervisor over a unix socket pair before it stops
+accepting.
+"""
+
+
+class ControlBlock(object):
+
+    def __init__(self, stats_slots=DEFAULT_STATS_SLOTS):
+        self.words = RawArray('q', _CONTROL_WORDS)
+        self.stats = RawArray('q', stats_slots)
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        _nonblocking(self._wakeup_read)
+        _nonblocking(self._wakeup_write)
+        self._handoff = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    def state(self):
+        return self.words[STATE]
+
+    def set_state(self, state):
+        self.words[STATE] = state
+
+    def request(self):
+        return self.words[REQUEST]
+
+    def generation(self):
+        return self.words[GENERATION]
+
+    def heartbeat(self):
+        """
+        Returns the time of the worker's last heartbeat in seconds, or None
+        before its first.
+        """
+        beat = self.words[HEARTBEAT]
+        return beat / 1e6 if beat else None
+
+    def beat(self, now):
+        self.words[HEARTBEAT] = int(now * 1e6)
+
+    def pid(self):
+        return self.words[PID] or None
+
+    def wakeup_fileno(self):
+        return self._wakeup_read
+
+    def request_stop(self):
+        self.words[REQUEST] = REQUEST_STOP
+        self.wake()
+
+    def request_reload(self):
+        self.words[GENERATION] += 1
+        self.wake()
+
+    def request_drain(self, deadline, handoff=False):
+        # A stop that was asked for already wins
+        if self.words[REQUEST] == REQUEST_STOP:
+            return
+        self.words[DRAIN_DEADLINE] = int(deadline * 1e6)
+        self.words[HANDOFF] = 1 if handoff else 0
+        self.words[REQUEST] = REQUEST_DRAIN
+        self.wake()
+
+    def drain_deadline(self):
+        return self.words[DRAIN_DEADLINE] / 1e6
+
+    def handing_off(self):
+        return self.words[HANDOFF] == 1
+
+    def send_listener(self, listener):
+        reduction.sendfds(self._handoff[1], [listener.fileno()])
+
+    def receive_listener(self, timeout=DEFAULT_HANDOFF_TIMEOUT):
+        """
+        Returns the listening socket sent by the worker. Raises IOError when
+        none arrives within timeout seconds.
+        """
+        receiver = self._handoff[0]
+        receiver.settimeout(timeout)
+        try:
+            fileno = reduction.recvfds(receiver, 1)[0]
+        except (EOFError, RuntimeError) as ex:
+            raise IOError('No listener received: {}'.format(ex))
+        return socket.socket(fileno=fileno)
+
+    def wake(self):
+        if self._wakeup_write is None:
+            # Closed along with a worker that has exited
+            return
+        try:
+            os.write(self._wakeup_write, b'\0')
+        except OSError as ose:
+            # A full pipe will wake the worker all the same
+            if ose.errno not in _WOULD_BLOCK:
+                raise
+
+    def clear_wakeups(self):
+        try:
+            while os.read(self._wakeup_read, 4096):
+                pass
+        except OSError as ose:
+            if ose.errno not in _WOULD_BLOCK:
+                raise
+
+    def close(self):
+        """
+        Closes the pipe and socket pair of the block. The shared words stay
+        readable.
+        """
+        for fileno in (self._wakeup_read, self._wakeup_write):
+            if fileno is None:
+                continue
+            try:
+                os.close(fileno)
+            except OSError:
+                pass
+        self._wakeup_read = self._wakeup_write = None
+        for end in self._handoff:
+            end.close()
@@ -1,15 +1,20 @@
 from libc.stdlib cimport realloc, malloc, free, atoi
+from libc.string cimport memchr, memcpy
 from cpython cimport bool
+from cpython cimport array as carray
+from cpython.object cimport Py_SIZE
 from cython import array
+from netpype.cutil cimport c_find_any
 
 cdef extern from "Python.h":
     char* PyByteArray_AsString(object bytearray) except NULL
     char* PyByteArray_AS_STRING(object bytearray) except NULL
-    object PyString_FromStringAndSize(char *string, Py_ssize_t length)
+    object PyBytes_FromStringAndSize(char *string, Py_ssize_t length)
     object PyByteArray_FromStringAndSize(char *string, Py_ssize_t length)
     int PyByteArray_Check(object bytearray)
     int PyByteArray_Size(object bytearray)
     int PyByteArray_GET_SIZE(object bytearray)
+    int PyByteArray_Resize(object bytearray, Py_ssize_t length) except -1
 
 
 NO_TOKENS = 0
@@ -26,6 +31,10 @@ SDE_FIELD_VALUE_TOKEN = 10
 MESSAGE_PART_TOKEN = 11
 
 
+class SyslogFramingError(Exception):
+    pass
+
+
 class SyslogMessageAccumulator(object):
 
     def on_message_part(self, message_part):
@@ -43,6 +52,7 @@ class SyslogMessageHead(object):
         self.processid = ''
         self.messageid = ''
         self.sd = dict()
+        self.message = ''
 
     def get_sd(self, name):
         return self.sd.get(name)
@@ -152,7 +162,7 @@ cdef class SyslogLexer(object):
     cpdef get_token(self):
         cdef object next_token
         # Export the token info
-        next_token = PyString_FromStringAndSize(self.token_buffer, self.token_length)
+        next_token = PyBytes_FromStringAndSize(self.token_buffer, self.token_length)
         # Reset the local token info
         self.token_length = 0
         # Return the token
@@ -291,3 +301,584 @@ cdef class SyslogLexer(object):
         if done_reading_message:
             self.current_state = OCTET
 
+
+# Octet counts of valid frames never run past this many digits
+cdef int MAX_OCTET_DIGITS = 9
+
+cdef bytes SD_NAME_DELIMS = b' ]'
+
+# Non-transparent frames end with a LF, or a NUL with some senders
+cdef bytes LINE_DELIMS = b'\n\0'
+
+# RFC 3164 tags end at most 32 bytes in, usually on a colon or a pid
+cdef bytes TAG_DELIMS = b':[ '
+cdef int MAX_TAG_LENGTH = 32
+
+# The Mmm dd hh:mm:ss timestamp of RFC 3164
+cdef int BSD_TIMESTAMP_LENGTH = 15
+
+cdef enum:
+    C_FRAMING_AUTO = 0
+    C_FRAMING_OCTET_COUNTED = 1
+    C_FRAMING_NON_TRANSPARENT = 2
+
+# Stream framings, RFC 6587
+FRAMING_AUTO = C_FRAMING_AUTO
+FRAMING_OCTET_COUNTED = C_FRAMING_OCTET_COUNTED
+FRAMING_NON_TRANSPARENT = C_FRAMING_NON_TRANSPARENT
+
+# Batch layout, see netpype.batch
+cdef int BATCH_FIELD_COUNT = 8
+cdef int BATCH_ELEMENT_WIDTH = 4
+cdef int BATCH_SD_FIELD_WIDTH = 4
+
+
+cdef int octet_count(const char *digits, Py_ssize_t length) except -1:
+    cdef int count = 0
+    cdef Py_ssize_t index
+
+    if length == 0 or length > MAX_OCTET_DIGITS:
+        raise SyslogFramingError('Bad octet count length: {}.'.format(length))
+    for index in range(length):
+        if digits[index] < c'0' or digits[index] > c'9':
+            raise SyslogFramingError('Bad octet count: {!r}.'.format(
+                digits[:length]))
+        count = count * 10 + (digits[index] - c'0')
+    if count == 0 or count > MAX_BYTES:
+        raise SyslogFramingError('Bad frame length: {}.'.format(count))
+    return count
+
+
+cdef int append_ints(carray.array target, int *values,
+                     Py_ssize_t count) except -1:
+    cdef Py_ssize_t size = Py_SIZE(target)
+    carray.resize_smart(target, size + count)
+    memcpy(target.data.as_ints + size, values, sizeof(int) * count)
+    return 0
+
+
+cdef int truncate_ints(carray.array target, Py_ssize_t size) except -1:
+    carray.resize(target, size)
+    return 0
+
+
+cdef inline bint is_digit(char value):
+    return c'0' <= value <= c'9'
+
+
+cdef bint is_bsd_timestamp(const char *data):
+    return (c'A' <= data[0] <= c'Z' and c'a' <= data[1] <= c'z' and
+            c'a' <= data[2] <= c'z' and data[3] == SPACE and
+            (data[4] == SPACE or is_digit(data[4])) and is_digit(data[5]) and
+            data[6] == SPACE and is_digit(data[7]) and is_digit(data[8]) and
+            data[9] == c':' and is_digit(data[10]) and is_digit(data[11]) and
+            data[12] == c':' and is_digit(data[13]) and is_digit(data[14]))
+
+
+cdef object field_bytes(const char *frame, Py_ssize_t start, Py_ssize_t end):
+    if start < 0:
+        return None
+    return frame[start:end]
+
+
+cdef Py_ssize_t find(const char *data, char delim, Py_ssize_t start,
+                     Py_ssize_t end):
+    cdef const char *found
+    if start >= end:
+        return -1
+    found = <const char*> memchr(data + start, delim, end - start)
+    if found == NULL:
+        return -1
+    return found - data
+
+
+cdef Py_ssize_t find_closing_quote(const char *data, Py_ssize_t start,
+                                   Py_ssize_t end):
+    # Quotes escaped by an odd number of backslashes are part of the value
+    cdef Py_ssize_t quote, escape
+    while True:
+        quote = find(data, QUOTE, start, end)
+        if quote < 0:
+            return -1
+        escape = quote
+        while escape > start and data[escape - 1] == c'\\':
+            escape -= 1
+        if (quote - escape) % 2 == 0:
+            return quote
+        start = quote + 1
+
+
+"""
+A SyslogBulkParser parses syslog streams a whole read at a time. Frame and
+field boundaries are found by scanning the read with memchr rather than by
+stepping a lexer through every byte, and every call returns the messages that
+the read completed.
+
+Streams are either octet counted or non-transparent, with every frame ending
+in a LF, as RFC 6587 describes. Unless a framing is given it is detected from
+the first byte of the stream: octet counts start with a digit and
+non-transparent frames with the < of a priority. Each frame is then read as
+RFC 5424 when its priority is followed by a version, and as BSD syslog, RFC
+3164, otherwise. BSD messages have no version, message id or structured data;
+their tag is the app name and the pid in its brackets the process id. Fields a
+frame does not have are None.
+
+A frame that a read ends in the middle of is copied aside and finished by the
+following reads. Frames that are not well formed are skipped and counted in
+malformed, while a bad octet count raises a SyslogFramingError since the
+stream can not be resynchronized after it.
+
+Datagrams, which hold a single message each and no framing, are parsed with
+parse_datagram instead.
+
+Structured data values are kept as sent, escapes included. Messages are
+returned as SyslogMessageHead objects by parse, or appended to a
+netpype.batch.SyslogBatch by parse_into, which copies each frame into the
+batch's arena once and records where its fields are.
+"""
+cdef class SyslogBulkParser(object):
+
+    cdef char *_pending
+    cdef Py_ssize_t _pending_size, _pending_length
+    cdef int _frame_length
+    cdef int _framing, _configured_framing
+    cdef object _batch
+    cdef carray.array _batch_elements, _batch_sd_fields
+    cdef public long malformed
+
+    def __cinit__(self, int size_hint=RFC5424_MAX_BYTES,
+                  int framing=C_FRAMING_AUTO):
+        self._pending = <char*> malloc(sizeof(char) * size_hint)
+        if self._pending is NULL:
+            raise MemoryError()
+        self._pending_size = size_hint
+        self._configured_framing = framing
+        self.malformed = 0
+        self.reset()
+
+    def __dealloc__(self):
+        if self._pending is not NULL:
+            free(self._pending)
+
+    def reset(self):
+        self._pending_length = 0
+        self._frame_length = -1
+        self._framing = self._configured_framing
+
+    def pending(self):
+        return self._pending_length
+
+    def framing(self):
+        return self._framing
+
+    def parse(self, data, Py_ssize_t length=-1):
+        cdef const unsigned char[::1] view = data
+        cdef list messages = list()
+
+        if length < 0 or length > view.shape[0]:
+            length = view.shape[0]
+        if length > 0:
+            self._parse(<const char*> &view[0], length, messages)
+        return messages
+
+    def parse_into(self, batch, data, Py_ssize_t length=-1):
+        return self._parse_into(batch, self.parse, data, length)
+
+    def parse_datagram(self, data, Py_ssize_t length=-1):
+        """
+        Parses one datagram as a single frame, as RFC 5426 carries syslog over
+        UDP, leaving the stream state alone. A trailing LF or NUL is dropped.
+        """
+        cdef const unsigned char[::1] view = data
+        cdef list messages = list()
+
+        if length < 0 or length > view.shape[0]:
+            length = view.shape[0]
+        while length > 0 and (view[length - 1] == c'\n' or
+                              view[length - 1] == 0):
+            length -= 1
+        if length > 0:
+            self._line(<const char*> &view[0], length, messages)
+        return messages
+
+    def parse_datagram_into(self, batch, data, Py_ssize_t length=-1):
+        return self._parse_into(batch, self.parse_datagram, data, length)
+
+    cdef _parse_into(self, batch, parse, data, Py_ssize_t length):
+        count = len(batch)
+        self._batch = batch
+        self._batch_elements = batch._sd_elements
+        self._batch_sd_fields = batch._sd_fields
+        try:
+            parse(data, length)
+        finally:
+            self._batch = None
+            self._batch_elements = None
+            self._batch_sd_fields = None
+        return len(batch) - count
+
+    cdef int _parse(self, const char *data, Py_ssize_t length,
+                    list messages) except -1:
+        cdef Py_ssize_t position = 0
+        cdef Py_ssize_t space, start
+        cdef int frame_length
+
+        if self._framing == C_FRAMING_AUTO:
+            if is_digit(data[0]):
+                self._framing = C_FRAMING_OCTET_COUNTED
+            elif data[0] == OPEN_ANGLE_BRACKET:
+                self._framing = C_FRAMING_NON_TRANSPARENT
+            else:
+                raise SyslogFramingError('Unknown framing: {!r}.'.format(
+                    data[:min(length, 16)]))
+        if self._framing == C_FRAMING_NON_TRANSPARENT:
+            return self._parse_lines(data, length, messages)
+
+        if self._pending_length > 0 or self._frame_length >= 0:
+            position = self._resume(data, length, messages)
+
+        while position < length:
+            space = find(data, SPACE, position,
+                         min(length, position + MAX_OCTET_DIGITS + 1))
+            if space < 0:
+                if length - position > MAX_OCTET_DIGITS:
+                    raise SyslogFramingError('Missing octet count.')
+                self._hold(data + position, length - position)
+                break
+
+            frame_length = octet_count(data + position, space - position)
+            start = space + 1
+            if length - start < frame_length:
+                self._frame_length = frame_length
+                self._hold(data + start, length - start)
+                break
+            self._frame(data + start, frame_length, messages)
+            position = start + frame_length
+        return 0
+
+    cdef int _parse_lines(self, const char *data, Py_ssize_t length,
+                          list messages) except -1:
+        cdef Py_ssize_t position = 0
+        cdef Py_ssize_t end, frame_length
+
+        if self._pending_length > 0:
+            end = c_find_any(LINE_DELIMS, 2, data, 0, length)
+            if end < 0:
+                self._hold_line(data, length)
+                return 0
+            self._hold_line(data, end)
+            frame_length = self._pending_length
+            self._pending_length = 0
+            self._line(self._pending, frame_length, messages)
+            position = end + 1
+
+        while position < length:
+            end = c_find_any(LINE_DELIMS, 2, data, position, length)
+            if end < 0:
+                self._hold_line(data + position, length - position)
+                break
+            self._line(data + position, end - position, messages)
+            position = end + 1
+        return 0
+
+    cdef int _hold_line(self, const char *data, Py_ssize_t length) except -1:
+        if self._pending_length + length > MAX_BYTES:
+            raise SyslogFramingError('Missing frame trailer.')
+        return self._hold(data, length)
+
+    cdef int _line(self, const char *frame, Py_ssize_t length,
+                   list messages) except -1:
+        if length > 0 and frame[length - 1] == c'\r':
+            length -= 1
+        # Blank lines between frames are not messages
+        if length > 0:
+            self._frame(frame, length, messages)
+        return 0
+
+    cdef Py_ssize_t _resume(self, const char *data, Py_ssize_t length,
+                            list messages) except -1:
+        cdef Py_ssize_t position = 0
+        cdef Py_ssize_t needed, space
+        cdef int frame_length
+
+        if self._frame_length < 0:
+            # The octet count itself was split
+            needed = MAX_OCTET_DIGITS + 1 - self._pending_length
+            space = find(data, SPACE, 0, min(length, needed))
+            if space < 0:
+                if length >= needed:
+                    raise SyslogFramingError('Missing octet count.')
+                self._hold(data, length)
+                return length
+            self._hold(data, space)
+            self._frame_length = octet_count(
+                self._pending, self._pending_length)
+            self._pending_length = 0
+            position = space + 1
+
+        needed = self._frame_length - self._pending_length
+        if length - position < needed:
+            self._hold(data + position, length - position)
+            return length
+
+        self._hold(data + position, needed)
+        frame_length = self._frame_length
+        self._frame_length = -1
+        self._pending_length = 0
+        self._frame(self._pending, frame_length, messages)
+        return position + needed
+
+    cdef int _hold(self, const char *data, Py_ssize_t length) except -1:
+        cdef Py_ssize_t needed = self._pending_length + length
+        cdef Py_ssize_t new_size = self._pending_size
+        cdef char *new_pending
+
+        if needed > self._pending_size:
+            while new_size < needed:
+                new_size *= 2
+            new_pending = <char*> realloc(self._pending, new_size)
+            if new_pending is NULL:
+                raise MemoryError()
+            self._pending = new_pending
+            self._pending_size = new_size
+        memcpy(self._pending + self._pending_length, data, length)
+        self._pending_length = needed
+        return 0
+
+    cdef int _frame(self, const char *frame, Py_ssize_t length,
+                    list messages) except -1:
+        cdef Py_ssize_t starts[8]
+        cdef Py_ssize_t ends[8]
+        cdef Py_ssize_t position, version_end
+
+        if length < 1 or frame[0] != OPEN_ANGLE_BRACKET:
+            self.malformed += 1
+            return 0
+        ends[0] = find(frame, CLOSE_ANGLE_BRACKET, 1, min(length, 5))
+        if ends[0] < 0:
+            self.malformed += 1
+            return 0
+        starts[0] = 1
+        position = ends[0] + 1
+
+        # RFC 5424 versions are one to two digits
+        version_end = find(frame, SPACE, position, min(length, position + 3))
+        if version_end > position and is_digit(frame[position]) and (
+                version_end == position + 1 or is_digit(frame[position + 1])):
+            return self._rfc5424(frame, length, position, starts, ends,
+                                 messages)
+        return self._rfc3164(frame, length, position, starts, ends, messages)
+
+    cdef int _rfc3164(self, const char *frame, Py_ssize_t length,
+                      Py_ssize_t position, Py_ssize_t *starts,
+                      Py_ssize_t *ends, list messages) except -1:
+        cdef Py_ssize_t end, close
+        cdef int field
+
+        for field in range(1, 8):
+            starts[field] = -1
+            ends[field] = -1
+
+        # Without a timestamp everything after the priority is the message
+        if (length - position > BSD_TIMESTAMP_LENGTH and
+                is_bsd_timestamp(frame + position) and
+                frame[position + BSD_TIMESTAMP_LENGTH] == SPACE):
+            starts[2] = position
+            ends[2] = position + BSD_TIMESTAMP_LENGTH
+            position += BSD_TIMESTAMP_LENGTH + 1
+
+            end = find(frame, SPACE, position, length)
+            if end > position:
+                starts[3] = position
+                ends[3] = end
+                position = end + 1
+
+                end = c_find_any(TAG_DELIMS, 3, frame, position,
+                                 min(length, position + MAX_TAG_LENGTH + 1))
+                if end > position and frame[end] != SPACE:
+                    starts[4] = position
+                    ends[4] = end
+                    if frame[end] == OPEN_BRACKET:
+                        close = find(frame, CLOSE_BRACKET, end + 1, length)
+                        if close > 0:
+                            starts[5] = end + 1
+                            ends[5] = close
+                            end = close + 1
+                    if end < length and frame[end] == c':':
+                        end += 1
+                    if end < length and frame[end] == SPACE:
+                        end += 1
+                    position = end
+
+        starts[7] = position
+        ends[7] = length
+        if self._batch is not None:
+            self._batch_commit(self._batch_copy(frame, length), starts, ends,
+                               Py_SIZE(self._batch_elements),
+                               Py_SIZE(self._batch_sd_fields))
+            return 0
+
+        message = SyslogMessageHead()
+        message.priority = field_bytes(frame, starts[0], ends[0])
+        message.version = None
+        message.timestamp = field_bytes(frame, starts[2], ends[2])
+        message.hostname = field_bytes(frame, starts[3], ends[3])
+        message.appname = field_bytes(frame, starts[4], ends[4])
+        message.processid = field_bytes(frame, starts[5], ends[5])
+        message.messageid = None
+        message.message = frame[starts[7]:ends[7]]
+        messages.append(message)
+        return 0
+
+    cdef int _rfc5424(self, const char *frame, Py_ssize_t length,
+                      Py_ssize_t position, Py_ssize_t *starts,
+                      Py_ssize_t *ends, list messages) except -1:
+        cdef Py_ssize_t field
+        cdef object message
+
+        # Version, timestamp, hostname, app name, process id and message id
+        for field in range(1, 7):
+            ends[field] = find(frame, SPACE, position, length)
+            if ends[field] < 0:
+                self.malformed += 1
+                return 0
+            starts[field] = position
+            position = ends[field] + 1
+
+        if self._batch is not None:
+            return self._batch_frame(frame, length, position, starts, ends)
+
+        message = SyslogMessageHead()
+        if position < length and frame[position] == DASH:
+            position += 1
+        else:
+            position = self._structured_data(
+                frame, position, length, message.sd, 0)
+        if position < 0 or (position < length and frame[position] != SPACE):
+            self.malformed += 1
+            return 0
+
+        message.priority = frame[starts[0]:ends[0]]
+        message.version = frame[starts[1]:ends[1]]
+        message.timestamp = frame[starts[2]:ends[2]]
+        message.hostname = frame[starts[3]:ends[3]]
+        message.appname = frame[starts[4]:ends[4]]
+        message.processid = frame[starts[5]:ends[5]]
+        message.messageid = frame[starts[6]:ends[6]]
+        message.message = frame[position + 1:length] if position < length else b''
+        messages.append(message)
+        return 0
+
+    cdef Py_ssize_t _batch_copy(self, const char *frame,
+                                Py_ssize_t length) except -1:
+        cdef object arena = self._batch.arena
+        cdef Py_ssize_t base = PyByteArray_GET_SIZE(arena)
+        PyByteArray_Resize(arena, base + length)
+        memcpy(PyByteArray_AS_STRING(arena) + base, frame, length)
+        return base
+
+    cdef int _batch_commit(self, Py_ssize_t base, Py_ssize_t *starts,
+                           Py_ssize_t *ends, Py_ssize_t elements_size,
+                           Py_ssize_t sd_fields_size) except -1:
+        cdef int bounds[16]
+        cdef int index[2]
+        cdef Py_ssize_t field
+        batch = self._batch
+
+        for field in range(BATCH_FIELD_COUNT):
+            if starts[field] < 0:
+                bounds[2 * field] = 0
+                bounds[2 * field + 1] = -1
+            else:
+                bounds[2 * field] = base + starts[field]
+                bounds[2 * field + 1] = ends[field] - starts[field]
+        index[0] = elements_size // BATCH_ELEMENT_WIDTH
+        index[1] = (Py_SIZE(self._batch_elements) -
+                    elements_size) // BATCH_ELEMENT_WIDTH
+        append_ints(batch._fields, bounds, 2 * BATCH_FIELD_COUNT)
+        append_ints(batch._sd_index, index, 2)
+        batch._marks = (base, elements_size, sd_fields_size)
+        return 0
+
+    cdef int _batch_frame(self, const char *frame, Py_ssize_t length,
+                          Py_ssize_t position, Py_ssize_t *starts,
+                          Py_ssize_t *ends) except -1:
+        # The batch's arrays are written directly rather than through its
+        # methods, which would cost a call per field
+        cdef Py_ssize_t base
+        cdef Py_ssize_t elements_size = Py_SIZE(self._batch_elements)
+        cdef Py_ssize_t sd_fields_size = Py_SIZE(self._batch_sd_fields)
+
+        base = self._batch_copy(frame, length)
+        if position < length and frame[position] == DASH:
+            position += 1
+        else:
+            position = self._structured_data(
+                frame, position, length, None, base)
+        if position < 0 or (position < length and frame[position] != SPACE):
+            PyByteArray_Resize(self._batch.arena, base)
+            truncate_ints(self._batch_elements, elements_size)
+            truncate_ints(self._batch_sd_fields, sd_fields_size)
+            self.malformed += 1
+            return 0
+
+        starts[7] = position + 1 if position < length else length
+        ends[7] = length
+        return self._batch_commit(base, starts, ends, elements_size,
+                                  sd_fields_size)
+
+    cdef Py_ssize_t _structured_data(self, const char *frame,
+                                     Py_ssize_t position, Py_ssize_t length,
+                                     dict sd, Py_ssize_t base) except -2:
+        # SD is collected into sd or, when there is none, into the batch
+        # whose arena holds the frame at base
+        cdef Py_ssize_t name_end, equals, quote
+        cdef dict fields = None
+        cdef int element[4]
+        cdef int sd_field[4]
+        cdef carray.array elements = self._batch_elements
+
+        if position >= length or frame[position] != OPEN_BRACKET:
+            return -1
+        while position < length and frame[position] == OPEN_BRACKET:
+            position += 1
+            name_end = c_find_any(SD_NAME_DELIMS, 2, frame, position, length)
+            if name_end <= position:
+                return -1
+            if sd is None:
+                element[0] = base + position
+                element[1] = name_end - position
+                element[2] = (Py_SIZE(self._batch_sd_fields) //
+                              BATCH_SD_FIELD_WIDTH)
+                element[3] = 0
+                append_ints(elements, element, BATCH_ELEMENT_WIDTH)
+            else:
+                fields = dict()
+                sd[frame[position:name_end]] = fields
+            position = name_end
+
+            while frame[position] == SPACE:
+                position += 1
+                equals = find(frame, EQUALS, position, length)
+                if (equals <= position or equals + 1 >= length or
+                        frame[equals + 1] != QUOTE):
+                    return -1
+                quote = find_closing_quote(frame, equals + 2, length)
+                if quote < 0 or quote + 1 >= length:
+                    return -1
+                if sd is None:
+                    sd_field[0] = base + position
+                    sd_field[1] = equals - position
+                    sd_field[2] = base + equals + 2
+                    sd_field[3] = quote - equals - 2
+                    append_ints(self._batch_sd_fields, sd_field,
+                                BATCH_SD_FIELD_WIDTH)
+                    elements.data.as_ints[Py_SIZE(elements) - 1] += 1
+                else:
+                    fields[frame[position:equals]] = frame[equals + 2:quote]
+                position = quote + 1
+
+            if frame[position] != CLOSE_BRACKET:
+                return -1
+            position += 1
+        return position
@@ -1,12 +1,26 @@
+cdef int c_find_any(const char *delims, int delim_count, const char *data,
+                    int start, int end)
+cdef int c_buffer_seek(const char *delims, int delim_count, char *data,
+                       int size, int read_index, int available, int limit)
+
+
 cdef class CyclicBuffer(object):
 
     cdef char *_buffer
-    cdef int _current_size, _read_index, _write_index, _available
+    cdef int _current_size, _read_index, _write_index, _available, _exports
     
     cdef int _get(self, char* data, int offset, int length)
-    cdef void _put(self, char *data, int offset, int length)
+    cdef int _put(self, char *data, int offset, int length) except -1
+    cdef int _contiguous_writable(self)
     cpdef int skip(self, int length)
     cpdef grow(self, int min_length)
     cpdef int available(self)
     cpdef int remaining(self)
     cpdef clear(self)
+
+
+cdef class BufferWindow(object):
+
+    cdef CyclicBuffer _owner
+    cdef char *_data
+    cdef Py_ssize_t _length
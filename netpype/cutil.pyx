@@ -1,4 +1,7 @@
 from libc.stdlib cimport malloc, realloc, free
+from libc.string cimport memchr, memset
+from cpython.buffer cimport PyBuffer_FillInfo
+from cpython.tuple cimport PyTuple_GET_ITEM, PyTuple_GET_SIZE
 from cython import array
 
 
@@ -7,25 +10,113 @@ cdef extern from "Python.h":
     int PyByteArray_Check(object bytearray)
     int PyByteArray_GET_SIZE(object bytearray)
 
-    
-def buffer_seek(char delim, object source, int size, int read_index, int available):
-    return c_buffer_seek(delim, PyByteArray_AS_STRING(source), size, read_index, available)
 
-    
-cdef c_buffer_seek(char delim, char *data, int size, int read_index, int available):
-    cdef int seek_offset = 0
-    cdef int seek_index = read_index
-    while seek_offset <= available:
-        if data[seek_index] == delim:
-            return seek_offset
-        if seek_index + 1 >= size:
-            seek_index = 0
-        else:
-            seek_index += 1
-        seek_offset += 1
+cdef enum:
+    C_SEEK_NOT_FOUND = -1
+    C_SEEK_LIMIT_REACHED = -2
+    # Up to this many delimiters are searched for with one memchr each
+    MEMCHR_DELIMS = 4
+
+# Seek results when no delimiter is found
+SEEK_NOT_FOUND = C_SEEK_NOT_FOUND
+SEEK_LIMIT_REACHED = C_SEEK_LIMIT_REACHED
+
+
+def buffer_seek(bytes delims, object source, int size, int read_index,
+                int available, int limit=-1):
+    return c_buffer_seek(delims, len(delims), PyByteArray_AS_STRING(source),
+                         size, read_index, available, limit)
+
+
+def run_pipeline(tuple methods, object socket_fileno, object data,
+                 int forward):
+    """
+    Calls the bound handler methods of an event in turn for as long as they
+    forward, and returns the first other result as a selector event. Handler
+    results are read in place so forwarding allocates nothing of its own.
+    """
+    cdef object method, result, signal
+
+    for method in methods:
+        result = method(data)
+        if not result:
+            continue
+        if type(result) is tuple and PyTuple_GET_SIZE(result) == 2:
+            signal = <object> PyTuple_GET_ITEM(result, 0)
+            if signal == forward:
+                data = <object> PyTuple_GET_ITEM(result, 1)
+                continue
+            return (signal, socket_fileno, <object> PyTuple_GET_ITEM(result, 1))
+        if result[0] == forward:
+            data = result[1]
+            continue
+        return (result[0], socket_fileno, result[1])
+    return None
+
+
+cdef int c_find_any(const char *delims, int delim_count, const char *data,
+                    int start, int end):
+    """
+    Returns the index of the first byte within data[start:end] that is one of
+    the delimiters or -1. A few delimiters are searched for with memchr, each
+    search ending where the best match so far is, and more are looked up in a
+    byte table.
+    """
+    cdef const char *found
+    cdef const char *best = NULL
+    cdef unsigned char table[256]
+    cdef int index
+
+    if delim_count <= MEMCHR_DELIMS:
+        for index in range(delim_count):
+            if end <= start:
+                break
+            found = <const char*> memchr(data + start, delims[index],
+                                         end - start)
+            if found != NULL:
+                best = found
+                end = <int> (found - data)
+        if best == NULL:
+            return -1
+        return <int> (best - data)
+
+    memset(table, 0, sizeof(table))
+    for index in range(delim_count):
+        table[<unsigned char> delims[index]] = 1
+    for index in range(start, end):
+        if table[<unsigned char> data[index]]:
+            return index
     return -1
 
 
+cdef int c_buffer_seek(const char *delims, int delim_count, char *data,
+                       int size, int read_index, int available, int limit):
+    """
+    Returns how far past the read index the first delimiter is. The readable
+    bytes are searched as at most two contiguous spans, the second starting
+    over at the front of the ring, and no further than limit bytes when a
+    limit is given.
+    """
+    cdef int scan = available
+    cdef int end, found
+
+    if limit >= 0 and limit < available:
+        scan = limit
+    end = read_index + scan
+
+    found = c_find_any(delims, delim_count, data, read_index,
+                       end if end < size else size)
+    if found >= 0:
+        return found - read_index
+    if end > size:
+        found = c_find_any(delims, delim_count, data, 0, end - size)
+        if found >= 0:
+            return size - read_index + found
+    if limit >= 0 and limit <= available:
+        return C_SEEK_LIMIT_REACHED
+    return C_SEEK_NOT_FOUND
+
+
 cdef direct_copy(char *source, int soffset, char *dest, int doffset, int length):
     cdef int ioffset = 0
     while ioffset < length:
@@ -38,29 +129,56 @@ cdef array_copy(char *source, int soffset, char[:] dest, int doffset, int length
         dest[doffset + ioffset] = source[soffset + ioffset]
         ioffset += 1
 
+
+"""
+A BufferWindow exposes a span of a CyclicBuffer through the buffer protocol
+without copying it. The owning buffer refuses to grow while any view over one
+of its windows is still alive since growing would free the memory behind it.
+"""
+cdef class BufferWindow(object):
+
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        PyBuffer_FillInfo(buffer, self, self._data, self._length, 0, flags)
+        self._owner._exports += 1
+
+    def __releasebuffer__(self, Py_buffer *buffer):
+        self._owner._exports -= 1
+
+    def __len__(self):
+        return self._length
+
+
+cdef BufferWindow new_window(CyclicBuffer owner, int offset, int length):
+    cdef BufferWindow window = BufferWindow.__new__(BufferWindow)
+    window._owner = owner
+    window._data = owner._buffer + offset
+    window._length = length
+    return window
+
         
 cdef class CyclicBuffer(object):
     
     def __cinit__(self, int size_hint=4096):
         self._buffer = <char*> malloc(sizeof(char) * size_hint)
         self._current_size = size_hint
+        self._exports = 0
         self.clear()
 
     def __dealloc__(self):
         free(self._buffer)
         
-    def skip_until(self, char *delims, int limit=-1):
+    def skip_until(self, bytes delims, int limit=-1):
         cdef int seek_offset
-        seek_offset = c_buffer_seek(delims[0], self._buffer, 
-            self._current_size, self._read_index, self._available)
+        seek_offset = c_buffer_seek(delims, len(delims), self._buffer,
+            self._current_size, self._read_index, self._available, limit)
         if seek_offset > 0:
             return self.skip(seek_offset)
         return seek_offset
 
-    def get_until(self, char *delims, char[:] data, int offset=0, int limit=-1):
+    def get_until(self, bytes delims, char[:] data, int offset=0, int limit=-1):
         cdef int seek_offset
-        seek_offset = c_buffer_seek(delims[0], self._buffer, 
-            self._current_size, self._read_index, self._available)
+        seek_offset = c_buffer_seek(delims, len(delims), self._buffer,
+            self._current_size, self._read_index, self._available, limit)
         if seek_offset > 0:
             return self.get(data, offset, seek_offset)
         return seek_offset
@@ -121,7 +239,7 @@ cdef class CyclicBuffer(object):
             self._available -= readable
         return readable
 
-    cdef void _put(self, char *data, int offset, int length):
+    cdef int _put(self, char *data, int offset, int length) except -1:
         cdef int remaining, trimmed_length, next_write_index
         remaining = self._current_size - self._available
         if remaining < length:
@@ -139,16 +257,14 @@ cdef class CyclicBuffer(object):
                         self._write_index, length)
             self._write_index += length
         self._available += length
+        return 0
         
-    def put(self, object data, int offset=0, int length=-1):
-        if not PyByteArray_Check(data):
-            raise Exception
+    def put(self, const unsigned char[::1] data, int offset=0, int length=-1):
         cdef int size = length
         if length == -1:
-            size = PyByteArray_GET_SIZE(data)
-        self._put(PyByteArray_AS_STRING(data),
-                  offset,
-                  size)
+            size = data.shape[0]
+        if size > 0:
+            self._put(<char*> &data[0], offset, size)
 
     cpdef int skip(self, int length):
         cdef int bytes_skipped = 0
@@ -162,12 +278,14 @@ cdef class CyclicBuffer(object):
                 if self._read_index + length < self._current_size:
                     self._read_index += length
                 else:
-                    self._read_index = length - self._current_size
-                    self._read_index -= self._read_index
+                    self._read_index = length - (
+                        self._current_size - self._read_index)
             self._available -= bytes_skipped
         return bytes_skipped
 
     cpdef grow(self, int min_length):
+        if self._exports > 0:
+            raise BufferError('Unable to grow while views are exported.')
         cdef int new_size = self._current_size * 2 * (
             int(min_length / self._current_size) + 1)
         cdef char* new_buffer = <char*> malloc(sizeof(char) * new_size)
@@ -177,6 +295,7 @@ cdef class CyclicBuffer(object):
         self._current_size = new_size
         self._read_index = 0
         self._write_index = read
+        self._available = read
 
     cpdef int available(self):
         return self._available
@@ -184,6 +303,33 @@ cdef class CyclicBuffer(object):
     cpdef int remaining(self):
         return self._current_size - self._available
 
+    def writable_view(self, int min_length=1):
+        if self._available == 0:
+            self.clear()
+        if self._contiguous_writable() < min_length:
+            self.grow(min_length)
+        return memoryview(new_window(
+            self, self._write_index, self._contiguous_writable()))
+
+    def commit(self, int length):
+        self._write_index += length
+        if self._write_index >= self._current_size:
+            self._write_index -= self._current_size
+        self._available += length
+
+    def readable_view(self):
+        cdef int readable = self._current_size - self._read_index
+        if self._available < readable:
+            readable = self._available
+        return memoryview(new_window(self, self._read_index, readable))
+
+    cdef int _contiguous_writable(self):
+        if self._available == self._current_size:
+            return 0
+        if self._write_index >= self._read_index:
+            return self._current_size - self._write_index
+        return self._read_index - self._write_index
+
     cpdef clear(self):
         self._read_index = 0
         self._write_index = 0
@@ -0,0 +1,151 @@
+import errno
+import fcntl
+import os
+import traceback
+import netpype.env as env
+
+from collections import deque
+from functools import partial
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from netpype.affinity import allowed_cpus, pin
+
+
+_LOG = env.get_logger('netpype.dispatch')
+
+# Pool types
+THREAD_POOL = 'thread'
+PROCESS_POOL = 'process'
+
+DEFAULT_MAX_PENDING = 1024
+
+_WAKEUP_BYTE = b'\0'
+_WAKEUP_READ_SIZE = 4096
+
+
+class DispatchFailure(object):
+
+    def __init__(self, message):
+        self.message = message
+
+    def __repr__(self):
+        return 'Dispatched task failed: {}'.format(self.message)
+
+
+def _invoke(function, message):
+    # Failures are handed back as results so that the worker's traceback
+    # reaches the I/O loop, which only gets the exception otherwise
+    try:
+        return function(message)
+    except Exception:
+        return DispatchFailure(traceback.format_exc())
+
+
+def _set_nonblocking(fileno):
+    flags = fcntl.fcntl(fileno, fcntl.F_GETFL)
+    fcntl.fcntl(fileno, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+"""
+A DispatchPool runs DISPATCH payloads away from the I/O loop. A payload is a
+tuple of a function and the message it is called with. The function follows
+the same contract as the NetworkEventHandler methods and its result is handed
+back to the pipeline of the channel that dispatched it.
+
+Work is handed to a process pool or a thread pool. Process pools require both
+the function and the message to be picklable. Pool workers are pinned to cpus
+when it is set and there is one worker per CPU unless workers says otherwise.
+
+Results are collected by the pool's result thread and queued for the I/O loop,
+which is woken up by a byte written to a pipe that the selector polls. The
+number of tasks in flight is bounded; callers are expected to hold tasks back
+while the pool is full.
+"""
+
+
+class DispatchPool(object):
+
+    def __init__(self, pool_type=PROCESS_POOL, workers=None,
+                 max_pending=DEFAULT_MAX_PENDING, cpus=None):
+        if pool_type not in (THREAD_POOL, PROCESS_POOL):
+            raise ValueError('Unknown pool type: {}.'.format(pool_type))
+        self._pool_type = pool_type
+        self._workers = workers
+        self.cpus = tuple(cpus) if cpus else None
+        self._max_pending = max_pending
+        self._pending = 0
+        self._completions = deque()
+        self._pool = None
+
+    def start(self):
+        workers = self._workers or len(self.cpus or allowed_cpus())
+        pool_class = ThreadPool if self._pool_type == THREAD_POOL else Pool
+        self._pool = pool_class(
+            processes=workers, initializer=pin, initargs=(self.cpus,))
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        _set_nonblocking(self._wakeup_read)
+        _set_nonblocking(self._wakeup_write)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            os.close(self._wakeup_read)
+            os.close(self._wakeup_write)
+
+    def fileno(self):
+        return self._wakeup_read
+
+    def pending(self):
+        return self._pending
+
+    def full(self):
+        return self._pending >= self._max_pending
+
+    def submit(self, owner, task):
+        if self.full():
+            return False
+        function, message = task
+        self._pending += 1
+        self._pool.apply_async(
+            _invoke,
+            (function, message),
+            callback=partial(self._complete, owner),
+            error_callback=partial(self._fail, owner))
+        return True
+
+    def completions(self):
+        """
+        Yields the owner and result of every task that has completed since
+        the last call. Must be called from the I/O loop.
+        """
+        try:
+            while os.read(self._wakeup_read, _WAKEUP_READ_SIZE):
+                pass
+        except OSError as oe:
+            if oe.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+        while self._completions:
+            owner, result = self._completions.popleft()
+            self._pending -= 1
+            if isinstance(result, DispatchFailure):
+                _LOG.error(result)
+                result = None
+            yield owner, result
+
+    def _fail(self, owner, error):
+        # Tasks and results that can't be pickled fail outside _invoke
+        self._complete(owner, DispatchFailure(''.join(
+            traceback.format_exception_only(type(error), error)).strip()))
+
+    def _complete(self, owner, result):
+        # Runs on the pool's result thread
+        self._completions.append((owner, result))
+        try:
+            os.write(self._wakeup_write, _WAKEUP_BYTE)
+        except OSError as oe:
+            # A full pipe already has a wakeup pending
+            if oe.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
@@ -2,8 +2,11 @@ import time
 import netpype.env as env
 
 from netpype.selector import events as selection_events, new_server
-from netpype.channel import SocketINet4Address
+from netpype.channel import SocketINet4Address, SEEK_LIMIT_REACHED
 from netpype.channel import NetworkEventHandler, PipelineFactory
+from netpype.batch import FIELD_NAMES, MESSAGE
+from netpype.batch import PRIORITY, VERSION, TIMESTAMP, HOSTNAME
+from netpype.batch import APPNAME, PROCESSID, MESSAGEID
 
 try:
     from netpype.cutil import CyclicBuffer
@@ -11,12 +14,12 @@ except ImportError:
     from netpype.channel import CyclicBuffer
 
 # Delimeter constants
-_SPACE = ' '
-_QUOTE = '"'
-_EQUALS = '='
-_CLOSE_ANGLE_BRACKET = '>'
-_OPEN_BRACKET = '['
-_CLOSE_BRACKET = ']'
+_SPACE = b' '
+_QUOTE = b'"'
+_EQUALS = b'='
+_CLOSE_ANGLE_BRACKET = b'>'
+_OPEN_BRACKET = b'['
+_CLOSE_BRACKET = b']'
 
 # Ordinal values
 _SPACE_ORD = ord(_SPACE)
@@ -44,6 +47,8 @@ class LexerState(object):
     READ_SD_VALUE_CONTENT = 13
     READ_SD_NEXT_FIELD_OR_END = 14
     READ_MESSAGE = 15
+    SKIP_FRAME = 16
+    MALFORMED = 17
 
 lexer_states = LexerState()
 
@@ -81,10 +86,13 @@ class StructuredDataField(object):
 
 class SyslogLexer(NetworkEventHandler):
 
-    def __init__(self):
+    def __init__(self, batch=None):
+        # Messages are appended to batch, a netpype.batch.SyslogBatch, when
+        # one is given
         self._accumulator = CyclicBuffer(size_hint=1024)
         self._lookaside = bytearray(1024)
         self._state = lexer_states.START
+        self._batch = batch
 
     def get_message(self):
         return self._message
@@ -92,6 +100,9 @@ class SyslogLexer(NetworkEventHandler):
     def get_state(self):
         return self._state
 
+    def buffered(self):
+        return self._accumulator.available()
+
     def on_connect(self, message):
         _LOG.info('Syslog client connected @ {}.'.format(message))
         return (selection_events.REQUEST_READ, None)
@@ -99,8 +110,12 @@ class SyslogLexer(NetworkEventHandler):
     def on_read(self, message):
         # Load into our accumulator
         self._accumulator.put(message)
-        while self._accumulator.available > 0 and self.parse_next():
+        while self._accumulator.available() > 0 and self.parse_next():
             pass
+        if self._state == lexer_states.MALFORMED:
+            _LOG.error('Closing a connection that sent an octet count over '
+                       '9 digits.')
+            return (selection_events.REQUEST_CLOSE, None)
         
     def on_write(self, message):
         _LOG.info('Requesting close.')
@@ -120,11 +135,66 @@ class SyslogLexer(NetworkEventHandler):
             self._accumulator.skip(1)
             self._octet_count -= read + 1
             self._read_offset = read
+        elif read == SEEK_LIMIT_REACHED:
+            self._token_too_long()
         return read
 
+    def _token_too_long(self):
+        if self._state == lexer_states.READ_OCTET:
+            # Without an octet count there is no telling where the next frame
+            # starts
+            self._state = lexer_states.MALFORMED
+            return
+        # The rest of the frame is dropped along with its message
+        if self._batch is not None:
+            self._batch.rollback()
+        self._state = lexer_states.SKIP_FRAME
+
     def _next_token(self, offset=0):
         return self._lookaside[offset:self._read_offset]
 
+    def _set_field(self, field, token):
+        if self._batch is not None:
+            self._batch.put_field(field, token)
+        else:
+            setattr(self._message, FIELD_NAMES[field], token)
+
+    def _new_message(self):
+        if self._batch is not None:
+            return self._batch[self._batch.begin()]
+        return SyslogMessage()
+
+    def _sd_element(self, name):
+        if self._batch is not None:
+            self._batch.put_sd_element(name)
+            return None
+        return self._message.sd_element(name)
+
+    def _sd_field_name(self, name):
+        if self._batch is not None:
+            # The field is put once its value has been read
+            return name
+        return self._structured_data.sd_field(name)
+
+    def _sd_field_value(self, value):
+        if self._batch is not None:
+            self._batch.put_sd_field(self._sd_field, value)
+        else:
+            self._sd_field.value = value
+
+    def _message_finished(self):
+        if self._batch is not None and self._message_offset >= 0:
+            self._batch.set_field(
+                MESSAGE,
+                self._message_offset,
+                len(self._batch.arena) - self._message_offset)
+
+    def _message_content(self, read):
+        if self._batch is not None:
+            offset = self._batch.copy(self._lookaside[:read])
+            if self._message_offset < 0:
+                self._message_offset = offset
+
     def parse_next(self):
         if self._state == lexer_states.START:
             self._octet_count = 0
@@ -132,47 +202,48 @@ class SyslogLexer(NetworkEventHandler):
             self._state = lexer_states.READ_OCTET
             self._structured_data = None
             self._sd_field = None
+            self._message_offset = -1
         
         if self._state == lexer_states.READ_OCTET:
             if self._get_until(_SPACE, 9) > -1:
-                self._octet_count += int(self._next_token())
-                self._message = SyslogMessage()
+                self._octet_count = int(self._next_token())
+                self._message = self._new_message()
                 self._state = lexer_states.READ_PRI
                 return True
         elif self._state == lexer_states.READ_PRI:
             if self._get_until(_CLOSE_ANGLE_BRACKET, 5) > -1:
                 self._state = lexer_states.READ_VERSION
-                self._message.priority = self._next_token(1)
+                self._set_field(PRIORITY, self._next_token(1))
                 return True
         elif self._state == lexer_states.READ_VERSION:
             if self._get_until(_SPACE, 2) > -1:
                 self._state = lexer_states.READ_TIMESTAMP
-                self._message.version = self._next_token()
+                self._set_field(VERSION, self._next_token())
                 return True
         elif self._state == lexer_states.READ_TIMESTAMP:
             if self._get_until(_SPACE, 48) > -1:
                 self._state = lexer_states.READ_HOSTNAME
-                self._message.timestamp = self._next_token()
+                self._set_field(TIMESTAMP, self._next_token())
                 return True
         elif self._state == lexer_states.READ_HOSTNAME:
             if self._get_until(_SPACE, 255) > -1:
                 self._state = lexer_states.READ_APPNAME
-                self._message.hostname = self._next_token()
+                self._set_field(HOSTNAME, self._next_token())
                 return True
         elif self._state == lexer_states.READ_APPNAME:
             if self._get_until(_SPACE, 48) > -1:
                 self._state = lexer_states.READ_PROCESSID
-                self._message.appname = self._next_token()
+                self._set_field(APPNAME, self._next_token())
                 return True
         elif self._state == lexer_states.READ_PROCESSID:
             if self._get_until(_SPACE, 128) > -1:
                 self._state = lexer_states.READ_MESSAGEID
-                self._message.processid = self._next_token()
+                self._set_field(PROCESSID, self._next_token())
                 return True
         elif self._state == lexer_states.READ_MESSAGEID:
             if self._get_until(_SPACE, 32) > -1:
                 self._state = lexer_states.READ_SD_ELEMENT
-                self._message.messageid = self._next_token()
+                self._set_field(MESSAGEID, self._next_token())
                 return True
         elif self._state == lexer_states.READ_SD_ELEMENT:
             read = self._accumulator.get(
@@ -191,14 +262,12 @@ class SyslogLexer(NetworkEventHandler):
                 return True
         elif self._state == lexer_states.READ_SD_ELEMENT_NAME:
             if self._get_until(_SPACE, 32) > -1:
-                self._structured_data = self._message.sd_element(
-                    self._next_token())
+                self._structured_data = self._sd_element(self._next_token())
                 self._state = lexer_states.READ_SD_FIELD_NAME
                 return True
         elif self._state == lexer_states.READ_SD_FIELD_NAME:
             if self._get_until(_EQUALS, 32) > -1:
-                self._sd_field = self._structured_data.sd_field(
-                    self._next_token())             
+                self._sd_field = self._sd_field_name(self._next_token())
                 self._state = lexer_states.READ_SD_VALUE_START
                 return True
         elif self._state == lexer_states.READ_SD_VALUE_START:
@@ -207,7 +276,7 @@ class SyslogLexer(NetworkEventHandler):
                 return True
         elif self._state == lexer_states.READ_SD_VALUE_CONTENT:
             if self._get_until(_QUOTE, 255) > -1:
-                self._sd_field.value = self._next_token()
+                self._sd_field_value(self._next_token())
                 self._state = lexer_states.READ_SD_NEXT_FIELD_OR_END
                 return True
         elif self._state == lexer_states.READ_SD_NEXT_FIELD_OR_END:
@@ -225,12 +294,22 @@ class SyslogLexer(NetworkEventHandler):
         elif self._state == lexer_states.READ_MESSAGE:
             read = self._accumulator.get(
                 data=self._lookaside,
-                length=self._octet_count)
+                length=min(self._octet_count, len(self._lookaside)))
             if read > 0:
                 self._octet_count -= read
+                self._message_content(read)
                 if self._octet_count == 0:
+                    self._message_finished()
                     self._state = lexer_states.START
-        return False
+                return True
+        elif self._state == lexer_states.SKIP_FRAME:
+            if self._octet_count > 0:
+                self._octet_count -= self._accumulator.skip(self._octet_count)
+            if self._octet_count <= 0:
+                self._state = lexer_states.START
+            return True
+        # A token over its limit moves on to skipping the rest of the frame
+        return self._state == lexer_states.SKIP_FRAME
 
 
 class EmptyHandler(NetworkEventHandler):
@@ -0,0 +1,135 @@
+import time
+
+from multiprocessing.sharedctypes import RawArray
+
+
+# Server counters
+POLLS = 0
+EVENTS = 1
+BYTES_READ = 2
+BYTES_WRITTEN = 3
+ACCEPTS = 4
+CLOSES = 5
+ACTIVE_CHANNELS = 6
+DISPATCH_SAMPLES = 7
+
+COUNTERS = ('polls', 'events', 'bytes_read', 'bytes_written', 'accepts',
+            'closes', 'active_channels', 'dispatch_samples')
+
+DEFAULT_BUCKETS = 32
+DEFAULT_HANDLER_SLOTS = 32
+# One in this many events has its handlers timed
+DEFAULT_DISPATCH_SAMPLE = 64
+
+_NAME_WIDTH = 64
+
+clock = getattr(time, 'perf_counter', time.time)
+
+
+"""
+A Histogram counts samples into power of two buckets held in shared memory.
+Bucket 0 counts samples below one, bucket n those from 2 ** (n - 1) up to
+2 ** n and the last bucket everything beyond.
+"""
+
+
+class Histogram(object):
+
+    __slots__ = ('_counts', '_offset', '_last')
+
+    def __init__(self, counts, offset, buckets):
+        self._counts = counts
+        self._offset = offset
+        self._last = buckets - 1
+
+    def record(self, value):
+        bucket = int(value).bit_length()
+        if bucket > self._last:
+            bucket = self._last
+        self._counts[self._offset + bucket] += 1
+
+    def counts(self):
+        return self._counts[self._offset:self._offset + self._last + 1]
+
+
+def percentile(counts, fraction):
+    """
+    Returns the upper bound of the bucket that holds the given fraction of
+    the samples of a histogram's counts, or None without samples.
+    """
+    total = sum(counts)
+    if total == 0:
+        return None
+    rank = fraction * total
+    seen = 0
+    for bucket, count in enumerate(counts):
+        seen += count
+        if seen >= rank:
+            return 2 ** bucket
+    return 2 ** (len(counts) - 1)
+
+
+"""
+ServerMetrics holds the counters and histograms of one server in shared
+memory that is allocated before the server process starts. The server process
+updates them without locks and any process may take a snapshot, which is
+consistent per value but not across values.
+
+Loop time is the nanoseconds spent handling what one poll returned. Handler
+latency is the nanoseconds a handler method took, kept per handler class for
+up to handler_slots classes and sampled on a share of events.
+"""
+
+
+class ServerMetrics(object):
+
+    def __init__(self, buckets=DEFAULT_BUCKETS,
+                 handler_slots=DEFAULT_HANDLER_SLOTS):
+        self.counters = RawArray('q', len(COUNTERS))
+        self._buckets = buckets
+        self._handler_slots = handler_slots
+        self._histograms = RawArray('q', (2 + handler_slots) * buckets)
+        self._handler_names = RawArray('c', handler_slots * _NAME_WIDTH)
+        self.loop_time = Histogram(self._histograms, 0, buckets)
+        self.events_per_poll = Histogram(self._histograms, buckets, buckets)
+        self._handlers = dict()
+
+    def handler(self, handler_class):
+        """
+        Returns the latency histogram of a handler class, or None once every
+        handler slot is taken.
+        """
+        histogram = self._handlers.get(handler_class)
+        if histogram is None and handler_class not in self._handlers:
+            slot = len(self._handlers)
+            if slot < self._handler_slots:
+                name = handler_class.__name__.encode('utf-8')[:_NAME_WIDTH]
+                offset = slot * _NAME_WIDTH
+                self._handler_names[offset:offset + len(name)] = name
+                histogram = Histogram(
+                    self._histograms, (2 + slot) * self._buckets,
+                    self._buckets)
+            self._handlers[handler_class] = histogram
+        return histogram
+
+    def _handler_name(self, slot):
+        offset = slot * _NAME_WIDTH
+        name = self._handler_names[offset:offset + _NAME_WIDTH]
+        return name.rstrip(b'\0').decode('utf-8')
+
+    def snapshot(self):
+        buckets = self._buckets
+        histograms = self._histograms[:]
+        handlers = dict()
+        for slot in range(self._handler_slots):
+            name = self._handler_name(slot)
+            if not name:
+                break
+            offset = (2 + slot) * buckets
+            handlers[name] = histograms[offset:offset + buckets]
+        return {
+            'counters': dict(zip(COUNTERS, self.counters[:])),
+            'loop_ns': histograms[:buckets],
+            'events_per_poll': histograms[buckets:2 * buckets],
+            'handler_ns': handlers,
+        }
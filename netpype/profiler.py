@@ -0,0 +1,268 @@
+import marshal
+import os
+import signal
+import tempfile
+import netpype.env as env
+
+from netpype.metrics import clock
+from netpype.selector import events as selection_events
+
+
+_LOG = env.get_logger('netpype.profiler')
+
+# Profiler defaults
+DEFAULT_PROFILE_SAMPLE = 100
+DEFAULT_PROFILE_FORMAT = 'pstats'
+DEFAULT_DUMP_SIGNAL = signal.SIGUSR1
+
+PROFILE_FORMATS = ('pstats', 'collapsed')
+_EXTENSIONS = {'pstats': 'prof', 'collapsed': 'folded'}
+
+_SIGNAL_NAMES = dict((value, name)
+                     for name, value in vars(selection_events).items()
+                     if name.isupper())
+
+
+def from_env():
+    """
+    Returns the sampling profiler configured by the PROFILE environment
+    variable, or None when it is unset or asks for cProfile instead.
+    PROFILE_SAMPLE, PROFILE_INTERVAL, PROFILE_DIR and PROFILE_FORMAT set the
+    profiler's sample rate, dump interval, dump directory and dump format.
+    """
+    mode = env.get('PROFILE')
+    if not mode or mode == 'cprofile':
+        return None
+    interval = env.get('PROFILE_INTERVAL')
+    return SamplingProfiler(
+        sample=int(env.get('PROFILE_SAMPLE', DEFAULT_PROFILE_SAMPLE)),
+        interval=float(interval) if interval else None,
+        directory=env.get('PROFILE_DIR'),
+        dump_format=env.get('PROFILE_FORMAT', DEFAULT_PROFILE_FORMAT))
+
+
+class _ProfiledSelector(object):
+
+    def __init__(self, selector, profiler, name):
+        self._selector = selector
+        self._record = profiler.record_syscall
+        self._profiler = profiler
+        self._name = name
+
+    def _call(self, call, *args):
+        if not self._profiler.sample():
+            return getattr(self._selector, call)(*args)
+        start = clock()
+        try:
+            return getattr(self._selector, call)(*args)
+        finally:
+            self._record(self._name, call, clock() - start)
+
+    def poll(self, *args):
+        return self._call('poll', *args)
+
+    def register(self, *args):
+        return self._call('register', *args)
+
+    def modify(self, *args):
+        return self._call('modify', *args)
+
+    def unregister(self, *args):
+        return self._call('unregister', *args)
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+
+"""
+A SamplingProfiler times one in sample handler method calls and selector
+calls of a server process and keeps their totals per event signal and
+handler class. Everything else runs untouched, so a profiled server behaves
+close to an unprofiled one.
+
+The totals are dumped to a file when the dump signal arrives, every interval
+seconds if an interval is set and when the server halts, and start over after
+every dump. Dumps either load into pstats, with every handler method called
+from a pseudo-function named after its event signal, or hold collapsed
+stacks for flame graphs. Calls and times in a dump are scaled up by the
+sample rate to estimate the totals of every call.
+"""
+
+
+class SamplingProfiler(object):
+
+    def __init__(self, sample=DEFAULT_PROFILE_SAMPLE, interval=None,
+                 directory=None, dump_format=DEFAULT_PROFILE_FORMAT,
+                 dump_signal=DEFAULT_DUMP_SIGNAL):
+        if sample < 1:
+            raise ValueError('The sample rate must be at least 1.')
+        if dump_format not in PROFILE_FORMATS:
+            raise ValueError(
+                'Unknown profile format: {}.'.format(dump_format))
+        self.sample_rate = sample
+        self._interval = interval
+        self._directory = directory or tempfile.gettempdir()
+        self._dump_format = dump_format
+        self._dump_signal = dump_signal
+        self._countdown = sample
+        self._calls = dict()
+        self._syscalls = dict()
+        self._recorders = dict()
+        self._dumps = 0
+        self._dump_requested = False
+        self._last_dump = None
+
+    def start(self, now):
+        """
+        Called from the profiled process to start dumping on its signal and
+        interval.
+        """
+        self._last_dump = now
+        if self._dump_signal is not None:
+            signal.signal(self._dump_signal, self.request_dump)
+
+    def sample(self):
+        if self._countdown != 1:
+            self._countdown -= 1
+            return False
+        self._countdown = self.sample_rate
+        return True
+
+    def selector(self, selector, name):
+        """
+        Wraps a poll or epoll object so that its calls are sampled under the
+        given name.
+        """
+        return _ProfiledSelector(selector, self, name)
+
+    def recorder(self, event_signal):
+        """
+        Returns a callable that records how long a handler method took on
+        the given event signal.
+        """
+        record = self._recorders.get(event_signal)
+        if record is None:
+            calls = self._calls
+
+            def record(method, seconds):
+                key = (event_signal, type(method.__self__), method.__name__)
+                totals = calls.get(key)
+                if totals is None:
+                    totals = calls[key] = [0, 0.0, _code_location(method)]
+                totals[0] += 1
+                totals[1] += seconds
+            self._recorders[event_signal] = record
+        return record
+
+    def record_syscall(self, selector, call, seconds):
+        totals = self._syscalls.get((selector, call))
+        if totals is None:
+            totals = self._syscalls[(selector, call)] = [0, 0.0]
+        totals[0] += 1
+        totals[1] += seconds
+
+    def request_dump(self, signum=None, frame=None):
+        # Signals only flag the dump, the loop writes it
+        self._dump_requested = True
+
+    def dump_due(self, now):
+        return self._dump_requested or (
+            self._interval is not None and self._last_dump is not None and
+            now - self._last_dump >= self._interval)
+
+    def dump(self, now=None):
+        """
+        Writes the totals since the last dump and starts over. Returns the
+        path written, or None when nothing was sampled.
+        """
+        self._dump_requested = False
+        if now is not None:
+            self._last_dump = now
+        if not self._calls and not self._syscalls:
+            return None
+
+        self._dumps += 1
+        path = os.path.join(self._directory, 'netpype-{}-{}.{}'.format(
+            os.getpid(), self._dumps, _EXTENSIONS[self._dump_format]))
+        try:
+            if self._dump_format == 'pstats':
+                with open(path, 'wb') as dump_file:
+                    marshal.dump(self.pstats(), dump_file)
+            else:
+                with open(path, 'w') as dump_file:
+                    dump_file.writelines(
+                        line + '\n' for line in self.collapsed())
+        except IOError as ioe:
+            _LOG.error('Unable to write profile {}: {}'.format(path, ioe))
+            return None
+        finally:
+            self._calls = dict()
+            self._syscalls = dict()
+            self._recorders = dict()
+        _LOG.info('Wrote profile {}.'.format(path))
+        return path
+
+    def pstats(self):
+        """
+        Returns the scaled totals as the stats dict that pstats loads.
+        """
+        rate = self.sample_rate
+        stats = dict()
+        for (event_signal, handler_class, name), totals in self._calls.items():
+            calls = totals[0] * rate
+            seconds = totals[1] * rate
+            filename, line = totals[2]
+            function = (filename, line, '{}.{}'.format(
+                handler_class.__name__, name))
+            caller = ('~', 0, '<{}>'.format(_signal_name(event_signal)))
+            _add_stats(stats, function, calls, seconds, seconds,
+                       {caller: (calls, calls, seconds, seconds)})
+            _add_stats(stats, caller, calls, 0.0, seconds, {})
+        for (selector, call), totals in self._syscalls.items():
+            seconds = totals[1] * rate
+            _add_stats(stats, ('~', 0, '<{}.{}>'.format(selector, call)),
+                       totals[0] * rate, seconds, seconds, {})
+        return stats
+
+    def collapsed(self):
+        """
+        Returns the scaled totals as collapsed stack lines weighted in
+        microseconds.
+        """
+        rate = self.sample_rate
+        lines = list()
+        for (event_signal, handler_class, name), totals in self._calls.items():
+            lines.append('netpype;{};{}.{} {}'.format(
+                _signal_name(event_signal), handler_class.__name__, name,
+                int(totals[1] * rate * 1e6)))
+        for (selector, call), totals in self._syscalls.items():
+            lines.append('netpype;selector;{}.{} {}'.format(
+                selector, call, int(totals[1] * rate * 1e6)))
+        return sorted(lines)
+
+
+def _signal_name(event_signal):
+    return _SIGNAL_NAMES.get(event_signal, str(event_signal))
+
+
+def _code_location(method):
+    # Compiled handlers have no code object to point at
+    code = getattr(getattr(method, '__func__', None), '__code__', None)
+    if code is None:
+        return ('~', 0)
+    return (code.co_filename, code.co_firstlineno)
+
+
+def _add_stats(stats, function, calls, own_seconds, seconds, callers):
+    entry = stats.get(function)
+    if entry is not None:
+        merged = dict(entry[4])
+        for caller, totals in callers.items():
+            if caller in merged:
+                totals = tuple(a + b for a, b in zip(merged[caller], totals))
+            merged[caller] = totals
+        callers = merged
+        calls += entry[1]
+        own_seconds += entry[2]
+        seconds += entry[3]
+    stats[function] = (calls, calls, own_seconds, seconds, callers)
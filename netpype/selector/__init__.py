@@ -4,20 +4,63 @@ import netpype.env as env
 
 from netpype.server.poll import PollSelectorServer
 from netpype.server.epoll import EPollSelectorServer
+from netpype.server.epoll import EdgeTriggeredEPollSelectorServer
+from netpype.server.cluster import SelectorServerCluster
+from netpype.server.datagram import DatagramServer
+
+try:
+    from netpype.server.aio import AsyncioSelectorServer
+except ImportError:
+    AsyncioSelectorServer = None
 
 
 _LOG = env.get_logger('netpype.selector')
 _USE_GENERIC = env.get('GENERIC', False)
 
 
-def new_server(socket_addr, pipeline_factory):
+def _server_class(edge_triggered=False, use_asyncio=False):
+    if use_asyncio:
+        if AsyncioSelectorServer is not None:
+            _LOG.info('Selecting asyncio implementation.')
+            return AsyncioSelectorServer
+        _LOG.warn('The asyncio implementation requires asyncio.')
+
+    if edge_triggered:
+        if hasattr(select, 'epoll'):
+            _LOG.info('Selecting edge triggered EPoll implementation.')
+            return EdgeTriggeredEPollSelectorServer
+        _LOG.warn('Edge triggered polling requires epoll.')
+
     if not _USE_GENERIC:
-        if sys.platform == "linux2" and getattr(select, 'epoll'):
+        if sys.platform.startswith('linux') and hasattr(select, 'epoll'):
             _LOG.info('Selecting EPoll implementation.')
-            return EPollSelectorServer(socket_addr, pipeline_factory)
+            return EPollSelectorServer
         elif sys.platform == 'darwin':
             pass
         elif sys.platform == 'win32' or sys.platform == 'cygwin':
             pass
     _LOG.info('Selecting generic Poll implementation.')
-    return PollSelectorServer(socket_addr, pipeline_factory)
+    return PollSelectorServer
+
+
+def new_server(socket_addr, pipeline_factory, edge_triggered=False,
+               use_asyncio=False, **kwargs):
+    return _server_class(edge_triggered, use_asyncio)(
+        socket_addr, pipeline_factory, **kwargs)
+
+
+def new_cluster(socket_addr, pipeline_factory, workers=None,
+                edge_triggered=False, use_asyncio=False, **kwargs):
+    return SelectorServerCluster(
+        _server_class(edge_triggered, use_asyncio), socket_addr,
+        pipeline_factory, workers, **kwargs)
+
+
+def new_datagram_server(socket_addr, pipeline_factory, **kwargs):
+    return DatagramServer(socket_addr, pipeline_factory, **kwargs)
+
+
+def new_datagram_cluster(socket_addr, pipeline_factory, workers=None,
+                         **kwargs):
+    return SelectorServerCluster(
+        DatagramServer, socket_addr, pipeline_factory, workers, **kwargs)
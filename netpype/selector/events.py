@@ -4,6 +4,7 @@ READ_AVAILABLE = 2
 CHANNEL_CONNECTED = 3
 CHANNEL_CLOSED = 4
 RECLAIM_CHANNEL = 5
+CHANNEL_TIMEOUT = 6
 
 # Pipline event signals
 REQUEST_WRITE = 100
@@ -11,3 +12,10 @@ REQUEST_READ = 101
 REQUEST_CLOSE = 102
 FORWARD = 103
 DISPATCH = 104
+SCHEDULE_TIMER = 105
+SEND_UPSTREAM = 106
+
+# Timeout messages
+IDLE_TIMEOUT = 200
+READ_TIMEOUT = 201
+WRITE_TIMEOUT = 202
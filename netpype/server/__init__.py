@@ -1,100 +1,763 @@
+import os
 import socket
 import select
 import errno
+import time
 import netpype.env as env
 
-from netpype import PersistentProcess
+from netpype import PersistentProcess, WorkerStateError
+from netpype.affinity import node_cpus, set_incoming_cpu
 from netpype.channel import server_socket, HandlerPipeline, ChannelPipeline
+from netpype.channel import close_socket, client_socket
+from netpype.channel import ReceiveSizer, DEFAULT_RECV_SIZE
+from netpype.channel import DEFAULT_MIN_RECV_SIZE, DEFAULT_MAX_RECV_SIZE
+from netpype.channel import ChannelBuffer, DEFAULT_HIGH_WATERMARK
+from netpype.channel import DEFAULT_LOW_WATERMARK
+from netpype.channel import PAUSED_BY_WRITE_QUEUE, PAUSED_BY_DISPATCH
+from netpype.channel import PAUSED_BY_READ_BUFFER, PAUSED_BY_MEMORY
+from netpype.channel import PAUSE_REASONS, DEFAULT_READ_HIGH_WATERMARK
+from netpype.channel import DEFAULT_READ_LOW_WATERMARK
+from netpype.channel import DEFAULT_BACKLOG, DEFAULT_ACCEPT_BATCH
+from netpype.control import DEFAULT_HEARTBEAT_INTERVAL, DEFAULT_DRAIN_TIMEOUT
+from netpype.control import DEFAULT_HANDOFF_TIMEOUT, STATE_STOPPED
+from netpype.metrics import ServerMetrics, DEFAULT_DISPATCH_SAMPLE, clock
+from netpype.metrics import POLLS, EVENTS, BYTES_READ, BYTES_WRITTEN
+from netpype.metrics import ACCEPTS, CLOSES, ACTIVE_CHANNELS, DISPATCH_SAMPLES
+from netpype.profiler import from_env as profiler_from_env
 from netpype.selector import events as selection_events
-from multiprocessing import cpu_count
+from netpype.server.upstream import ConnectionPool
+from netpype.timer import TimerWheel, DEFAULT_TICK
+from collections import deque
+from multiprocessing import Array
 
 
 _LOG = env.get_logger('netpype.server')
+_FORWARD = selection_events.FORWARD
 _EMPTY_BUFFER = b''
 
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK)
+# The connection went away before it could be accepted
+_ACCEPT_SKIP = (errno.ECONNABORTED, errno.EPROTO, errno.EINTR)
+_OUT_OF_DESCRIPTORS = (errno.EMFILE, errno.ENFILE)
+
+# Reads paused by the memory budget resume once the server holds this share
+# of it
+_MEMORY_RESUME_RATIO = 0.75
+
+# Seconds between checks on the channels of a draining server
+_DRAIN_CHECK_INTERVAL = 0.1
+
+# Flow control counters, a pause and a resume count for every pause reason
+# followed by the bytes held across every channel
+FLOW_STATS = ('write_queue_pauses', 'write_queue_resumes',
+              'dispatch_pauses', 'dispatch_resumes',
+              'read_buffer_pauses', 'read_buffer_resumes',
+              'memory_pauses', 'memory_resumes',
+              'buffered')
+_BUFFERED_STAT = len(FLOW_STATS) - 1
+_PAUSE_STAT = dict((reason, 2 * index)
+                   for index, reason in enumerate(PAUSE_REASONS))
+
+
+# Handler methods by the event that calls them
+_EVENT_FUNCTIONS = {
+    selection_events.CHANNEL_CONNECTED: 'on_connect',
+    selection_events.READ_AVAILABLE: 'on_read',
+    selection_events.WRITE_AVAILABLE: 'on_write',
+    selection_events.CHANNEL_TIMEOUT: 'on_timeout',
+}
+
 
 def network_event(signal, socket_fileno, handler_pipelines, data=None):
     if signal == selection_events.CHANNEL_CLOSED:
-        one_way_dispatch('on_close', handler_pipelines.downstream, data)
+        try:
+            for method in handler_pipelines.methods['on_close']:
+                method(data)
+        except Exception as ex:
+            _LOG.exception(ex)
         return (selection_events.RECLAIM_CHANNEL, socket_fileno, None)
 
-    if signal == selection_events.CHANNEL_CONNECTED:
-        function = 'on_connect'
-        pipeline = handler_pipelines.downstream
-    elif signal == selection_events.READ_AVAILABLE:
-        function = 'on_read'
-        pipeline = handler_pipelines.downstream
-    elif signal == selection_events.WRITE_AVAILABLE:
-        function = 'on_write'
-        pipeline = handler_pipelines.upstream
-    else:
+    try:
+        methods = handler_pipelines.methods[_EVENT_FUNCTIONS[signal]]
+    except KeyError:
         raise Exception('Unable to drive pipeline event: {}.'.format(signal))
-    return pipeline_dispatch(function, socket_fileno, pipeline, data)
-
-
-def one_way_dispatch(function, pipeline, data):
-    msg_obj = data
-
     try:
-        for handler in pipeline:
-            getattr(handler, function)(msg_obj)
+        return run_pipeline(methods, socket_fileno, data, _FORWARD)
     except Exception as ex:
         _LOG.exception(ex)
+    return None
 
 
-def pipeline_dispatch(function, socket_fileno, pipeline, data):
-    exit_signal = None
-    msg_obj = data
+def _run_pipeline(methods, socket_fileno, data, forward):
+    """
+    Calls the bound handler methods of an event in turn for as long as they
+    forward, and returns the first other result as a selector event.
+    """
+    for method in methods:
+        result = method(data)
+        if result:
+            if result[0] != forward:
+                return (result[0], socket_fileno, result[1])
+            data = result[1]
+    return None
 
-    try:
-        for handler in pipeline:
-            result = getattr(handler, function)(msg_obj)
-            if result:
-                exit_signal = result[0]
-                msg_obj = result[1]
-                if not exit_signal == selection_events.FORWARD:
-                    break
-    except Exception as ex:
-        _LOG.exception(ex)
 
-    if exit_signal:
-        return (exit_signal, socket_fileno, msg_obj)
+try:
+    from netpype.cutil import run_pipeline
+except ImportError:
+    run_pipeline = _run_pipeline
+
+
+def timed_pipeline(methods, socket_fileno, data, forward, record):
+    """
+    Runs the handler methods of an event like run_pipeline while passing each
+    method and the seconds it took to record.
+    """
+    for method in methods:
+        start = clock()
+        result = method(data)
+        record(method, clock() - start)
+        if result:
+            if result[0] != forward:
+                return (result[0], socket_fileno, result[1])
+            data = result[1]
     return None
 
 
 class SelectorServer(PersistentProcess):
 
-    def __init__(self, socket_addr, pipeline_factory):
+    def __init__(self, socket_addr, pipeline_factory, reuse_port=False,
+                 recv_size=DEFAULT_RECV_SIZE,
+                 min_recv_size=DEFAULT_MIN_RECV_SIZE,
+                 max_recv_size=DEFAULT_MAX_RECV_SIZE,
+                 rcvbuf=None, sndbuf=None, zero_copy=False,
+                 high_watermark=DEFAULT_HIGH_WATERMARK,
+                 low_watermark=DEFAULT_LOW_WATERMARK,
+                 idle_timeout=None, read_timeout=None, write_timeout=None,
+                 timer_tick=DEFAULT_TICK, backlog=DEFAULT_BACKLOG,
+                 accept_batch=DEFAULT_ACCEPT_BATCH, max_channels=None,
+                 read_high_watermark=DEFAULT_READ_HIGH_WATERMARK,
+                 read_low_watermark=DEFAULT_READ_LOW_WATERMARK,
+                 memory_budget=None,
+                 dispatch_sample=DEFAULT_DISPATCH_SAMPLE, profiler=None,
+                 cpus=None, incoming_cpu=None, dispatch_cpus=None):
         super(SelectorServer, self).__init__(
-            'SelectorServer - {}'.format(socket_addr))
+            'SelectorServer - {}'.format(socket_addr), cpus=cpus)
         self._socket_addr = socket_addr
         self._pipeline_factory = pipeline_factory
+        self._reuse_port = reuse_port
+        self._recv_sizing = (recv_size, min_recv_size, max_recv_size)
+        self._rcvbuf = rcvbuf
+        self._sndbuf = sndbuf
+        self._zero_copy = zero_copy
+        self._watermarks = (high_watermark, low_watermark)
+        self._idle_timeout = idle_timeout
+        self._read_timeout = read_timeout
+        self._write_timeout = write_timeout
+        self._timer_tick = timer_tick
+        self._backlog = backlog
+        self._accept_batch = accept_batch
+        self._max_channels = max_channels
+        self._accept_paused = False
+        if read_low_watermark > read_high_watermark:
+            raise ValueError('The read low watermark is above the high one.')
+        self._read_watermarks = (read_high_watermark, read_low_watermark)
+        self._memory_budget = memory_budget
+        self._buffered = 0
+        self._memory_paused = set()
+        # Written by the server process and read from any other
+        self._flow_stats = Array('l', len(FLOW_STATS), lock=False)
+        self._metrics = ServerMetrics()
+        self._counters = self._metrics.counters
+        # Handlers are timed on one in dispatch_sample events, never with 0
+        self._dispatch_sample = dispatch_sample
+        self._sample_countdown = dispatch_sample
+        self._woke = None
+        self._profiler = profiler if profiler is not None else (
+            profiler_from_env())
+        # Fail early on a bad sizing configuration
+        ReceiveSizer(*self._recv_sizing)
+        ChannelBuffer(b'', *self._watermarks)
+        TimerWheel(timer_tick)
         self._active_channels = dict()
+        self._watchers = dict()
+        self._dispatch_pool = None
+        self._dispatch_backlog = deque()
+        self._pools = dict()
+        self._incoming_cpu = incoming_cpu
+        self._dispatch_cpus = dispatch_cpus
+        self._listener = None
+        self._draining = False
+        self._drain_deadline = None
+        self._handed_off = False
 
     def on_start(self):
         # Init everything else we need now that we're in the sub-process
-        self._workers = Pool(processes=cpu_count())
-        self._socket = server_socket(self._socket_addr)
+        if self._listener is not None:
+            self._socket = self._listener
+            self._socket.setblocking(0)
+        else:
+            self._socket = server_socket(
+                self._socket_addr,
+                reuse_port=self._reuse_port,
+                rcvbuf=self._rcvbuf,
+                sndbuf=self._sndbuf,
+                backlog=self._backlog)
+        if self._incoming_cpu is not None:
+            set_incoming_cpu(self._socket, self._incoming_cpu)
         self._socket_fileno = self._socket.fileno()
+        self._now = time.time()
+        self._timers = TimerWheel(self._timer_tick, now=self._now)
+        if self._profiler is not None:
+            self._profiler.start(self._now)
+        for name, upstream in self._pipeline_factory.upstreams().items():
+            self._pools[name] = ConnectionPool(self, name, upstream)
 
     def on_halt(self):
         if hasattr(self, '_socket'):
-            self._socket.close()
-        if hasattr(self, '_workers'):
-            self._workers.close()
-            self._workers.join()
-
-    def dispatch(self, event):
-        self._workers().apply()
+            if self._handed_off:
+                # The socket file belongs to the next generation now
+                self._socket.close()
+            else:
+                close_socket(self._socket, self._socket_addr)
+        if self._dispatch_pool is not None:
+            self._dispatch_pool.close()
+            self._dispatch_pool = None
+        if self._profiler is not None:
+            self._profiler.dump()
+
+    def inherit(self, listener):
+        """
+        Serves on a listening socket handed off by an earlier generation
+        instead of binding a new one. Must be called before start.
+        """
+        self._listener = listener
+
+    def handoff(self, successor, timeout=DEFAULT_DRAIN_TIMEOUT,
+                handoff_timeout=DEFAULT_HANDOFF_TIMEOUT):
+        """
+        Restarts the server as successor, an unstarted server for the same
+        address. The worker sends its listening socket to this process and
+        drains, and the successor is started on that same socket, so
+        connections waiting to be accepted are never refused. Returns the
+        started successor.
+        """
+        self._control.request_drain(time.time() + timeout, handoff=True)
+        try:
+            listener = self._control.receive_listener(handoff_timeout)
+        except (IOError, OSError) as ioe:
+            raise WorkerStateError(
+                'Worker did not hand off its listener: {}'.format(ioe))
+        try:
+            successor.inherit(listener)
+            successor.start()
+        finally:
+            listener.close()
+        return successor
+
+    def on_drain(self, deadline):
+        """
+        Stops accepting and closes every channel once its handlers hold no
+        bytes and its writes and dispatched tasks are done. Channels to
+        upstreams close once the other channels are gone and their pool has
+        sent its backlog. Whatever is left when the deadline passes is closed
+        as it is, and the worker stops when no channels remain.
+        """
+        self._now = time.time()
+        self._draining = True
+        self._drain_deadline = deadline
+        if self._control.handing_off():
+            self._control.send_listener(self._socket)
+            self._handed_off = True
+        self._stop_accepting()
+        self._check_drain()
+
+    def _stop_accepting(self):
+        self._accept_paused = True
+        self._listener_interest(False)
+
+    def _on_drain_check(self, timer):
+        self._check_drain()
+
+    def _check_drain(self):
+        expired = self._now >= self._drain_deadline
+        channels = list(self._active_channels.values())
+        if expired and channels:
+            _LOG.warn('Drain deadline passed, closing {} channels.'.format(
+                len(channels)))
+
+        downstream = 0
+        for channel_handler in channels:
+            if channel_handler.pool is None:
+                if expired or self._finished(channel_handler):
+                    self._handle_result((
+                        selection_events.REQUEST_CLOSE,
+                        channel_handler.fileno, None))
+                else:
+                    downstream += 1
+
+        for channel_handler in channels:
+            pool = channel_handler.pool
+            if pool is not None and self._is_active(channel_handler) and (
+                    expired or (downstream == 0 and pool.backlog() == 0 and
+                                not self._write_pending(channel_handler))):
+                pool.retire(channel_handler)
+
+        if self._active_channels:
+            self._schedule(_DRAIN_CHECK_INTERVAL, self._on_drain_check, None)
+        else:
+            self._control.set_state(STATE_STOPPED)
+            self._control.wake()
+
+    def _finished(self, channel_handler):
+        if (channel_handler.dispatch_backlog > 0 or
+                channel_handler.dispatched > 0 or
+                self._write_pending(channel_handler)):
+            return False
+        for gauge in channel_handler.read_gauges:
+            if gauge() > 0:
+                return False
+        return True
+
+    def flow_stats(self):
+        """
+        Returns the flow control counters of the server as a dict. The
+        counters are kept by the server process and can be read from the
+        process that started it.
+        """
+        return dict(zip(FLOW_STATS, self._flow_stats))
+
+    def metrics(self):
+        """
+        Returns a snapshot of the server's loop metrics, see
+        netpype.metrics.ServerMetrics, along with its flow control counters.
+        Like the flow control counters it can be taken from the process that
+        started the server.
+        """
+        snapshot = self._metrics.snapshot()
+        snapshot['flow'] = self.flow_stats()
+        return snapshot
+
+    def _pause_reads(self, channel_handler, reason):
+        if not channel_handler.paused_by(reason):
+            channel_handler.pause_reads(reason)
+            self._flow_stats[_PAUSE_STAT[reason]] += 1
+
+    def _resume_reads(self, channel_handler, reason):
+        if channel_handler.paused_by(reason):
+            channel_handler.resume_reads(reason)
+            self._flow_stats[_PAUSE_STAT[reason] + 1] += 1
+
+    def _measure(self, channel_handler):
+        """
+        Takes stock of the bytes the handlers of a channel hold and pauses or
+        resumes its reads against the read watermarks. With a memory budget
+        the channel's queued writes count toward the server's total as well,
+        and channels that hold more than the read low watermark stop reading
+        while the total is over budget.
+        """
+        held = 0
+        for gauge in channel_handler.read_gauges:
+            held += gauge()
+
+        high_watermark, low_watermark = self._read_watermarks
+        paused = channel_handler.read_paused
+        if held >= high_watermark:
+            self._pause_reads(channel_handler, PAUSED_BY_READ_BUFFER)
+        elif held <= low_watermark:
+            self._resume_reads(channel_handler, PAUSED_BY_READ_BUFFER)
+
+        if self._memory_budget is not None:
+            buffered = held + self._write_buffered(channel_handler)
+            self._buffered += buffered - channel_handler.buffered
+            self._flow_stats[_BUFFERED_STAT] = self._buffered
+            channel_handler.buffered = buffered
+            if self._buffered > self._memory_budget:
+                if held > low_watermark:
+                    self._pause_reads(channel_handler, PAUSED_BY_MEMORY)
+                    self._memory_paused.add(channel_handler)
+            else:
+                self._check_budget()
+
+        if channel_handler.read_paused != paused:
+            self._interest_changed(channel_handler)
+
+    def _check_budget(self):
+        if (not self._memory_paused or self._buffered >
+                self._memory_budget * _MEMORY_RESUME_RATIO):
+            return
+        paused = self._memory_paused
+        self._memory_paused = set()
+        for channel_handler in paused:
+            if self._is_active(channel_handler):
+                self._resume_reads(channel_handler, PAUSED_BY_MEMORY)
+                self._interest_changed(channel_handler)
+
+    def _write_buffered(self, channel_handler):
+        return channel_handler.write_buffer.size()
+
+    def _watch(self, fileno, callback):
+        """
+        Polls a descriptor that isn't a channel for reads and calls back
+        when it becomes readable.
+        """
+        self._watchers[fileno] = callback
+        self._register_watcher(fileno)
+
+    def _watch_control(self):
+        # Called by every backend once its selector is up
+        self._watch(self.wakeup_fileno(), self._on_control)
+
+    def dispatch(self, channel_handler, task):
+        if self._dispatch_pool is None:
+            self._dispatch_pool = self._pipeline_factory.dispatch_pool()
+            if self._dispatch_pool.cpus is None:
+                self._dispatch_pool.cpus = self._dispatch_placement()
+            self._dispatch_pool.start()
+            self._watch(
+                self._dispatch_pool.fileno(), self._on_dispatch_complete)
+
+        if (channel_handler.dispatch_backlog == 0 and
+                self._dispatch_pool.submit(channel_handler, task)):
+            channel_handler.dispatched += 1
+        else:
+            # Hold the task back and stop reading until the pool catches up
+            self._dispatch_backlog.append((channel_handler, task))
+            channel_handler.dispatch_backlog += 1
+            self._pause_reads(channel_handler, PAUSED_BY_DISPATCH)
+            self._interest_changed(channel_handler)
+
+    def _dispatch_placement(self):
+        # A pinned server keeps its dispatch workers on its own NUMA nodes
+        if self._dispatch_cpus:
+            return tuple(self._dispatch_cpus)
+        if self._cpus:
+            return tuple(node_cpus(self._cpus))
+        return None
+
+    def _on_dispatch_complete(self):
+        pool = self._dispatch_pool
+        for channel_handler, result in pool.completions():
+            channel_handler.dispatched -= 1
+            if result and self._is_active(channel_handler):
+                self._handle_result(
+                    (result[0], channel_handler.fileno, result[1]))
+
+        backlog = self._dispatch_backlog
+        while backlog and not pool.full():
+            channel_handler, task = backlog.popleft()
+            channel_handler.dispatch_backlog -= 1
+            if not self._is_active(channel_handler):
+                continue
+            pool.submit(channel_handler, task)
+            channel_handler.dispatched += 1
+            if channel_handler.dispatch_backlog == 0:
+                self._resume_reads(channel_handler, PAUSED_BY_DISPATCH)
+                self._interest_changed(channel_handler)
+
+    def connect(self, socket_addr, pipeline_factory, pool=None, rcvbuf=None,
+                sndbuf=None):
+        """
+        Opens an outbound channel to socket_addr whose events drive a
+        pipeline built by pipeline_factory. The connect is finished by the
+        polling loop, after which the pipeline receives its connect event
+        like an accepted channel would. A connect that fails closes the
+        channel instead. Connects that fail straight away raise IOError.
+        """
+        channel = client_socket(socket_addr, rcvbuf, sndbuf)
+        channel_handler = ChannelPipeline(
+            channel,
+            HandlerPipeline(pipeline_factory),
+            socket_addr,
+            ReceiveSizer(*self._recv_sizing),
+            ChannelBuffer(b'', *self._watermarks))
+        channel_handler.connecting = True
+        channel_handler.pool = pool
+        self._active_channels[channel_handler.fileno] = channel_handler
+        self._start_connect(channel_handler)
+        return channel_handler
+
+    def _start_connect(self, channel_handler):
+        # Connects finish when the channel polls writable
+        self._register(channel_handler.fileno)
+        channel_handler.write_interest = True
+        self._interest_changed(channel_handler)
+
+    def _finish_connect(self, channel_handler):
+        """
+        Finishes the connect of an outbound channel that polled writable and
+        returns whether it has connected. Raises IOError when it failed.
+        """
+        channel = channel_handler.channel
+        error = channel.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error:
+            raise IOError(error, os.strerror(error))
+        try:
+            channel.getpeername()
+        except socket.error as se:
+            # Edge triggered servers may look before the connect is done
+            if se.errno == errno.ENOTCONN:
+                return False
+            raise
+        channel_handler.connecting = False
+        self._connect_complete(channel_handler)
+        return True
+
+    def _connect_complete(self, channel_handler):
+        channel_handler.write_interest = self._write_pending(channel_handler)
+        self._interest_changed(channel_handler)
+        self._connected(channel_handler)
+        if channel_handler.pool is not None and self._is_active(
+                channel_handler):
+            channel_handler.pool.connected(channel_handler)
+
+    def _send_upstream(self, name, message):
+        pool = self._pools.get(name)
+        if pool is None:
+            _LOG.error('No upstream named {}.'.format(name))
+            return
+        pool.send(message)
+
+    def _on_wakeup(self, events=None):
+        # One clock reading serves every event handled after a poll
+        self._now = time.time()
+        if self._profiler is not None and self._profiler.dump_due(self._now):
+            self._profiler.dump(self._now)
+        if events is not None:
+            self._woke = clock()
+            counters = self._counters
+            counters[POLLS] += 1
+            counters[EVENTS] += events
+            self._metrics.events_per_poll.record(events)
+
+    def _poll_timeout(self):
+        # Idle workers still come round to beat their heartbeat
+        timeout = self._timers.timeout()
+        if timeout < 0 or timeout > DEFAULT_HEARTBEAT_INTERVAL:
+            return DEFAULT_HEARTBEAT_INTERVAL
+        return timeout
+
+    def _connected(self, channel_handler):
+        self._active_channels[channel_handler.fileno] = channel_handler
+        self._counters[ACTIVE_CHANNELS] = len(self._active_channels)
+        self._arm_timers(channel_handler)
+        self._network_event(
+            selection_events.CHANNEL_CONNECTED,
+            channel_handler.fileno,
+            channel_handler.pipeline,
+            channel_handler.client_addr)
+
+    def _arm_timers(self, channel_handler):
+        channel_handler.last_read = self._now
+        channel_handler.last_write = self._now
+        if self._idle_timeout:
+            channel_handler.idle_timer = self._schedule(
+                self._idle_timeout, self._on_idle_timeout, channel_handler)
+        if self._read_timeout:
+            channel_handler.read_timer = self._schedule(
+                self._read_timeout, self._on_read_timeout, channel_handler)
+
+    def _schedule(self, delay, callback, payload):
+        return self._timers.schedule(delay, callback, payload, self._now)
+
+    def _cancel_timers(self, channel_handler):
+        for timer in (channel_handler.idle_timer,
+                      channel_handler.read_timer,
+                      channel_handler.write_timer):
+            if timer is not None:
+                self._timers.cancel(timer)
+        for timer in channel_handler.timers:
+            self._timers.cancel(timer)
+        channel_handler.idle_timer = None
+        channel_handler.read_timer = None
+        channel_handler.write_timer = None
+        channel_handler.timers.clear()
+
+    def _rearm(self, timer, last_active, timeout):
+        """
+        Schedules the next check of a channel deadline. Activity is only
+        recorded as a timestamp so a check that finds the channel was active
+        since it was scheduled waits out the rest of the period instead.
+        """
+        remaining = last_active + timeout - self._now
+        if remaining <= 0:
+            remaining = timeout
+        return self._schedule(remaining, timer.callback, timer.payload)
+
+    def _on_idle_timeout(self, timer):
+        channel_handler = timer.payload
+        last_active = max(channel_handler.last_read,
+                          channel_handler.last_write)
+        channel_handler.idle_timer = self._rearm(
+            timer, last_active, self._idle_timeout)
+        if last_active + self._idle_timeout <= self._now:
+            self._deadline_passed(
+                channel_handler, selection_events.IDLE_TIMEOUT)
+
+    def _on_read_timeout(self, timer):
+        channel_handler = timer.payload
+        # Channels that aren't reading can't be late with a read
+        if not channel_handler.reading():
+            channel_handler.last_read = self._now
+        channel_handler.read_timer = self._rearm(
+            timer, channel_handler.last_read, self._read_timeout)
+        if channel_handler.last_read + self._read_timeout <= self._now:
+            self._deadline_passed(
+                channel_handler, selection_events.READ_TIMEOUT)
+
+    def _on_write_timeout(self, timer):
+        channel_handler = timer.payload
+        if not self._write_pending(channel_handler):
+            channel_handler.write_timer = None
+            return
+        channel_handler.write_timer = self._rearm(
+            timer, channel_handler.last_write, self._write_timeout)
+        if channel_handler.last_write + self._write_timeout <= self._now:
+            self._deadline_passed(
+                channel_handler, selection_events.WRITE_TIMEOUT)
+
+    def _schedule_timer(self, channel_handler, delay, message):
+        channel_handler.timers.add(self._schedule(
+            delay, self._on_handler_timer, (channel_handler, message)))
+
+    def _on_handler_timer(self, timer):
+        channel_handler, message = timer.payload
+        channel_handler.timers.discard(timer)
+        self._timed_out(channel_handler, message)
+
+    def _deadline_passed(self, channel_handler, deadline):
+        # Channels that no handler looks after are closed at their deadlines
+        if channel_handler.pipeline.methods['on_timeout']:
+            self._timed_out(channel_handler, deadline)
+        elif self._is_active(channel_handler):
+            self._handle_result((
+                selection_events.REQUEST_CLOSE, channel_handler.fileno, None))
+
+    def _timed_out(self, channel_handler, message):
+        if self._is_active(channel_handler):
+            self._network_event(
+                selection_events.CHANNEL_TIMEOUT,
+                channel_handler.fileno,
+                channel_handler.pipeline,
+                message)
 
     def _network_event(self, signal, fileno, pipeline, data=None):
+        profiler = self._profiler
         try:
-            result = network_event(signal, fileno, pipeline, data)
+            if profiler is not None and profiler.sample():
+                result = self._profiled_event(signal, fileno, pipeline, data)
+            elif self._sample_countdown != 1:
+                self._sample_countdown -= 1
+                result = network_event(signal, fileno, pipeline, data)
+            else:
+                self._sample_countdown = self._dispatch_sample
+                result = self._timed_event(signal, fileno, pipeline, data)
             if result:
                 self._handle_result(result)
         except IOError as ioe:
             self._handle_result
 
+        channel_handler = self._active_channels.get(fileno)
+        if channel_handler is not None and (
+                channel_handler.read_gauges or self._memory_budget is not None):
+            self._measure(channel_handler)
+
+    def _timed_event(self, signal, fileno, pipeline, data):
+        function = _EVENT_FUNCTIONS.get(signal)
+        if function is None:
+            return network_event(signal, fileno, pipeline, data)
+        self._counters[DISPATCH_SAMPLES] += 1
+        try:
+            return timed_pipeline(pipeline.methods[function], fileno, data,
+                                  _FORWARD, self._record_latency)
+        except Exception as ex:
+            _LOG.exception(ex)
+        return None
+
+    def _record_latency(self, method, seconds):
+        histogram = self._metrics.handler(type(method.__self__))
+        if histogram is not None:
+            histogram.record(seconds * 1e9)
+
+    def _profiled_event(self, signal, fileno, pipeline, data):
+        profile = self._profiler.recorder(signal)
+
+        def record(method, seconds):
+            # Profiled calls count toward the latency metrics as well
+            profile(method, seconds)
+            self._record_latency(method, seconds)
+
+        if signal == selection_events.CHANNEL_CLOSED:
+            try:
+                for method in pipeline.methods['on_close']:
+                    start = clock()
+                    method(data)
+                    record(method, clock() - start)
+            except Exception as ex:
+                _LOG.exception(ex)
+            return (selection_events.RECLAIM_CHANNEL, fileno, None)
+
+        function = _EVENT_FUNCTIONS.get(signal)
+        if function is None:
+            return network_event(signal, fileno, pipeline, data)
+        try:
+            return timed_pipeline(pipeline.methods[function], fileno, data,
+                                  _FORWARD, record)
+        except Exception as ex:
+            _LOG.exception(ex)
+        return None
+
+    def _profiled(self, selector, name):
+        # Selector calls are only sampled while profiling
+        if self._profiler is None:
+            return selector
+        return self._profiler.selector(selector, name)
+
+    def _on_accept(self):
+        """
+        Accepts the connections waiting on the listener, up to the accept
+        batch size per wakeup. The listener stops being polled once the
+        server holds its maximum number of channels.
+        """
+        for _ in range(self._accept_batch):
+            if self._at_capacity():
+                break
+            try:
+                handler = self._accept(self._socket, self._pipeline_factory)
+            except socket.error as se:
+                if se.errno in _WOULD_BLOCK:
+                    break
+                if se.errno in _ACCEPT_SKIP:
+                    continue
+                if se.errno in _OUT_OF_DESCRIPTORS:
+                    _LOG.error('Out of descriptors, unable to accept.')
+                    # Wait for a channel to give its descriptor back
+                    if self._active_channels:
+                        self._pause_accepting()
+                    break
+                raise
+            self._register(handler.fileno)
+            self._counters[ACCEPTS] += 1
+            self._connected(handler)
+
+        if self._at_capacity():
+            self._pause_accepting()
+
+    def _at_capacity(self):
+        return (self._max_channels is not None and
+                len(self._active_channels) >= self._max_channels)
+
+    def _pause_accepting(self):
+        if not self._accept_paused:
+            self._accept_paused = True
+            self._listener_interest(False)
+
+    def _resume_accepting(self):
+        if (self._accept_paused and not self._at_capacity() and
+                not self._draining):
+            self._accept_paused = False
+            self._listener_interest(True)
+
     def _accept(self, socket, pipeline_factory):
         # Gimme dat socket
         channel, address = socket.accept()
@@ -107,7 +770,100 @@ class SelectorServer(PersistentProcess):
         return ChannelPipeline(
             channel,
             HandlerPipeline(pipeline_factory),
-            address)
+            address,
+            ReceiveSizer(*self._recv_sizing),
+            ChannelBuffer(b'', *self._watermarks))
+
+    def _is_active(self, channel_handler):
+        return self._active_channels.get(
+            channel_handler.fileno) is channel_handler
+
+    def _recv(self, channel_handler):
+        if self._zero_copy:
+            if self._recv_into(channel_handler) == 0:
+                return _EMPTY_BUFFER
+            return self._take_read(channel_handler)
+
+        sizer = channel_handler.recv_sizer
+        read = channel_handler.channel.recv(sizer.size)
+        sizer.record(len(read))
+        self._counters[BYTES_READ] += len(read)
+        channel_handler.last_read = self._now
+        return read
+
+    def _recv_into(self, channel_handler):
+        sizer = channel_handler.recv_sizer
+        read_buffer = channel_handler.read_buffer
+        read = channel_handler.channel.recv_into(
+            read_buffer.writable_view(sizer.size), sizer.size)
+        read_buffer.commit(read)
+        sizer.record(read)
+        self._counters[BYTES_READ] += read
+        channel_handler.last_read = self._now
+        return read
+
+    def _take_read(self, channel_handler):
+        # The read buffer is recycled as soon as the pipeline returns
+        read_buffer = channel_handler.read_buffer
+        read = read_buffer.readable_view()
+        read_buffer.clear()
+        if self._zero_copy:
+            channel_handler.read_source = read.obj
+            return read
+        return read.tobytes()
+
+    def _detached(self, channel_handler, message):
+        """
+        Returns message, copied if it is a view over the channel's read buffer
+        so that it stays intact once the buffer is read into again.
+        """
+        if (isinstance(message, memoryview) and
+                message.obj is channel_handler.read_source):
+            return message.tobytes()
+        return message
+
+    def _write_pending(self, channel_handler):
+        return not channel_handler.write_buffer.empty()
+
+    def _close_channel(self, channel_handler):
+        try:
+            channel_handler.channel.close()
+        except IOError:
+            pass
+
+    def _write(self, channel_handler):
+        if channel_handler.connecting:
+            self._finish_connect(channel_handler)
+            return
+        self._counters[BYTES_WRITTEN] += channel_handler.write_buffer.send(
+            channel_handler.channel)
+        self._sent(channel_handler)
+
+    def _sent(self, channel_handler):
+        write_buffer = channel_handler.write_buffer
+        interest_changed = False
+        channel_handler.last_write = self._now
+
+        if (channel_handler.paused_by(PAUSED_BY_WRITE_QUEUE) and
+                write_buffer.below_low_watermark()):
+            self._resume_reads(channel_handler, PAUSED_BY_WRITE_QUEUE)
+            interest_changed = True
+
+        if write_buffer.empty():
+            if channel_handler.write_timer is not None:
+                self._timers.cancel(channel_handler.write_timer)
+                channel_handler.write_timer = None
+            channel_handler.write_interest = False
+            self._interest_changed(channel_handler)
+            self._network_event(
+                selection_events.WRITE_AVAILABLE,
+                channel_handler.fileno,
+                channel_handler.pipeline)
+            if channel_handler.pool is not None and self._is_active(
+                    channel_handler):
+                channel_handler.pool.drained(channel_handler)
+        elif interest_changed:
+            self._interest_changed(channel_handler)
 
     def _handle_result(self, result):
         result_signal = result[0]
@@ -115,14 +871,38 @@ class SelectorServer(PersistentProcess):
 
         channel_handler = self._active_channels.get(result_fileno)
         if result_signal == selection_events.REQUEST_READ:
-            self._read_requested(result_fileno)
+            channel_handler.read_interest = True
+            self._interest_changed(channel_handler)
         elif result_signal == selection_events.REQUEST_WRITE:
-            channel_handler.write_buffer.set_buffer(result[2])
-            self._write_requested(result_fileno)
+            write_buffer = channel_handler.write_buffer
+            write_buffer.put(self._detached(channel_handler, result[2]))
+            channel_handler.write_interest = True
+
+            if self._write_timeout and channel_handler.write_timer is None:
+                channel_handler.last_write = self._now
+                channel_handler.write_timer = self._schedule(
+                    self._write_timeout, self._on_write_timeout,
+                    channel_handler)
+
+            # Stop reading from clients that don't keep up with their writes
+            if write_buffer.above_high_watermark():
+                self._pause_reads(channel_handler, PAUSED_BY_WRITE_QUEUE)
+            self._interest_changed(channel_handler)
         elif result_signal == selection_events.DISPATCH:
-            self.dispatch((channel_handler.address, result[2]))
+            function, message = result[2]
+            self.dispatch(channel_handler, (
+                function, self._detached(channel_handler, message)))
+        elif result_signal == selection_events.SCHEDULE_TIMER:
+            delay, message = result[2]
+            self._schedule_timer(
+                channel_handler, delay,
+                self._detached(channel_handler, message))
+        elif result_signal == selection_events.SEND_UPSTREAM:
+            name, message = result[2]
+            self._send_upstream(
+                name, self._detached(channel_handler, message))
         elif result_signal == selection_events.REQUEST_CLOSE:
-            channel_handler.write_buffer.set_buffer(_EMPTY_BUFFER)
+            channel_handler.write_buffer.clear()
 
             # Try to gracefully start the closing process for the socket
             try:
@@ -138,16 +918,27 @@ class SelectorServer(PersistentProcess):
                 channel_handler.client_addr)
         elif result_signal == selection_events.RECLAIM_CHANNEL:
             del self._active_channels[result_fileno]
-            try:
-                channel_handler.channel.close()
-            except IOError:
-                pass
+            self._counters[CLOSES] += 1
+            self._counters[ACTIVE_CHANNELS] = len(self._active_channels)
+            self._cancel_timers(channel_handler)
+            self._close_channel(channel_handler)
+            self._resume_accepting()
+            if self._memory_budget is not None:
+                self._buffered -= channel_handler.buffered
+                self._flow_stats[_BUFFERED_STAT] = self._buffered
+                self._memory_paused.discard(channel_handler)
+                self._check_budget()
+            if channel_handler.pool is not None:
+                channel_handler.pool.closed(channel_handler)
         else:
             _LOG.debug('Unrecognized event: {} passed.'.format(result_signal))
 
     def process(self):
         try:
             self._poll()
+            self._timers.expire(self._now)
+            if self._woke is not None:
+                self._metrics.loop_time.record((clock() - self._woke) * 1e9)
         except IOError as ioe:
             if ioe.errno == errno.EINTR:
                 _LOG.warn('Interrupt caught, exiting.')
@@ -157,10 +948,16 @@ class SelectorServer(PersistentProcess):
     def _poll(self):
         raise NotImplementedError
 
-    def _read_requested(self, fileno):
+    def _interest_changed(self, channel_handler):
+        raise NotImplementedError
+
+    def _register(self, fileno):
+        raise NotImplementedError
+
+    def _register_watcher(self, fileno):
         raise NotImplementedError
 
-    def _write_requested(self, fileno, data):
+    def _listener_interest(self, polling):
         raise NotImplementedError
 
     def _channel_closed(self, fileno):
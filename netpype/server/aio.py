@@ -0,0 +1,306 @@
+import asyncio
+import signal
+import time
+import netpype.env as env
+
+from netpype.server import SelectorServer
+from netpype.channel import HandlerPipeline, ChannelPipeline
+from netpype.channel import ReceiveSizer, ChannelBuffer
+from netpype.channel import PAUSED_BY_WRITE_QUEUE
+from netpype.control import DEFAULT_HEARTBEAT_INTERVAL
+from netpype.metrics import ACCEPTS, BYTES_READ, BYTES_WRITTEN
+from netpype.selector import events as selection_events
+
+
+_LOG = env.get_logger('netpype.server.aio')
+
+
+class _ChannelProtocol(asyncio.BufferedProtocol):
+
+    def __init__(self, server):
+        self._server = server
+        self.channel_handler = None
+
+    def connection_made(self, transport):
+        self._server._on_connection(self, transport)
+
+    def get_buffer(self, sizehint):
+        channel_handler = self.channel_handler
+        return channel_handler.read_buffer.writable_view(
+            channel_handler.recv_sizer.size)
+
+    def buffer_updated(self, nbytes):
+        self._server._on_buffer_updated(self.channel_handler, nbytes)
+
+    def pause_writing(self):
+        pass
+
+    def resume_writing(self):
+        self._server._on_drained(self.channel_handler)
+
+    def connection_lost(self, exc):
+        self._server._on_connection_lost(self.channel_handler)
+
+
+"""
+The asyncio server drives the same pipelines from an asyncio event loop, which
+makes any loop implementation a drop in replacement for the hand written
+selectors. Loops are built by the loop_factory option, so passing
+uvloop.new_event_loop runs the server on uvloop.
+
+Reads land in the channel's read buffer through a BufferedProtocol. Writes are
+handed straight to the transport whose write buffer limits are set to zero, so
+the protocol is told about every write backlog and about the moment it has
+drained, which is when the pipeline receives its write event.
+
+Accepting is left to the loop. A server at its channel limit cannot take its
+listener out of the loop, so it closes connections beyond the limit as soon as
+they are made instead.
+"""
+
+
+class AsyncioSelectorServer(SelectorServer):
+
+    def __init__(self, socket_addr, pipeline_factory, loop_factory=None,
+                 **kwargs):
+        super(AsyncioSelectorServer, self).__init__(
+            socket_addr, pipeline_factory, **kwargs)
+        self._loop_factory = loop_factory or asyncio.new_event_loop
+        self._timer_handle = None
+        self._timer_due = 0
+
+    def on_start(self):
+        super(AsyncioSelectorServer, self).on_start()
+        self._loop = self._loop_factory()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(self._loop.create_server(
+            lambda: _ChannelProtocol(self),
+            sock=self._socket,
+            backlog=self._backlog))
+        # Interrupts are handled by the loop so they reach its control watcher
+        self._loop.add_signal_handler(
+            signal.SIGINT, self._on_signal, signal.SIGINT, None)
+        self._watch_control()
+        self._on_heartbeat()
+
+    def on_halt(self):
+        if hasattr(self, '_server'):
+            self._server.close()
+        if hasattr(self, '_loop'):
+            self._loop.stop()
+        super(AsyncioSelectorServer, self).on_halt()
+
+    def process(self):
+        try:
+            self._loop.run_forever()
+        except Exception as ex:
+            _LOG.exception(ex)
+
+    def _stop_accepting(self):
+        self._server.close()
+
+    def _on_control(self):
+        # Return from process so the worker can act on the request
+        super(AsyncioSelectorServer, self)._on_control()
+        self._loop.stop()
+
+    def _on_heartbeat(self):
+        # The loop never returns to the worker on its own to beat
+        self._control.beat(time.time())
+        self._loop.call_later(DEFAULT_HEARTBEAT_INTERVAL, self._on_heartbeat)
+
+    def _on_connection(self, protocol, transport):
+        self._on_wakeup()
+        transport.pause_reading()
+        if protocol.channel_handler is not None:
+            # An outbound channel that has connected
+            transport.set_write_buffer_limits(high=0)
+            protocol.channel_handler.transport = transport
+            super(AsyncioSelectorServer, self)._connect_complete(
+                protocol.channel_handler)
+            return
+        if self._at_capacity():
+            transport.abort()
+            return
+
+        transport.set_write_buffer_limits(high=0)
+        channel_handler = ChannelPipeline(
+            transport.get_extra_info('socket'),
+            HandlerPipeline(self._pipeline_factory),
+            transport.get_extra_info('peername'),
+            ReceiveSizer(*self._recv_sizing),
+            ChannelBuffer(b'', *self._watermarks))
+        channel_handler.transport = transport
+        protocol.channel_handler = channel_handler
+        self._counters[ACCEPTS] += 1
+        self._connected(channel_handler)
+
+    def _on_buffer_updated(self, channel_handler, nbytes):
+        self._on_wakeup()
+        channel_handler.read_buffer.commit(nbytes)
+        channel_handler.recv_sizer.record(nbytes)
+        self._counters[BYTES_READ] += nbytes
+        channel_handler.last_read = self._now
+        self._network_event(
+            selection_events.READ_AVAILABLE,
+            channel_handler.fileno,
+            channel_handler.pipeline,
+            self._take_read(channel_handler))
+
+    def _on_drained(self, channel_handler):
+        self._on_wakeup()
+        if self._is_active(channel_handler):
+            self._sent(channel_handler)
+
+    def _on_written(self, channel_handler):
+        # Writes that went out in full never pause the protocol
+        if (self._is_active(channel_handler) and
+                not self._write_pending(channel_handler)):
+            self._on_drained(channel_handler)
+
+    def _on_connection_lost(self, channel_handler):
+        if channel_handler is None:
+            return
+        self._on_wakeup()
+        if self._is_active(channel_handler):
+            self._network_event(
+                selection_events.CHANNEL_CLOSED,
+                channel_handler.fileno,
+                channel_handler.pipeline,
+                channel_handler.client_addr)
+
+    def _start_connect(self, channel_handler):
+        channel_handler.transport = None
+        self._loop.add_writer(
+            channel_handler.fileno, self._on_connect_ready, channel_handler)
+
+    def _on_connect_ready(self, channel_handler):
+        self._on_wakeup()
+        try:
+            self._finish_connect(channel_handler)
+        except IOError:
+            self._loop.remove_writer(channel_handler.fileno)
+            self._network_event(
+                selection_events.CHANNEL_CLOSED,
+                channel_handler.fileno,
+                channel_handler.pipeline,
+                channel_handler.client_addr)
+
+    def _connect_complete(self, channel_handler):
+        # The pipeline hears about the connect once it has a transport
+        self._loop.remove_writer(channel_handler.fileno)
+        protocol = _ChannelProtocol(self)
+        protocol.channel_handler = channel_handler
+        self._loop.create_task(self._loop.connect_accepted_socket(
+            lambda: protocol, sock=channel_handler.channel))
+
+    def _on_watcher(self, fileno):
+        self._on_wakeup()
+        self._watchers[fileno]()
+
+    def _schedule(self, delay, callback, payload):
+        # The wheel is turned by a loop callback that is due no later than
+        # the earliest timer
+        timer = super(AsyncioSelectorServer, self)._schedule(
+            delay, callback, payload)
+        due = self._now + delay
+        if self._timer_handle is None or due < self._timer_due:
+            self._call_timers_at(due)
+        return timer
+
+    def _call_timers_at(self, due):
+        if self._timer_handle is not None:
+            self._timer_handle.cancel()
+        self._timer_due = due
+        self._timer_handle = self._loop.call_later(
+            max(due - self._now, 0), self._on_timer_tick)
+
+    def _on_timer_tick(self):
+        self._timer_handle = None
+        self._on_wakeup()
+        self._timers.expire(self._now)
+
+        # Timers rescheduled while expiring may not be the earliest
+        timeout = self._timers.timeout(self._now)
+        if timeout < 0:
+            if self._timer_handle is not None:
+                self._timer_handle.cancel()
+                self._timer_handle = None
+        else:
+            self._call_timers_at(self._now + timeout)
+
+    def _handle_result(self, result):
+        result_signal = result[0]
+        if result_signal == selection_events.REQUEST_WRITE:
+            channel_handler = self._active_channels.get(result[1])
+            self._request_write(
+                channel_handler, self._detached(channel_handler, result[2]))
+        elif result_signal == selection_events.REQUEST_CLOSE:
+            # Pending writes are dropped like the selectors do
+            channel_handler = self._active_channels.get(result[1])
+            if channel_handler.transport is not None:
+                channel_handler.transport.abort()
+            else:
+                # Still connecting, so there is no transport to abort
+                self._loop.remove_writer(channel_handler.fileno)
+                self._network_event(
+                    selection_events.CHANNEL_CLOSED,
+                    channel_handler.fileno,
+                    channel_handler.pipeline,
+                    channel_handler.client_addr)
+        else:
+            super(AsyncioSelectorServer, self)._handle_result(result)
+
+    def _request_write(self, channel_handler, data):
+        transport = channel_handler.transport
+        channel_handler.write_interest = True
+        transport.write(data)
+        # Bytes count as written once the transport takes them
+        self._counters[BYTES_WRITTEN] += len(data)
+
+        if not self._write_pending(channel_handler):
+            self._loop.call_soon(self._on_written, channel_handler)
+            return
+
+        if self._write_timeout and channel_handler.write_timer is None:
+            channel_handler.last_write = self._now
+            channel_handler.write_timer = self._schedule(
+                self._write_timeout, self._on_write_timeout,
+                channel_handler)
+
+        # Stop reading from clients that don't keep up with their writes
+        high_watermark = self._watermarks[0]
+        if transport.get_write_buffer_size() >= high_watermark:
+            self._pause_reads(channel_handler, PAUSED_BY_WRITE_QUEUE)
+            self._interest_changed(channel_handler)
+
+    def _write_pending(self, channel_handler):
+        transport = channel_handler.transport
+        return (transport is not None and
+                transport.get_write_buffer_size() > 0)
+
+    def _write_buffered(self, channel_handler):
+        if channel_handler.transport is None:
+            return 0
+        return channel_handler.transport.get_write_buffer_size()
+
+    def _close_channel(self, channel_handler):
+        if channel_handler.transport is not None:
+            channel_handler.transport.close()
+        else:
+            channel_handler.channel.close()
+
+    def _register_watcher(self, fileno):
+        self._loop.add_reader(fileno, self._on_watcher, fileno)
+
+    def _interest_changed(self, channel_handler):
+        reading = channel_handler.reading()
+        if reading != bool(channel_handler.event_mask):
+            channel_handler.event_mask = 1 if reading else 0
+            if reading:
+                channel_handler.transport.resume_reading()
+            else:
+                channel_handler.transport.pause_reading()
+
+    def _channel_closed(self, fileno):
+        pass
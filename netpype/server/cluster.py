@@ -0,0 +1,182 @@
+import threading
+import time
+import netpype.env as env
+
+from netpype import WorkerStateError
+from netpype.affinity import LAYOUT_NUMA, allowed_cpus, default_layout
+from netpype.affinity import rx_queue_layout
+from netpype.control import DEFAULT_DRAIN_TIMEOUT, DEFAULT_HANDOFF_TIMEOUT
+
+
+_LOG = env.get_logger('netpype.server.cluster')
+
+
+"""
+A SelectorServerCluster runs several selector servers side by side. Every
+worker is its own process that binds its own SO_REUSEPORT listener to the same
+address and runs its own polling loop, leaving the kernel to balance new
+connections across the workers.
+
+The cluster supervises its workers from a thread in the parent process and
+respawns any worker that dies while the cluster is running. A restart hands
+every worker's listener off to a new worker one at a time, so the listeners
+of the reuse port group stay open throughout. Workers that can't hand off, or
+whose handoff fails, are replaced by a new worker that joins the group on its
+own. Old workers are supervised until they exit.
+
+A layout pins every worker to a tuple of CPUs. LAYOUT_NUMA spreads one worker
+per CPU across the NUMA nodes in turn. Given an rx_interface instead, the
+cluster runs one worker per receive queue of that interface, each pinned to the
+CPU that handles its queue and asking the kernel, through SO_INCOMING_CPU, for
+the connections that arrive there.
+"""
+
+
+class SelectorServerCluster(object):
+
+    def __init__(self, server_class, socket_addr, pipeline_factory,
+                 workers=None, supervise_interval=1.0, layout=None,
+                 rx_interface=None, **server_kwargs):
+        self._server_class = server_class
+        self._socket_addr = socket_addr
+        self._pipeline_factory = pipeline_factory
+        self._server_kwargs = server_kwargs
+        self._supervise_interval = supervise_interval
+        self._incoming = False
+
+        if rx_interface is not None:
+            layout = rx_queue_layout(rx_interface)
+            if not layout:
+                raise ValueError('No receive queues found for {}.'.format(
+                    rx_interface))
+            self._incoming = True
+        elif layout == LAYOUT_NUMA:
+            layout = default_layout(workers or len(allowed_cpus()))
+        self._layout = [tuple(cpus) for cpus in layout] if layout else None
+
+        if self._layout is not None:
+            workers = workers or len(self._layout)
+        self._workers = [None] * (workers or len(allowed_cpus()))
+        # Replaced workers that are still draining
+        self._retiring = list()
+        self._halted = threading.Event()
+        self._supervisor = None
+        # Held while a worker slot is being replaced
+        self._lock = threading.Lock()
+
+    def workers(self):
+        return list(self._workers)
+
+    def start(self):
+        if self._supervisor is not None:
+            raise WorkerStateError('Cluster has been started once already.')
+
+        for index in range(len(self._workers)):
+            self._spawn(index)
+
+        self._supervisor = threading.Thread(
+            target=self._supervise,
+            name='SelectorServerCluster - {}'.format(self._socket_addr))
+        self._supervisor.daemon = True
+        self._supervisor.start()
+
+    def restart(self, timeout=DEFAULT_DRAIN_TIMEOUT,
+                handoff_timeout=DEFAULT_HANDOFF_TIMEOUT):
+        """
+        Replaces every worker with a new one that inherits its listener while
+        the old one drains its channels for up to timeout seconds. A worker
+        that doesn't hand its listener off within handoff_timeout seconds is
+        replaced by a new worker with a listener of its own.
+        """
+        for index in range(len(self._workers)):
+            with self._lock:
+                worker = self._workers[index]
+                if worker is None or worker.join(0):
+                    self._spawn(index)
+                    continue
+                if hasattr(worker, 'handoff'):
+                    try:
+                        self._workers[index] = worker.handoff(
+                            self._build(index), timeout, handoff_timeout)
+                    except WorkerStateError as wse:
+                        # The old worker is draining already
+                        _LOG.error('Worker {} failed to hand off, '
+                                   'respawning: {}'.format(index, wse))
+                        self._spawn(index)
+                else:
+                    self._spawn(index)
+                    worker.drain(timeout)
+                self._retiring.append(worker)
+
+    def stop(self, timeout=5.0, drain=False):
+        """
+        Stops every worker, letting them drain their channels first if drain
+        is set. Workers still running after timeout seconds are terminated.
+        """
+        self._halted.set()
+        if self._supervisor is not None:
+            self._supervisor.join()
+
+        with self._lock:
+            workers = [
+                worker for worker in self._workers if worker is not None]
+            workers.extend(self._retiring)
+            self._retiring = list()
+
+        # Interrupt everyone first so that the workers wind down in parallel
+        for worker in workers:
+            if drain:
+                worker.drain(timeout)
+            else:
+                worker.interrupt()
+
+        deadline = time.time() + timeout
+        for worker in workers:
+            if not worker.join(max(0, deadline - time.time())):
+                _LOG.warn('Worker {} did not halt in time, terminating.'.format(
+                    worker))
+                worker.terminate()
+
+    def _placement(self, index):
+        if self._layout is None:
+            return dict()
+        cpus = self._layout[index % len(self._layout)]
+        placement = {'cpus': cpus}
+        if self._incoming:
+            placement['incoming_cpu'] = cpus[0]
+        return placement
+
+    def _build(self, index):
+        kwargs = dict(self._server_kwargs)
+        kwargs.update(self._placement(index))
+        return self._server_class(
+            self._socket_addr,
+            self._pipeline_factory,
+            reuse_port=True,
+            **kwargs)
+
+    def _spawn(self, index):
+        worker = self._build(index)
+        worker.start()
+        self._workers[index] = worker
+        return worker
+
+    def _supervise(self):
+        while not self._halted.wait(self._supervise_interval):
+            with self._lock:
+                self._retiring = [
+                    worker for worker in self._retiring if not worker.join(0)]
+            for index in range(len(self._workers)):
+                if self._halted.is_set():
+                    break
+                with self._lock:
+                    worker = self._workers[index]
+                    # Joining an exited worker closes its control block
+                    if worker is not None and worker.join(0):
+                        _LOG.error(
+                            'Worker {} exited with code {}, respawning.'.format(
+                                index, worker.exitcode()))
+                        try:
+                            self._spawn(index)
+                        except Exception as ex:
+                            _LOG.exception(ex)
@@ -0,0 +1,163 @@
+import socket
+import select
+import errno
+import netpype.env as env
+
+from netpype import PersistentProcess
+from netpype.affinity import set_incoming_cpu
+from netpype.channel import datagram_socket, HandlerPipeline
+from netpype.channel import close_socket
+from netpype.channel import DEFAULT_DATAGRAM_BATCH, DEFAULT_MAX_DATAGRAM
+from netpype.control import DEFAULT_HEARTBEAT_INTERVAL
+from netpype.server import run_pipeline
+from netpype.selector import events as selection_events
+
+
+_LOG = env.get_logger('netpype.server.datagram')
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK)
+# Poll takes its timeout in milliseconds
+_POLL_TIMEOUT = int(DEFAULT_HEARTBEAT_INTERVAL * 1000)
+
+
+"""
+A DatagramServer serves a UDP socket with the same pipeline factories that the
+selector servers use. There are no connections to track so the server builds
+one handler pipeline when it starts and every datagram is handed to it as a
+read event of its own, making each datagram one message for the pipeline.
+
+Every wakeup drains up to batch_size datagrams from the socket into a slab
+that is allocated once, one max_datagram sized slot per datagram, before any
+of them are handed to the pipeline. Datagrams larger than max_datagram are
+truncated to it. With zero_copy set the pipeline is handed memoryviews of the
+slab that are only good until its read event returns.
+
+A netpype.selector.REQUEST_WRITE sends its message back to the peer of the
+datagram being handled. Read and close requests have nothing to act upon and
+are ignored. Workers of a netpype.server.cluster.SelectorServerCluster bind
+with SO_REUSEPORT, leaving the kernel to spread datagrams across them.
+"""
+
+
+class DatagramServer(PersistentProcess):
+
+    def __init__(self, socket_addr, pipeline_factory, reuse_port=False,
+                 rcvbuf=None, sndbuf=None, zero_copy=False,
+                 batch_size=DEFAULT_DATAGRAM_BATCH,
+                 max_datagram=DEFAULT_MAX_DATAGRAM, cpus=None,
+                 incoming_cpu=None):
+        super(DatagramServer, self).__init__(
+            'DatagramServer - {}'.format(socket_addr), cpus=cpus)
+        if batch_size < 1:
+            raise ValueError('Batch size must be at least one datagram.')
+        if max_datagram < 1:
+            raise ValueError('Datagrams must be at least one byte.')
+        self._socket_addr = socket_addr
+        self._pipeline_factory = pipeline_factory
+        self._reuse_port = reuse_port
+        self._rcvbuf = rcvbuf
+        self._sndbuf = sndbuf
+        self._zero_copy = zero_copy
+        self._incoming_cpu = incoming_cpu
+        self._batch_size = batch_size
+        self._max_datagram = max_datagram
+        self._peer = None
+
+    def on_start(self):
+        self._socket = datagram_socket(
+            self._socket_addr,
+            reuse_port=self._reuse_port,
+            rcvbuf=self._rcvbuf,
+            sndbuf=self._sndbuf)
+        if self._incoming_cpu is not None:
+            set_incoming_cpu(self._socket, self._incoming_cpu)
+        self._socket_fileno = self._socket.fileno()
+        self._pipeline = HandlerPipeline(self._pipeline_factory)
+        self._on_read = self._pipeline.methods['on_read']
+
+        size = self._max_datagram
+        self._slab = memoryview(bytearray(self._batch_size * size))
+        self._slots = [self._slab[offset:offset + size]
+                       for offset in range(0, len(self._slab), size)]
+
+        self._select_poll = select.poll()
+        self._select_poll.register(self._socket_fileno, select.POLLIN)
+        self._select_poll.register(self.wakeup_fileno(), select.POLLIN)
+
+    def on_halt(self):
+        if hasattr(self, '_select_poll'):
+            self._select_poll.unregister(self._socket_fileno)
+            self._select_poll.unregister(self.wakeup_fileno())
+        if hasattr(self, '_socket'):
+            close_socket(self._socket, self._socket_addr)
+
+    def process(self):
+        try:
+            for fileno, event in self._select_poll.poll(_POLL_TIMEOUT):
+                if fileno == self._socket_fileno:
+                    self._on_readable()
+                else:
+                    self._on_control()
+        except IOError as ioe:
+            if ioe.errno == errno.EINTR:
+                _LOG.warn('Interrupt caught, exiting.')
+        except Exception as ex:
+            _LOG.exception(ex)
+
+    def _on_readable(self):
+        received = self._receive()
+        for slot, (length, address) in zip(self._slots, received):
+            self._datagram(slot[:length], address)
+        return len(received)
+
+    def _receive(self):
+        """
+        Reads datagrams into the slab until the socket has no more or every
+        slot is full and returns the length and peer of each.
+        """
+        received = list()
+        recvfrom_into = self._socket.recvfrom_into
+        for slot in self._slots:
+            try:
+                received.append(recvfrom_into(slot))
+            except socket.error as se:
+                if se.errno in _WOULD_BLOCK:
+                    break
+                raise
+        return received
+
+    def _datagram(self, data, address):
+        self._peer = address
+        if not self._zero_copy:
+            data = data.tobytes()
+        try:
+            result = run_pipeline(
+                self._on_read, self._socket_fileno, data,
+                selection_events.FORWARD)
+        except Exception as ex:
+            _LOG.exception(ex)
+            return
+        if result:
+            self._handle_result(result)
+
+    def _handle_result(self, result):
+        signal = result[0]
+        if signal == selection_events.REQUEST_WRITE:
+            self._send(result[2])
+        elif signal not in (selection_events.REQUEST_READ,
+                            selection_events.REQUEST_CLOSE):
+            _LOG.warn('Unsupported datagram event: {}.'.format(signal))
+
+    def _send(self, message):
+        if not self._peer:
+            # Unix datagram senders that never bound a path can't be answered
+            _LOG.debug('Dropping reply to an unbound peer.')
+            return
+        try:
+            self._socket.sendto(message, self._peer)
+        except socket.error as se:
+            # Replies are as unreliable as the datagrams they answer
+            if se.errno not in _WOULD_BLOCK:
+                raise
+            _LOG.debug('Send buffer full, dropping reply to {}.'.format(
+                self._peer))
@@ -1,51 +1,80 @@
+import errno
 import select
+import socket
 import netpype.env as env
 
 from netpype.server import SelectorServer
+from netpype.metrics import BYTES_WRITTEN
 from netpype.selector import events as selection_events
 
 
 _LOG = env.get_logger('netpype.server.epoll')
 
+# Older select modules do not export every epoll flag
+_EPOLLRDHUP = getattr(select, 'EPOLLRDHUP', 0x2000)
+_EPOLLET = getattr(select, 'EPOLLET', 1 << 31)
+
+_EDGE_TRIGGERED_MASK = (select.EPOLLIN | select.EPOLLPRI | select.EPOLLOUT |
+                        _EPOLLRDHUP | _EPOLLET)
+_READ_MASK = select.EPOLLIN | select.EPOLLPRI | _EPOLLRDHUP
+_CLOSE_MASK = select.EPOLLHUP | select.EPOLLERR
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK)
+
+# Bytes a channel may read per wakeup, in maximum receive sizes, before the
+# rest waits behind the other channels
+_DRAIN_RECV_SIZES = 16
+
 
 class EPollSelectorServer(SelectorServer):
 
-    def __init__(self, socket_addr, pipeline_factory):
+    def __init__(self, socket_addr, pipeline_factory, **kwargs):
         super(EPollSelectorServer, self).__init__(
-            socket_addr, pipeline_factory)
+            socket_addr, pipeline_factory, **kwargs)
 
     def on_start(self):
         super(EPollSelectorServer, self).on_start()
-        self._epoll = select.epoll()
+        self._epoll = self._profiled(select.epoll(), 'epoll')
         self._epoll.register(self._socket_fileno, select.EPOLLIN)
+        self._watch_control()
 
     def on_halt(self):
-        if hasattr(self, '_select_epoll'):
-            self._epoll.unregister(self._socket_fileno)
+        if hasattr(self, '_epoll'):
             self._epoll.close()
         super(EPollSelectorServer, self).on_halt()
 
     def _poll(self):
         # Poll
-        for fileno, event in self._epoll.poll():
+        events = self._epoll.poll(self._poll_timeout())
+        self._on_wakeup(len(events))
+        for fileno, event in events:
             self._on_epoll(event, fileno)
 
+    def _register(self, fileno):
+        self._epoll.register(fileno, 0)
+
+    def _register_watcher(self, fileno):
+        self._epoll.register(fileno, select.EPOLLIN)
+
+    def _listener_interest(self, polling):
+        self._epoll.modify(
+            self._socket_fileno, select.EPOLLIN if polling else 0)
+
     def _on_epoll(self, event, fileno):
-        if fileno == self._socket_fileno:
-            handler = self._accept(self._socket, self._pipeline_factory)
-            self._epoll.register(handler.fileno)
-            self._active_channels[handler.fileno] = handler
-            self._network_event(
-                selection_events.CHANNEL_CONNECTED,
-                handler.fileno,
-                handler.pipeline,
-                handler.client_addr)
+        watcher = self._watchers.get(fileno)
+        if watcher is not None:
+            watcher()
+        elif fileno == self._socket_fileno:
+            self._on_accept()
         else:
-            channel_handler = self._active_channels[fileno]
+            # An earlier event of the batch may have closed the channel
+            channel_handler = self._active_channels.get(fileno)
+            if channel_handler is None:
+                return
 
             if event & select.EPOLLIN or event & select.EPOLLPRI:
                 try:
-                    read = channel_handler.channel.recv(1024)
+                    read = self._recv(channel_handler)
                     if len(read) == 0:
                         raise IOError()
                     self._network_event(
@@ -54,40 +83,192 @@ class EPollSelectorServer(SelectorServer):
                         channel_handler.pipeline,
                         read)
                 except IOError:
-                    self._network_event(
-                        selection_events.CHANNEL_CLOSED,
-                        channel_handler.fileno,
-                        channel_handler.pipeline,
-                        channel_handler.client_addr)
-            elif event & select.EPOLLOUT:
-                write_buffer = channel_handler.write_buffer
-                if not write_buffer.empty():
-                    try:
-                        write_buffer.sent(channel_handler.channel.send(
-                            write_buffer.remaining()))
-                    except IOError:
-                        self._network_event(
-                            selection_events.CHANNEL_CLOSED,
-                            channel_handler.fileno,
-                            channel_handler.pipeline,
-                            channel_handler.client_addr)
-                if write_buffer.empty():
-                    self._network_event(
-                        selection_events.WRITE_AVAILABLE,
-                        fileno,
-                        channel_handler.pipeline)
-            elif event & select.EPOLLHUP:
-                self._network_event(
-                    selection_events.CHANNEL_CLOSED,
-                    fileno,
-                    channel_handler.pipeline,
-                    channel_handler.client_addr)
+                    self._close(channel_handler)
+            if event & select.EPOLLOUT and self._is_active(channel_handler):
+                try:
+                    self._write(channel_handler)
+                except IOError:
+                    self._close(channel_handler)
+            if event & select.EPOLLHUP and self._is_active(channel_handler):
+                self._close(channel_handler)
 
-    def _read_requested(self, fileno):
-        self._epoll.modify(fileno, select.EPOLLIN)
+    def _close(self, channel_handler):
+        self._network_event(
+            selection_events.CHANNEL_CLOSED,
+            channel_handler.fileno,
+            channel_handler.pipeline,
+            channel_handler.client_addr)
 
-    def _write_requested(self, fileno):
-        self._epoll.modify(fileno, select.EPOLLOUT)
+    def _interest_changed(self, channel_handler):
+        event_mask = 0
+        if channel_handler.reading():
+            event_mask |= select.EPOLLIN
+        if channel_handler.write_interest:
+            event_mask |= select.EPOLLOUT
+        if event_mask != channel_handler.event_mask:
+            channel_handler.event_mask = event_mask
+            self._epoll.modify(channel_handler.fileno, event_mask)
 
     def _channel_closed(self, fileno):
         self._epoll.unregister(fileno)
+
+
+"""
+The edge triggered server registers every channel exactly once for both read
+and write readiness. Since readiness is only reported on edges, reads drain the
+socket until EAGAIN into the channel's read buffer and writes flush the write
+buffer until EAGAIN.
+
+The read buffer is handed to the pipeline whenever it holds a maximum receive
+size, and draining stops as soon as the pipeline stops reading. A channel that
+is still readable after its share of reads for the wakeup is queued to carry
+on during the next turn of the loop, after the events that turn reports. No
+channel is drained twice in one turn.
+
+Changes in read or write interest never touch the epoll registration. A
+channel that gains interest is instead queued the same way since the edge it
+is waiting on may have already passed.
+"""
+
+
+class EdgeTriggeredEPollSelectorServer(EPollSelectorServer):
+
+    def __init__(self, socket_addr, pipeline_factory, **kwargs):
+        super(EdgeTriggeredEPollSelectorServer, self).__init__(
+            socket_addr, pipeline_factory, **kwargs)
+        self._ready = list()
+        # Channels drained during the current turn
+        self._drained = set()
+        self._drain_limit = _DRAIN_RECV_SIZES * self._recv_sizing[2]
+
+    def _poll(self):
+        # Channels queued during the last turn are serviced after this one's
+        # events, and whatever gets queued now waits for the next turn
+        ready = self._ready
+        self._ready = list()
+        self._drained.clear()
+
+        # Don't block while there are channels waiting to be serviced
+        timeout = 0 if ready else self._poll_timeout()
+        events = self._epoll.poll(timeout)
+        self._on_wakeup(len(events))
+        for fileno, event in events:
+            self._on_epoll(event, fileno)
+
+        for channel_handler in ready:
+            self._service(channel_handler)
+
+    def _register(self, fileno):
+        self._epoll.register(fileno, _EDGE_TRIGGERED_MASK)
+
+    def _on_epoll(self, event, fileno):
+        watcher = self._watchers.get(fileno)
+        if watcher is not None:
+            watcher()
+            return
+        if fileno == self._socket_fileno:
+            self._on_accept()
+            return
+
+        channel_handler = self._active_channels.get(fileno)
+        if channel_handler is None:
+            return
+
+        if event & _READ_MASK and channel_handler.reading():
+            self._drain(channel_handler)
+        if (event & select.EPOLLOUT and channel_handler.write_interest and
+                self._is_active(channel_handler)):
+            self._flush(channel_handler)
+        if event & _CLOSE_MASK and self._is_active(channel_handler):
+            self._close(channel_handler)
+
+    def _service(self, channel_handler):
+        if not self._is_active(channel_handler):
+            return
+        # A channel drained by this turn's events has had its share of reads
+        if (channel_handler.reading() and
+                channel_handler not in self._drained):
+            self._drain(channel_handler)
+        if channel_handler.write_interest and self._is_active(channel_handler):
+            self._flush(channel_handler)
+
+    def _drain(self, channel_handler):
+        read_buffer = channel_handler.read_buffer
+        max_recv_size = self._recv_sizing[2]
+        remaining = self._drain_limit
+        closed = False
+        self._drained.add(channel_handler)
+
+        while True:
+            if remaining <= 0:
+                # The socket may hold more, come back after everyone else
+                self._ready.append(channel_handler)
+                break
+            try:
+                read = self._recv_into(channel_handler)
+            except socket.error as se:
+                if se.errno in _WOULD_BLOCK:
+                    break
+                if se.errno == errno.EINTR:
+                    continue
+                closed = True
+                break
+            if read == 0:
+                closed = True
+                break
+            remaining -= read
+
+            if read_buffer.available() >= max_recv_size:
+                self._read_available(channel_handler)
+                # Resuming reads queues the channel again
+                if not (self._is_active(channel_handler) and
+                        channel_handler.reading()):
+                    return
+
+        if read_buffer.available() > 0:
+            self._read_available(channel_handler)
+
+        if closed and self._is_active(channel_handler):
+            self._close(channel_handler)
+
+    def _read_available(self, channel_handler):
+        self._network_event(
+            selection_events.READ_AVAILABLE,
+            channel_handler.fileno,
+            channel_handler.pipeline,
+            self._take_read(channel_handler))
+
+    def _flush(self, channel_handler):
+        if channel_handler.connecting:
+            try:
+                self._finish_connect(channel_handler)
+            except IOError:
+                self._close(channel_handler)
+            return
+
+        channel = channel_handler.channel
+        write_buffer = channel_handler.write_buffer
+
+        while not write_buffer.empty():
+            try:
+                self._counters[BYTES_WRITTEN] += write_buffer.send(channel)
+            except socket.error as se:
+                if se.errno in _WOULD_BLOCK:
+                    break
+                if se.errno == errno.EINTR:
+                    continue
+                self._close(channel_handler)
+                return
+        self._sent(channel_handler)
+
+    def _interest_changed(self, channel_handler):
+        event_mask = 0
+        if channel_handler.reading():
+            event_mask |= select.EPOLLIN
+        if channel_handler.write_interest:
+            event_mask |= select.EPOLLOUT
+
+        # Only newly raised interest can be waiting on an edge that passed
+        if event_mask & ~channel_handler.event_mask:
+            self._ready.append(channel_handler)
+        channel_handler.event_mask = event_mask
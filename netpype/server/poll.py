@@ -1,3 +1,4 @@
+import math
 import select
 import netpype.env as env
 
@@ -10,14 +11,15 @@ _LOG = env.get_logger('netpype.server.poll')
 
 class PollSelectorServer(SelectorServer):
 
-    def __init__(self, socket_addr, pipeline_factory):
+    def __init__(self, socket_addr, pipeline_factory, **kwargs):
         super(PollSelectorServer, self).__init__(
-            socket_addr, pipeline_factory)
+            socket_addr, pipeline_factory, **kwargs)
 
     def on_start(self):
         super(PollSelectorServer, self).on_start()
-        self._select_poll = select.poll()
+        self._select_poll = self._profiled(select.poll(), 'poll')
         self._select_poll.register(self._socket_fileno, select.POLLIN)
+        self._watch_control()
 
     def on_halt(self):
         if hasattr(self, '_select_poll'):
@@ -25,66 +27,77 @@ class PollSelectorServer(SelectorServer):
         super(PollSelectorServer, self).on_halt()
 
     def _poll(self):
-        # Poll
-        for fileno, event in self._select_poll.poll():
+        # Poll takes its timeout in milliseconds
+        timeout = self._poll_timeout()
+        if timeout < 0:
+            timeout = None
+        else:
+            timeout = int(math.ceil(timeout * 1000))
+        events = self._select_poll.poll(timeout)
+        self._on_wakeup(len(events))
+        for fileno, event in events:
             self._on_poll(event, fileno)
 
+    def _register(self, fileno):
+        self._select_poll.register(fileno, 0)
+
+    def _register_watcher(self, fileno):
+        self._select_poll.register(fileno, select.POLLIN)
+
+    def _listener_interest(self, polling):
+        self._select_poll.modify(
+            self._socket_fileno, select.POLLIN if polling else 0)
+
     def _on_poll(self, event, fileno):
-        if fileno == self._socket_fileno:
-            handler = self._accept(self._socket, self._pipeline_factory)
-            self._select_poll.register(handler.fileno)
-            self._active_channels[handler.fileno] = handler
-            self._network_event(
-                selection_events.CHANNEL_CONNECTED,
-                handler.fileno,
-                handler.pipeline,
-                handler.client_addr)
+        watcher = self._watchers.get(fileno)
+        if watcher is not None:
+            watcher()
+        elif fileno == self._socket_fileno:
+            self._on_accept()
         else:
-            channel_handler = self._active_channels[fileno]
+            # An earlier event of the batch may have closed the channel
+            channel_handler = self._active_channels.get(fileno)
+            if channel_handler is None:
+                return
 
             if event & select.POLLIN or event & select.POLLPRI:
                 try:
-                    read = channel_handler.channel.recv(1024)
+                    read = self._recv(channel_handler)
+                    if len(read) == 0:
+                        raise IOError()
                     self._network_event(
                         selection_events.READ_AVAILABLE,
                         fileno,
                         channel_handler.pipeline,
                         read)
                 except IOError:
-                    self._network_event(
-                        selection_events.CHANNEL_CLOSED,
-                        channel_handler.fileno,
-                        channel_handler.pipeline,
-                        channel_handler.client_addr)
-            elif event & select.POLLOUT:
-                write_buffer = channel_handler.write_buffer
-                if not write_buffer.empty():
-                    try:
-                        write_buffer.sent(channel_handler.channel.send(
-                            write_buffer.remaining()))
-                    except IOError:
-                        self._network_event(
-                            selection_events.CHANNEL_CLOSED,
-                            channel_handler.fileno,
-                            channel_handler.pipeline,
-                            channel_handler.client_addr)
-                if write_buffer.empty():
-                    self._network_event(
-                        selection_events.WRITE_AVAILABLE,
-                        fileno,
-                        channel_handler.pipeline)
-            elif event & select.POLLHUP:
-                self._network_event(
-                    selection_events.CHANNEL_CLOSED,
-                    fileno,
-                    channel_handler.pipeline,
-                    channel_handler.client_addr)
-
-    def _read_requested(self, fileno):
-        self._select_poll.modify(fileno, select.POLLIN)
-
-    def _write_requested(self, fileno):
-        self._select_poll.modify(fileno, select.POLLOUT)
+                    self._on_channel_error(channel_handler)
+            if event & select.POLLOUT and self._is_active(channel_handler):
+                try:
+                    self._write(channel_handler)
+                except IOError:
+                    self._on_channel_error(channel_handler)
+            if event & select.POLLHUP and self._is_active(channel_handler):
+                self._on_channel_error(channel_handler)
+
+    def _on_channel_error(self, channel_handler):
+        # Poll keeps reporting closed descriptors so unregister before closing
+        self._select_poll.unregister(channel_handler.fileno)
+        self._network_event(
+            selection_events.CHANNEL_CLOSED,
+            channel_handler.fileno,
+            channel_handler.pipeline,
+            channel_handler.client_addr)
+
+    def _interest_changed(self, channel_handler):
+        event_mask = 0
+        if channel_handler.reading():
+            event_mask |= select.POLLIN
+        if channel_handler.write_interest:
+            event_mask |= select.POLLOUT
+        if event_mask != channel_handler.event_mask:
+            channel_handler.event_mask = event_mask
+            self._select_poll.modify(channel_handler.fileno, event_mask)
 
     def _channel_closed(self, fileno):
         self._select_poll.unregister(fileno)
@@ -0,0 +1,214 @@
+import netpype.env as env
+
+from netpype.channel import NetworkEventHandler, PipelineFactory
+from netpype.selector import events as selection_events
+from collections import deque
+
+
+_LOG = env.get_logger('netpype.server.upstream')
+
+
+class UpstreamHandler(NetworkEventHandler):
+
+    def on_connect(self, message):
+        # Reading is how a connection learns that the upstream went away
+        return (selection_events.REQUEST_READ, None)
+
+    def on_read(self, message):
+        return None
+
+    def on_write(self, message):
+        return None
+
+    def on_timeout(self, message):
+        # The pool decides when its connections are idle
+        return None
+
+
+class UpstreamPipelineFactory(PipelineFactory):
+
+    def upstream_pipeline(self):
+        return [UpstreamHandler()]
+
+    def downstream_pipeline(self):
+        return [UpstreamHandler()]
+
+
+_DEFAULT_PIPELINE_FACTORY = UpstreamPipelineFactory()
+
+
+"""
+A ConnectionPool keeps the outbound connections of a server to one
+netpype.channel.Upstream. Messages sent to the pool are written to the
+connected channel with the fewest messages in flight, where a message is in
+flight from the moment it is queued until the channel's writes drain. When
+every channel is at its pipelining limit messages wait in the backlog and, if
+the pool has room for another connection, one is opened.
+
+The server tells the pool when one of its channels connects, drains or
+closes. Failed connects and lost connections back off before the pool connects
+again. Messages still queued on a channel that closes are lost.
+"""
+
+
+class ConnectionPool(object):
+
+    def __init__(self, server, name, upstream):
+        self.name = name
+        self.upstream = upstream
+        self.dropped = 0
+        self._server = server
+        self._pipeline_factory = (
+            upstream.pipeline_factory or _DEFAULT_PIPELINE_FACTORY)
+        self._in_flight = dict()
+        self._connecting = set()
+        self._retiring = set()
+        self._keepalive_timers = dict()
+        self._backlog = deque()
+        self._failures = 0
+        self._reconnect_timer = None
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    def __repr__(self):
+        return 'ConnectionPool {} for {}'.format(self.name, self.upstream)
+
+    def backlog(self):
+        return len(self._backlog)
+
+    def retire(self, channel_handler):
+        # Closes a channel without the pool replacing it
+        self._retiring.add(channel_handler)
+        self._close(channel_handler)
+
+    def send(self, message):
+        if not self._backlog:
+            channel_handler = self._available()
+            if channel_handler is not None:
+                self._write(channel_handler, message)
+                return
+
+        if len(self._backlog) >= self.upstream.backlog:
+            self._backlog.popleft()
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                _LOG.warn('{} backlog full, {} messages dropped.'.format(
+                    self, self.dropped))
+        self._backlog.append(message)
+        self._grow()
+
+    def connected(self, channel_handler):
+        self._connecting.discard(channel_handler)
+        self._failures = 0
+        self._in_flight[channel_handler] = 0
+        self._flush(channel_handler)
+        self._grow()
+
+    def drained(self, channel_handler):
+        if channel_handler not in self._in_flight:
+            return
+        self._in_flight[channel_handler] = 0
+        self._flush(channel_handler)
+        if (self.upstream.keepalive and
+                channel_handler not in self._keepalive_timers):
+            self._keepalive_timers[channel_handler] = self._server._schedule(
+                self.upstream.keepalive, self._on_keepalive, channel_handler)
+
+    def closed(self, channel_handler):
+        timer = self._keepalive_timers.pop(channel_handler, None)
+        if timer is not None:
+            self._server._timers.cancel(timer)
+        self._connecting.discard(channel_handler)
+        self._in_flight.pop(channel_handler, None)
+
+        if channel_handler in self._retiring:
+            self._retiring.discard(channel_handler)
+        else:
+            _LOG.info('Lost connection to {}.'.format(self.upstream))
+            self._failed()
+
+    def _available(self):
+        best = None
+        least = self.upstream.pipelining
+        for channel_handler, in_flight in self._in_flight.items():
+            if in_flight < least:
+                best = channel_handler
+                least = in_flight
+        return best
+
+    def _write(self, channel_handler, message):
+        self._in_flight[channel_handler] += 1
+        self._server._handle_result((
+            selection_events.REQUEST_WRITE, channel_handler.fileno, message))
+
+    def _flush(self, channel_handler):
+        backlog = self._backlog
+        pipelining = self.upstream.pipelining
+        while backlog and self._in_flight.get(channel_handler, pipelining) < (
+                pipelining):
+            self._write(channel_handler, backlog.popleft())
+
+    def _grow(self):
+        """
+        Opens another connection when messages are waiting, no connect is
+        under way or backing off and the pool has room for one.
+        """
+        if (not self._backlog or self._connecting or
+                self._reconnect_timer is not None or
+                len(self._in_flight) >= self.upstream.connections):
+            return
+
+        upstream = self.upstream
+        try:
+            channel_handler = self._server.connect(
+                upstream.socket_addr, self._pipeline_factory, pool=self,
+                rcvbuf=upstream.rcvbuf, sndbuf=upstream.sndbuf)
+        except IOError as ioe:
+            _LOG.warn('Unable to connect to {}: {}'.format(upstream, ioe))
+            self._failed()
+            return
+
+        self._connecting.add(channel_handler)
+        if upstream.connect_timeout:
+            self._server._schedule(
+                upstream.connect_timeout, self._on_connect_timeout,
+                channel_handler)
+
+    def _failed(self):
+        upstream = self.upstream
+        delay = min(upstream.min_backoff * 2 ** min(self._failures, 32),
+                    upstream.max_backoff)
+        self._failures += 1
+        if self._reconnect_timer is None:
+            self._reconnect_timer = self._server._schedule(
+                delay, self._on_backoff, None)
+
+    def _close(self, channel_handler):
+        self._server._handle_result((
+            selection_events.REQUEST_CLOSE, channel_handler.fileno, None))
+
+    def _on_backoff(self, timer):
+        self._reconnect_timer = None
+        self._grow()
+
+    def _on_connect_timeout(self, timer):
+        channel_handler = timer.payload
+        if (channel_handler in self._connecting and
+                self._server._is_active(channel_handler)):
+            _LOG.warn('Timed out connecting to {}.'.format(self.upstream))
+            self._close(channel_handler)
+
+    def _on_keepalive(self, timer):
+        channel_handler = timer.payload
+        del self._keepalive_timers[channel_handler]
+        if self._in_flight.get(channel_handler) != 0:
+            return
+
+        idle_since = channel_handler.last_write
+        if idle_since + self.upstream.keepalive <= self._server._now:
+            self.retire(channel_handler)
+        else:
+            self._keepalive_timers[channel_handler] = self._server._schedule(
+                idle_since + self.upstream.keepalive - self._server._now,
+                self._on_keepalive, channel_handler)
@@ -1,6 +1,5 @@
-from libc.stdlib cimport malloc, free
-from netpype.cutil cimport CyclicBuffer
-from cython import array
+from libc.stdlib cimport malloc, realloc, free
+from netpype.cutil cimport CyclicBuffer, c_buffer_seek
 
 cdef enum LexerStates:
     START = 0
@@ -20,195 +19,533 @@ cdef enum LexerStates:
     READ_SD_NEXT_FIELD_OR_END = 14
     READ_MESSAGE = 15
 
+# Message fields, in the order netpype.batch uses
+cdef enum MessageFields:
+    PRIORITY_FIELD = 0
+    VERSION_FIELD = 1
+    TIMESTAMP_FIELD = 2
+    HOSTNAME_FIELD = 3
+    APPNAME_FIELD = 4
+    PROCESSID_FIELD = 5
+    MESSAGEID_FIELD = 6
+    MESSAGE_FIELD = 7
+    FIELD_COUNT = 8
+
+# Longest tokens allowed by RFC 5424, delimiter included
+cdef enum TokenLimits:
+    OCTET_LIMIT = 10
+    PRI_LIMIT = 6
+    VERSION_LIMIT = 4
+    TIMESTAMP_LIMIT = 33
+    HOSTNAME_LIMIT = 256
+    APPNAME_LIMIT = 49
+    PROCESSID_LIMIT = 129
+    MESSAGEID_LIMIT = 33
+    SD_NAME_LIMIT = 33
+
+cdef enum:
+    SEEK_NOT_FOUND = -1
+    SEEK_LIMIT_REACHED = -2
 
 # Delimeter constants
-_SPACE = ' '
-_QUOTE = '"'
-_EQUALS = '='
-_CLOSE_ANGLE_BRACKET = '>'
-_OPEN_BRACKET = '['
-_CLOSE_BRACKET = ']'
+cdef char _SPACE = b' '
+cdef char _QUOTE = b'"'
+cdef char _EQUALS = b'='
+cdef char _BACKSLASH = b'\\'
+cdef char _DASH = b'-'
+cdef char _OPEN_ANGLE_BRACKET = b'<'
+cdef char _CLOSE_ANGLE_BRACKET = b'>'
+cdef char _OPEN_BRACKET = b'['
+cdef char _CLOSE_BRACKET = b']'
+cdef char *_SD_NAME_DELIMS = b' ]'
 
-# Ordinal values
-_SPACE_ORD = ord(_SPACE)
-_OPEN_BRACKET_ORD = ord(_OPEN_BRACKET)
-_CLOSE_BRACKET_ORD = ord(_CLOSE_BRACKET)
+cdef int _MAX_BYTES = 536870912
 
-_MAX_BYTES = 536870912
+DEFAULT_ARENA_SIZE = 2048
+DEFAULT_POOL_SIZE = 64
+
+cdef int _DEFAULT_SD_ELEMENTS = 8
+cdef int _DEFAULT_SD_FIELDS = 32
+
+
+class SyslogLexerError(Exception):
+    pass
 
-cdef struct StructuredDataField:
-    char** names, values
-    int num_fields
 
 cdef struct StructuredData:
-    char* name
-    StructuredDataField* fields
+    int name_offset, name_length
+    int first_field, num_fields
+
+cdef struct StructuredDataField:
+    int name_offset, name_length
+    int value_offset, value_length
+
 
+"""
+A SyslogMessage keeps everything it holds in one arena: the bytes of every
+field, SD element name, SD field name and SD value are appended to it and
+looked up by offset and length. SD elements and fields are small structs kept
+in two arrays next to it. Nothing is allocated per field; the arena and the
+arrays grow by doubling and keep their size when the message is reset, so a
+pooled message stops allocating once it has seen its largest message.
+
+Fields are made into bytes when they are read. Fields that were never read,
+like the priority of a message that had none, are None.
+"""
 cdef class SyslogMessage(object):
-    
-    cdef StructuredData* _sd_elements
-    cdef int _num_elements
 
-    def __init__(self):
-        _sd_elements = <StructuredData*> malloc(sizeof(StructuredData) * 32)
+    cdef char *_arena
+    cdef int _arena_size, _arena_length
+    cdef int _bounds[16]
+    cdef StructuredData *_sd_elements
+    cdef int _num_elements, _elements_size
+    cdef StructuredDataField *_sd_fields
+    cdef int _num_fields, _fields_size
+
+    def __cinit__(self, int size_hint=DEFAULT_ARENA_SIZE):
+        self._arena = <char*> malloc(sizeof(char) * size_hint)
+        self._sd_elements = <StructuredData*> malloc(
+            sizeof(StructuredData) * _DEFAULT_SD_ELEMENTS)
+        self._sd_fields = <StructuredDataField*> malloc(
+            sizeof(StructuredDataField) * _DEFAULT_SD_FIELDS)
+        if (self._arena is NULL or self._sd_elements is NULL or
+                self._sd_fields is NULL):
+            raise MemoryError()
+        self._arena_size = size_hint
+        self._elements_size = _DEFAULT_SD_ELEMENTS
+        self._fields_size = _DEFAULT_SD_FIELDS
+        self.reset()
 
     def __dealloc__(self):
-        cdef int index = 0
-        while index < self._num_elements:
-            free(_sd_elements[index].fields)
-        free(_sd_elements)
-        
-    cdef sd_element(self, char* name):
-        cdef StructuredData sde
-        sde.name = name
-        sde.fields
-        self._sd_elements[self.num_elements] = sde
+        free(self._arena)
+        free(self._sd_elements)
+        free(self._sd_fields)
+
+    cpdef reset(self):
+        cdef int field
+        self._arena_length = 0
+        self._num_elements = 0
+        self._num_fields = 0
+        for field in range(<int> FIELD_COUNT):
+            self._bounds[2 * field] = 0
+            self._bounds[2 * field + 1] = -1
+
+    def arena_size(self):
+        return self._arena_size
+
+    cdef int _reserve(self, int length) except -1:
+        cdef int new_size = self._arena_size
+        cdef char *new_arena
+        if self._arena_length + length > self._arena_size:
+            while new_size < self._arena_length + length:
+                new_size *= 2
+            new_arena = <char*> realloc(self._arena, new_size)
+            if new_arena is NULL:
+                raise MemoryError()
+            self._arena = new_arena
+            self._arena_size = new_size
+        return 0
+
+    cdef int _append(self, CyclicBuffer source, int length) except -1:
+        """
+        Moves length bytes out of source onto the end of the arena and
+        returns the offset they start at.
+        """
+        cdef int offset = self._arena_length
+        self._reserve(length)
+        source._get(self._arena, offset, length)
+        self._arena_length += length
+        return offset
+
+    cdef int _set_field(self, int field, int offset, int length):
+        self._bounds[2 * field] = offset
+        self._bounds[2 * field + 1] = length
+        return 0
+
+    cdef int _sd_element(self, int offset, int length) except -1:
+        cdef StructuredData *element
+        if self._num_elements == self._elements_size:
+            element = <StructuredData*> realloc(
+                self._sd_elements,
+                sizeof(StructuredData) * self._elements_size * 2)
+            if element is NULL:
+                raise MemoryError()
+            self._sd_elements = element
+            self._elements_size *= 2
+        element = &self._sd_elements[self._num_elements]
+        element.name_offset = offset
+        element.name_length = length
+        element.first_field = self._num_fields
+        element.num_fields = 0
         self._num_elements += 1
-        
+        return 0
+
+    cdef int _sd_field(self, int name_offset, int name_length,
+                       int value_offset, int value_length) except -1:
+        cdef StructuredDataField *sd_field
+        if self._num_fields == self._fields_size:
+            sd_field = <StructuredDataField*> realloc(
+                self._sd_fields,
+                sizeof(StructuredDataField) * self._fields_size * 2)
+            if sd_field is NULL:
+                raise MemoryError()
+            self._sd_fields = sd_field
+            self._fields_size *= 2
+        sd_field = &self._sd_fields[self._num_fields]
+        sd_field.name_offset = name_offset
+        sd_field.name_length = name_length
+        sd_field.value_offset = value_offset
+        sd_field.value_length = value_length
+        self._sd_elements[self._num_elements - 1].num_fields += 1
+        self._num_fields += 1
+        return 0
+
+    cdef object _field(self, int field):
+        cdef int offset = self._bounds[2 * field]
+        cdef int length = self._bounds[2 * field + 1]
+        if length < 0:
+            return None
+        return self._arena[offset:offset + length]
+
+    property priority:
+        def __get__(self):
+            return self._field(PRIORITY_FIELD)
+
+    property version:
+        def __get__(self):
+            return self._field(VERSION_FIELD)
+
+    property timestamp:
+        def __get__(self):
+            return self._field(TIMESTAMP_FIELD)
+
+    property hostname:
+        def __get__(self):
+            return self._field(HOSTNAME_FIELD)
+
+    property appname:
+        def __get__(self):
+            return self._field(APPNAME_FIELD)
+
+    property processid:
+        def __get__(self):
+            return self._field(PROCESSID_FIELD)
+
+    property messageid:
+        def __get__(self):
+            return self._field(MESSAGEID_FIELD)
+
+    property message:
+        def __get__(self):
+            return self._field(MESSAGE_FIELD)
+
+    property sd:
+        def __get__(self):
+            cdef StructuredData *element
+            cdef StructuredDataField *sd_field
+            cdef int index, field_index
+            cdef dict sd = dict()
+            cdef dict fields
+            for index in range(self._num_elements):
+                element = &self._sd_elements[index]
+                fields = dict()
+                for field_index in range(
+                        element.first_field,
+                        element.first_field + element.num_fields):
+                    sd_field = &self._sd_fields[field_index]
+                    fields[self._arena[
+                        sd_field.name_offset:
+                        sd_field.name_offset + sd_field.name_length]] = (
+                        self._arena[sd_field.value_offset:
+                                    sd_field.value_offset +
+                                    sd_field.value_length])
+                sd[self._arena[element.name_offset:
+                               element.name_offset + element.name_length]] = (
+                    fields)
+            return sd
 
+
+"""
+A SyslogMessagePool hands out reset messages and takes them back once they
+have been consumed. At most max_size idle messages are kept.
+"""
+cdef class SyslogMessagePool(object):
+
+    cdef list _idle
+    cdef int _max_size, _size_hint
+
+    def __cinit__(self, int max_size=DEFAULT_POOL_SIZE,
+                  int size_hint=DEFAULT_ARENA_SIZE):
+        self._idle = list()
+        self._max_size = max_size
+        self._size_hint = size_hint
+
+    def __len__(self):
+        return len(self._idle)
+
+    cpdef SyslogMessage acquire(self):
+        if self._idle:
+            return self._idle.pop()
+        return SyslogMessage(self._size_hint)
+
+    cpdef release(self, SyslogMessage message):
+        if len(self._idle) < self._max_size:
+            message.reset()
+            self._idle.append(message)
+
+
+"""
+The SyslogLexer reads octet counted RFC 5424 messages out of a CyclicBuffer.
+Every token is found with a bounded seek over the buffer and moved straight
+into the arena of the message being read, so nothing is copied through an
+intermediate buffer or made into a Python object while lexing.
+
+on_read returns the messages that the data completed. Messages come from the
+lexer's pool and are handed back to it with release once consumed. A
+SyslogLexerError leaves the lexer mid message; the stream it was reading can
+not be recovered.
+"""
 cdef class SyslogLexer(object):
 
     cdef CyclicBuffer _accumulator
-    cdef char* _lookaside
-    cdef int _octet_count, _read_offset, _state
-    
-    def __cinit__(self, int size_hint=1024):
+    cdef SyslogMessagePool _pool
+    cdef SyslogMessage _message
+    cdef list _completed
+    cdef int _octet_count, _state
+    cdef int _token_offset, _token_length
+    cdef int _sd_name_offset, _sd_name_length
+    cdef int _value_offset, _message_offset
+
+    def __cinit__(self, int size_hint=1024, SyslogMessagePool pool=None):
         self._accumulator = CyclicBuffer(size_hint)
-        self._lookaside = <char*> malloc(sizeof(char) * size_hint) 
+        self._pool = pool if pool is not None else SyslogMessagePool()
+        self._completed = list()
         self._state = START
 
     def get_message(self):
         return self._message
 
+    def buffered(self):
+        return self._accumulator.available()
+
     def get_state(self):
         return self._state
 
-    def on_read(self, message):
-        # Load into our accumulator
-        self._accumulator.put(message)
-        while self._accumulator.available() > 0 and self.parse_next():
+    def release(self, SyslogMessage message):
+        self._pool.release(message)
+
+    def on_read(self, const unsigned char[::1] data):
+        cdef list completed
+        if data.shape[0] > 0:
+            self._accumulator._put(<char*> &data[0], 0, data.shape[0])
+        while self._accumulator._available > 0 and self._parse_next():
             pass
-        
-    def _get_until(self, delimeter, read_limit):
-        read = self._accumulator.get_until(
-            delimeter,
-            self._lookaside,
-            0,
-            read_limit)
-        if read > -1:
-            # Skip the following delim and mark what we've read
-            self._accumulator.skip(1)
-            self._octet_count -= read + 1
-            self._read_offset = read
-        return read
-
-    def _next_token(self, offset=0):
-        return self._lookaside[offset:self._read_offset]
-
-    def parse_next(self):
+        completed = self._completed
+        self._completed = list()
+        return completed
+
+    cdef int _seek(self, const char *delims, int delim_count,
+                   int limit) except -2:
+        cdef CyclicBuffer accumulator = self._accumulator
+        cdef int found
+        # Tokens never run past the end of their frame
+        if self._state != READ_OCTET and self._octet_count < limit:
+            limit = self._octet_count
+        found = c_buffer_seek(
+            delims, delim_count, accumulator._buffer,
+            accumulator._current_size, accumulator._read_index,
+            accumulator._available, limit)
+        if found == SEEK_LIMIT_REACHED:
+            raise SyslogLexerError(
+                'Token too long while in state {}.'.format(self._state))
+        return found
+
+    cdef int _read_token(self, const char *delims, int delim_count,
+                         int limit) except -1:
+        """
+        Moves the bytes up to the next delimiter into the message arena and
+        returns 1 or returns 0 when the delimiter hasn't been read yet. The
+        delimiter is left in the buffer.
+        """
+        cdef int found = self._seek(delims, delim_count, limit)
+        if found == SEEK_NOT_FOUND:
+            return 0
+        self._token_offset = self._message._append(self._accumulator, found)
+        self._token_length = found
+        self._octet_count -= found
+        return 1
+
+    cdef int _read_field(self, int field, char delim, int limit) except -1:
+        if not self._read_token(&delim, 1, limit):
+            return 0
+        self._message._set_field(
+            field, self._token_offset, self._token_length)
+        self._skip()
+        return 1
+
+    cdef char _peek(self):
+        return self._accumulator._buffer[self._accumulator._read_index]
+
+    cdef int _skip(self) except -1:
+        self._accumulator.skip(1)
+        self._octet_count -= 1
+        return 0
+
+    cdef int _read_octet_count(self) except -1:
+        cdef char digits[OCTET_LIMIT]
+        cdef int found = self._seek(&_SPACE, 1, OCTET_LIMIT)
+        cdef int count = 0
+        cdef int index
+        if found == SEEK_NOT_FOUND:
+            return 0
+        if found == 0:
+            raise SyslogLexerError('Missing octet count.')
+        self._accumulator._get(digits, 0, found)
+        self._accumulator.skip(1)
+        for index in range(found):
+            if digits[index] < c'0' or digits[index] > c'9':
+                raise SyslogLexerError('Bad octet count: {!r}.'.format(
+                    digits[:found]))
+            count = count * 10 + (digits[index] - c'0')
+        if count > _MAX_BYTES:
+            raise SyslogLexerError('Bad frame length: {}.'.format(count))
+        self._octet_count = count
+        return 1
+
+    cdef int _finish(self) except -1:
+        if self._state == READ_MESSAGE:
+            self._message._set_field(
+                MESSAGE_FIELD, self._message_offset,
+                self._message._arena_length - self._message_offset)
+        elif self._state != READ_SD_ELEMENT:
+            raise SyslogLexerError(
+                'Frame ended while in state {}.'.format(self._state))
+        self._completed.append(self._message)
+        self._state = START
+        return 0
+
+    cdef int _parse_next(self) except -1:
+        cdef int read
+        cdef char delim
+
         if self._state == START:
-            self._octet_count = 0
-            self._read_offset = 0
+            self._message = self._pool.acquire()
             self._state = READ_OCTET
-            self._structured_data = None
-            self._sd_field = None
-        
+
         if self._state == READ_OCTET:
-            if self._get_until(_SPACE, 9) > -1:
-                self._octet_count += int(self._next_token())
-                self._message = SyslogMessage()
-                self._state = READ_PRI
-                return True
+            if not self._read_octet_count():
+                return 0
+            self._state = READ_PRI
         elif self._state == READ_PRI:
-            if self._get_until(_CLOSE_ANGLE_BRACKET, 5) > -1:
-                self._state = READ_VERSION
-                self._message.priority = self._next_token(1)
-                return True
+            if not self._read_token(&_CLOSE_ANGLE_BRACKET, 1, PRI_LIMIT):
+                return 0
+            if (self._token_length < 2 or
+                    self._message._arena[self._token_offset] !=
+                    _OPEN_ANGLE_BRACKET):
+                raise SyslogLexerError('Expected a priority.')
+            self._message._set_field(
+                PRIORITY_FIELD, self._token_offset + 1, self._token_length - 1)
+            self._skip()
+            self._state = READ_VERSION
         elif self._state == READ_VERSION:
-            if self._get_until(_SPACE, 2) > -1:
-                self._state = READ_TIMESTAMP
-                self._message.version = self._next_token()
-                return True
+            if not self._read_field(VERSION_FIELD, _SPACE, VERSION_LIMIT):
+                return 0
+            self._state = READ_TIMESTAMP
         elif self._state == READ_TIMESTAMP:
-            if self._get_until(_SPACE, 48) > -1:
-                self._state = READ_HOSTNAME
-                self._message.timestamp = self._next_token()
-                return True
+            if not self._read_field(TIMESTAMP_FIELD, _SPACE, TIMESTAMP_LIMIT):
+                return 0
+            self._state = READ_HOSTNAME
         elif self._state == READ_HOSTNAME:
-            if self._get_until(_SPACE, 255) > -1:
-                self._state = READ_APPNAME
-                self._message.hostname = self._next_token()
-                return True
+            if not self._read_field(HOSTNAME_FIELD, _SPACE, HOSTNAME_LIMIT):
+                return 0
+            self._state = READ_APPNAME
         elif self._state == READ_APPNAME:
-            if self._get_until(_SPACE, 48) > -1:
-                self._state = READ_PROCESSID
-                self._message.appname = self._next_token()
-                return True
+            if not self._read_field(APPNAME_FIELD, _SPACE, APPNAME_LIMIT):
+                return 0
+            self._state = READ_PROCESSID
         elif self._state == READ_PROCESSID:
-            if self._get_until(_SPACE, 128) > -1:
-                self._state = READ_MESSAGEID
-                self._message.processid = self._next_token()
-                return True
+            if not self._read_field(
+                    PROCESSID_FIELD, _SPACE, PROCESSID_LIMIT):
+                return 0
+            self._state = READ_MESSAGEID
         elif self._state == READ_MESSAGEID:
-            if self._get_until(_SPACE, 32) > -1:
-                self._state = READ_SD_ELEMENT
-                self._message.messageid = self._next_token()
-                return True
+            if not self._read_field(
+                    MESSAGEID_FIELD, _SPACE, MESSAGEID_LIMIT):
+                return 0
+            self._state = READ_SD_ELEMENT
         elif self._state == READ_SD_ELEMENT:
-            read = self._accumulator.get(
-                data=self._lookaside,
-                length=1)
-            if read > 0:
-                self._octet_count -= read
-                potential_delim = self._lookaside[0]
-                if potential_delim == _SPACE_ORD:
-                    self._state = READ_MESSAGE
-                elif potential_delim == _OPEN_BRACKET_ORD:
-                    self._state = READ_SD_ELEMENT_NAME
-                else:
-                    raise Exception('Unexpected delimeter: {} - {}'.format(
-                        chr(potential_delim), potential_delim))
-                return True
+            delim = self._peek()
+            self._skip()
+            if delim == _SPACE:
+                self._message_offset = self._message._arena_length
+                self._state = READ_MESSAGE
+            elif delim == _OPEN_BRACKET:
+                self._state = READ_SD_ELEMENT_NAME
+            elif delim != _DASH:
+                raise SyslogLexerError('Unexpected delimeter: {!r}'.format(
+                    chr(<unsigned char> delim)))
         elif self._state == READ_SD_ELEMENT_NAME:
-            if self._get_until(_SPACE, 32) > -1:
-                self._structured_data = self._message.sd_element(
-                    self._next_token())
+            if not self._read_token(_SD_NAME_DELIMS, 2, SD_NAME_LIMIT):
+                return 0
+            self._message._sd_element(self._token_offset, self._token_length)
+            delim = self._peek()
+            self._skip()
+            if delim == _CLOSE_BRACKET:
+                self._state = READ_SD_ELEMENT
+            else:
                 self._state = READ_SD_FIELD_NAME
-                return True
         elif self._state == READ_SD_FIELD_NAME:
-            if self._get_until(_EQUALS, 32) > -1:
-                self._sd_field = self._structured_data.sd_field(
-                    self._next_token())             
-                self._state = READ_SD_VALUE_START
-                return True
+            if not self._read_token(&_EQUALS, 1, SD_NAME_LIMIT):
+                return 0
+            self._sd_name_offset = self._token_offset
+            self._sd_name_length = self._token_length
+            self._skip()
+            self._state = READ_SD_VALUE_START
         elif self._state == READ_SD_VALUE_START:
-            if self._get_until(_QUOTE, 32) > -1:
-                self._state = READ_SD_VALUE_CONTENT
-                return True
+            if self._peek() != _QUOTE:
+                raise SyslogLexerError('Expected a quoted value.')
+            self._skip()
+            self._value_offset = self._message._arena_length
+            self._state = READ_SD_VALUE_CONTENT
         elif self._state == READ_SD_VALUE_CONTENT:
-            if self._get_until(_QUOTE, 255) > -1:
-                self._sd_field.value = self._next_token()
+            if not self._read_token(&_QUOTE, 1, self._octet_count):
+                return 0
+            if self._escaped():
+                # The quote belongs to the value
+                self._message._append(self._accumulator, 1)
+                self._octet_count -= 1
+            else:
+                self._message._sd_field(
+                    self._sd_name_offset, self._sd_name_length,
+                    self._value_offset,
+                    self._message._arena_length - self._value_offset)
+                self._skip()
                 self._state = READ_SD_NEXT_FIELD_OR_END
-                return True
         elif self._state == READ_SD_NEXT_FIELD_OR_END:
-            read = self._accumulator.get(
-                data=self._lookaside,
-                length=1)
-            if read > 0:
-                self._octet_count -= read
-                potential_delim = self._lookaside[0]
-                if potential_delim == _SPACE_ORD:
-                    self._state = READ_SD_FIELD_NAME
-                elif potential_delim == _CLOSE_BRACKET_ORD:
-                    self._state = READ_SD_ELEMENT
-                return True
+            delim = self._peek()
+            self._skip()
+            if delim == _SPACE:
+                self._state = READ_SD_FIELD_NAME
+            elif delim == _CLOSE_BRACKET:
+                self._state = READ_SD_ELEMENT
+            else:
+                raise SyslogLexerError('Unexpected delimeter: {!r}'.format(
+                    chr(<unsigned char> delim)))
         elif self._state == READ_MESSAGE:
-            read = self._accumulator.get(
-                data=self._lookaside,
-                length=self._octet_count)
-            if read > 0:
-                self._octet_count -= read
-                if self._octet_count == 0:
-                    self._state = START
-        return False
+            read = self._accumulator._available
+            if read > self._octet_count:
+                read = self._octet_count
+            self._message._append(self._accumulator, read)
+            self._octet_count -= read
+
+        if self._octet_count == 0 and self._state > READ_OCTET:
+            self._finish()
+        return 1
 
+    cdef int _escaped(self):
+        # An odd run of backslashes before a quote escapes it
+        cdef char *arena = self._message._arena
+        cdef int index = self._message._arena_length
+        while index > self._value_offset and arena[index - 1] == _BACKSLASH:
+            index -= 1
+        return (self._message._arena_length - index) % 2
@@ -0,0 +1,161 @@
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from netpype.tests.support import EmptyPipelineFactory
+from netpype.affinity import parse_cpu_list, allowed_cpus, numa_nodes
+from netpype.affinity import node_cpus, default_layout, rx_queue_cpus
+from netpype.affinity import set_incoming_cpu
+from netpype.channel import SocketUnixAddress
+from netpype.dispatch import DispatchPool, THREAD_POOL
+from netpype.server.cluster import SelectorServerCluster
+from netpype.server.poll import PollSelectorServer
+
+
+_INTERRUPTS = """\
+           CPU0       CPU1       CPU2       CPU3
+  0:         22          0          0          0   IO-APIC   2-edge      timer
+ 41:          0          0          0          0   PCI-MSI 524288-edge      eth0
+ 42:       1004          0          0          0   PCI-MSI 524289-edge      eth0-TxRx-0
+ 43:          0       2001          0          0   PCI-MSI 524290-edge      eth0-TxRx-1
+ 44:          0          0          0         12   PCI-MSI 524291-edge      eth0-tx-2
+ 45:          0          0          0          0   PCI-MSI 524292-edge      eth10-rx-0
+NMI:          0          0          0          0   Non-maskable interrupts
+"""
+
+
+def _write(path, content):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as output:
+        output.write(content)
+
+
+def _current_cpus():
+    return sorted(os.sched_getaffinity(0))
+
+
+class WhenReadingTopology(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cpu_lists(self):
+        self.assertEqual([0, 1, 2, 3, 8, 10, 11],
+                         parse_cpu_list('0-3,8,10-11\n'))
+        self.assertEqual([], parse_cpu_list('\n'))
+
+    def test_numa_nodes(self):
+        cpus = allowed_cpus()
+        half = len(cpus) // 2 or 1
+        _write(os.path.join(self.directory, 'node0', 'cpulist'),
+               ','.join(str(cpu) for cpu in cpus[:half]))
+        _write(os.path.join(self.directory, 'node1', 'cpulist'),
+               ','.join(str(cpu) for cpu in cpus[half:]))
+        _write(os.path.join(self.directory, 'possible'), '0-1')
+
+        nodes = numa_nodes(self.directory)
+        self.assertEqual(cpus[:half], nodes[0])
+        self.assertEqual(cpus[half:], nodes.get(1, []))
+
+    def test_missing_topology_is_one_node(self):
+        self.assertEqual({0: allowed_cpus()},
+                         numa_nodes(os.path.join(self.directory, 'none')))
+
+    def test_layouts_interleave_nodes(self):
+        nodes = {0: [0, 1, 2], 1: [4, 5]}
+        self.assertEqual([(0,), (4,), (1,), (5,), (2,), (0,)],
+                         default_layout(6, nodes))
+
+    def test_node_cpus(self):
+        nodes = {0: [0, 1], 1: [2, 3]}
+        self.assertEqual([2, 3], node_cpus((3,), nodes))
+        self.assertEqual([0, 1, 2, 3], node_cpus((1, 2), nodes))
+
+    def test_rx_queue_cpus(self):
+        interrupts = os.path.join(self.directory, 'interrupts')
+        irq_root = os.path.join(self.directory, 'irq')
+        _write(interrupts, _INTERRUPTS)
+        _write(os.path.join(irq_root, '42', 'effective_affinity_list'), '6')
+        _write(os.path.join(irq_root, '42', 'smp_affinity_list'), '0-7')
+        _write(os.path.join(irq_root, '43', 'smp_affinity_list'), '3,7')
+        _write(os.path.join(irq_root, '44', 'smp_affinity_list'), '5')
+
+        self.assertEqual([6, 3], rx_queue_cpus('eth0', interrupts, irq_root))
+        self.assertEqual([], rx_queue_cpus('eth1', interrupts, irq_root))
+
+
+class WhenPinningWorkers(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_servers_pin_themselves(self):
+        cpu = allowed_cpus()[-1]
+        server = PollSelectorServer(
+            SocketUnixAddress(os.path.join(self.directory, 'pinned.sock')),
+            EmptyPipelineFactory(), cpus=(cpu,))
+        server.start()
+        try:
+            deadline = time.time() + 5
+            while server.heartbeat() is None and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(
+                {cpu}, os.sched_getaffinity(server._control.pid()))
+        finally:
+            server.interrupt()
+            if not server.join(2):
+                server.terminate()
+
+    def test_dispatch_workers_pin_themselves(self):
+        cpu = allowed_cpus()[-1]
+        pool = DispatchPool(THREAD_POOL, workers=1, cpus=(cpu,))
+        pool.start()
+        try:
+            self.assertEqual([cpu], pool._pool.apply(_current_cpus))
+        finally:
+            pool.close()
+
+    def test_incoming_cpus(self):
+        listener = socket.socket()
+        try:
+            set_incoming_cpu(listener, 0)
+        except socket.error:
+            self.skipTest('SO_INCOMING_CPU is not supported.')
+        finally:
+            listener.close()
+
+
+class WhenLayingOutClusters(unittest.TestCase):
+
+    def _cluster(self, **kwargs):
+        return SelectorServerCluster(
+            PollSelectorServer, SocketUnixAddress('unused.sock'),
+            EmptyPipelineFactory(), **kwargs)
+
+    def test_workers_follow_the_layout(self):
+        cluster = self._cluster(layout=[(0,), (1, 2)])
+        self.assertEqual(2, len(cluster.workers()))
+        self.assertEqual({'cpus': (1, 2)}, cluster._placement(1))
+
+    def test_workers_default_to_allowed_cpus(self):
+        cluster = self._cluster()
+        self.assertEqual(len(allowed_cpus()), len(cluster.workers()))
+        self.assertEqual({}, cluster._placement(0))
+
+    def test_unknown_interfaces(self):
+        with self.assertRaises(ValueError):
+            self._cluster(rx_interface='nonexistent0')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+from netpype.batch import SyslogBatch, PRIORITY, HOSTNAME, MESSAGE
+
+
+class WhenBatchingSyslogMessages(unittest.TestCase):
+
+    def setUp(self):
+        self.batch = SyslogBatch()
+
+    def _add(self, hostname, sd=None):
+        index = self.batch.begin()
+        self.batch.put_field(PRIORITY, b'46')
+        self.batch.put_field(HOSTNAME, hostname)
+        for name, fields in (sd or dict()).items():
+            self.batch.put_sd_element(name)
+            for field_name, value in fields.items():
+                self.batch.put_sd_field(field_name, value)
+        return index
+
+    def test_fields_read_back(self):
+        self._add(b'tohru')
+        self._add(b'ukyo')
+        self.assertEqual(2, len(self.batch))
+        self.assertEqual(b'46', self.batch[0].priority)
+        self.assertEqual(b'ukyo', self.batch[1].hostname)
+        self.assertEqual(b'ukyo', self.batch[-1].hostname)
+        self.assertEqual(b'ukyo', bytes(self.batch[1].view(HOSTNAME)))
+
+    def test_unset_fields_are_none(self):
+        self._add(b'tohru')
+        self.assertIsNone(self.batch[0].message)
+        self.assertIsNone(self.batch[0].view(MESSAGE))
+
+    def test_fields_set_from_copied_frames(self):
+        self.batch.begin()
+        offset = self.batch.copy(b'<13> body')
+        bounds = [0, -1] * 8
+        bounds[0:2] = [offset + 1, 2]
+        bounds[14:16] = [offset + 5, 4]
+        self.batch.set_fields(bounds)
+        self.assertEqual(b'13', self.batch[0].priority)
+        self.assertEqual(b'body', self.batch[0].message)
+        self.assertIsNone(self.batch[0].hostname)
+
+    def test_structured_data(self):
+        sd = {b'origin': {b'software': b'rsyslogd', b'x-pid': b'12297'},
+              b'meta': {}}
+        self._add(b'tohru')
+        self._add(b'ukyo', sd)
+        self.assertEqual({}, self.batch[0].sd)
+        self.assertEqual(sd, self.batch[1].sd)
+
+    def test_sd_fields_require_an_element(self):
+        self.batch.begin()
+        with self.assertRaises(ValueError):
+            self.batch.put_sd_field(b'name', b'value')
+
+    def test_rollback(self):
+        self._add(b'tohru')
+        arena_length = len(self.batch.arena)
+        self._add(b'ukyo', {b'origin': {b'a': b'b'}})
+        self.batch.rollback()
+        self.assertEqual(1, len(self.batch))
+        self.assertEqual(arena_length, len(self.batch.arena))
+        self._add(b'ranma', {b'meta': {b'c': b'd'}})
+        self.assertEqual({b'meta': {b'c': b'd'}}, self.batch[1].sd)
+
+    def test_iteration_and_clear(self):
+        for hostname in (b'a', b'b', b'c'):
+            self._add(hostname)
+        self.assertEqual(
+            [b'a', b'b', b'c'], [view.hostname for view in self.batch])
+        self.batch.clear()
+        self.assertEqual(0, len(self.batch))
+        self.assertEqual(0, len(self.batch.arena))
+        with self.assertRaises(IndexError):
+            self.batch[0]
+
+
+if __name__ == '__main__':
+    unittest.main()
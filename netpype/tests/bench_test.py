@@ -0,0 +1,53 @@
+import unittest
+
+from netpype.selector import events as selection_events
+from netpype.channel import CyclicBuffer
+from netpype.bench.load import SyslogWorkload, percentile
+from netpype.bench.pipelines import SyslogAckHandler
+from netpype.bench import lexers
+
+
+class WhenAcknowledgingSyslogFrames(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = SyslogAckHandler(CyclicBuffer)
+        self.request = SyslogWorkload(message=b'<46>1 - - - - - - hi',
+                                      batch=3).request
+
+    def test_whole_frames_acknowledged(self):
+        self.assertEqual((selection_events.REQUEST_WRITE, b'...'),
+                         self.handler.on_read(self.request))
+
+    def test_split_frames_acknowledged_once_complete(self):
+        self.assertEqual((selection_events.REQUEST_WRITE, b'.'),
+                         self.handler.on_read(self.request[:30]))
+        self.assertIsNone(self.handler.on_read(self.request[30:40]))
+        self.assertEqual((selection_events.REQUEST_WRITE, b'..'),
+                         self.handler.on_read(self.request[40:]))
+
+
+class WhenSummarizingLatencies(unittest.TestCase):
+
+    def test_percentiles(self):
+        samples = list(range(1, 101))
+        self.assertEqual(51, percentile(samples, 0.5))
+        self.assertEqual(100, percentile(samples, 0.99))
+        self.assertIsNone(percentile([], 0.5))
+
+
+class WhenBenchmarkingLexers(unittest.TestCase):
+
+    def test_every_lexer_reports_a_rate(self):
+        results = lexers.run(messages=50, rounds=1)
+        self.assertEqual([name for name, _ in lexers.LEXERS],
+                         [result['lexer'] for result in results])
+        for result in results:
+            self.assertTrue(result['messages_per_sec'] > 0)
+
+    def test_reads_cover_the_stream(self):
+        data = lexers.octet_stream(count=10)
+        self.assertEqual(data, b''.join(lexers.reads(data, 100)))
+
+
+if __name__ == '__main__':
+    unittest.main()
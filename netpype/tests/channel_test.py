@@ -1,3 +1,7 @@
+import os
+import shutil
+import socket
+import tempfile
 import unittest
 import time
 
@@ -77,6 +81,90 @@ class WhenManipulatingCyclicBuffers(unittest.TestCase):
         buff.put(bytearray('More than you can handle.'), 0, 25)
         self.assertEqual(25, buff.available())
 
+    def test_growing_keeps_data(self):
+        buff = channel.CyclicBuffer(size_hint=8)
+        buff.put(bytearray(b'abcdef'))
+        buff.put(bytearray(b'ghijkl'))
+        self.assertEqual(12, buff.available())
+        dest = bytearray(12)
+        buff.get(dest)
+        self.assertEqual(b'abcdefghijkl', bytes(dest))
+
+    def test_skip_wraps(self):
+        buff = channel.CyclicBuffer(size_hint=8)
+        buff.put(bytearray(b'abcdef'))
+        buff.skip(6)
+        buff.put(bytearray(b'ghijk'))
+        buff.skip(3)
+        dest = bytearray(2)
+        buff.get(dest)
+        self.assertEqual(b'jk', bytes(dest))
+
+    def test_writable_view(self):
+        buff = channel.CyclicBuffer(size_hint=8)
+        view = buff.writable_view(4)
+        self.assertEqual(8, len(view))
+        view[0:4] = b'test'
+        buff.commit(4)
+        self.assertEqual(4, buff.available())
+        self.assertEqual(b'test', buff.readable_view().tobytes())
+
+    def test_writable_view_grows(self):
+        buff = channel.CyclicBuffer(size_hint=8)
+        buff.put(bytearray(b'abcdef'))
+        view = buff.writable_view(16)
+        self.assertTrue(len(view) >= 16)
+        view[0:2] = b'gh'
+        buff.commit(2)
+        self.assertEqual(b'abcdefgh', buff.readable_view().tobytes())
+
+    def test_readable_view_stops_at_wrap(self):
+        buff = channel.CyclicBuffer(size_hint=8)
+        buff.put(bytearray(b'abcdef'))
+        buff.skip(4)
+        buff.put(bytearray(b'ghij'))
+        self.assertEqual(6, buff.available())
+        self.assertEqual(b'efgh', buff.readable_view().tobytes())
+
+
+class WhenSeekingDelimiters(unittest.TestCase):
+
+    def _wrapped(self):
+        # Leaves 'cd ef' wrapped around the end of an eight byte ring
+        buff = channel.CyclicBuffer(size_hint=8)
+        buff.put(bytearray(b'xxxxxxab'))
+        buff.skip(6)
+        buff.put(bytearray(b'c ef'))
+        return buff
+
+    def test_seek_across_the_wrap(self):
+        buff = self._wrapped()
+        data = bytearray(8)
+        self.assertEqual(3, buff.get_until(b' ', data))
+        self.assertEqual(b'abc', bytes(data[:3]))
+
+    def test_first_of_several_delimiters(self):
+        source = bytearray(b'key=value; next')
+        self.assertEqual(3, channel.seek(b';=', source, 15, 0, 15))
+        self.assertEqual(9, channel.seek(b' ;', source, 15, 0, 15))
+
+    def test_many_delimiters(self):
+        source = bytearray(b'abcdefgh')
+        self.assertEqual(5, channel.seek(b'zyxwvf', source, 8, 0, 8))
+
+    def test_limit(self):
+        source = bytearray(b'abcdefgh')
+        self.assertEqual(4, channel.seek(b'e', source, 8, 0, 8, 5))
+        self.assertEqual(channel.SEEK_LIMIT_REACHED,
+                         channel.seek(b'e', source, 8, 0, 8, 4))
+        self.assertEqual(channel.SEEK_NOT_FOUND,
+                         channel.seek(b'z', source, 8, 0, 4, 6))
+
+    def test_nothing_past_available(self):
+        source = bytearray(b'abc ')
+        self.assertEqual(channel.SEEK_NOT_FOUND,
+                         channel.seek(b' ', source, 4, 0, 3))
+
 
 class WhenManipulatingChannelBuffers(unittest.TestCase):
 
@@ -98,6 +186,154 @@ class WhenManipulatingChannelBuffers(unittest.TestCase):
         channel_buffer.sent(5)
         self.assertTrue(channel_buffer.empty())
 
+    def test_queueing_buffers(self):
+        channel_buffer = channel.ChannelBuffer()
+        channel_buffer.put(b'first')
+        channel_buffer.put(b'second')
+        self.assertEqual(11, channel_buffer.size())
+        self.assertEqual(2, len(channel_buffer.buffers()))
+        channel_buffer.sent(7)
+        self.assertEqual(4, channel_buffer.size())
+        self.assertEqual(b'cond', channel_buffer.remaining().tobytes())
+
+    def test_watermarks(self):
+        channel_buffer = channel.ChannelBuffer(
+            high_watermark=8, low_watermark=4)
+        channel_buffer.put(b'12345678')
+        self.assertTrue(channel_buffer.above_high_watermark())
+        channel_buffer.sent(3)
+        self.assertFalse(channel_buffer.above_high_watermark())
+        self.assertFalse(channel_buffer.below_low_watermark())
+        channel_buffer.sent(1)
+        self.assertTrue(channel_buffer.below_low_watermark())
+
+    def test_rejects_inverted_watermarks(self):
+        self.assertRaises(ValueError, channel.ChannelBuffer,
+                          b'', 4, 8)
+
+    def test_gather_send(self):
+        local, remote = socket.socketpair()
+        try:
+            channel_buffer = channel.ChannelBuffer()
+            channel_buffer.put(b'one ')
+            channel_buffer.put(b'two ')
+            channel_buffer.put(b'three')
+            self.assertEqual(13, channel_buffer.send(local))
+            self.assertTrue(channel_buffer.empty())
+            self.assertEqual(b'one two three', remote.recv(32))
+        finally:
+            local.close()
+            remote.close()
+
+
+class WhenSizingReceives(unittest.TestCase):
+
+    def test_grows_on_full_reads(self):
+        sizer = channel.ReceiveSizer(1024, 512, 4096)
+        sizer.record(1024)
+        self.assertEqual(2048, sizer.size)
+        sizer.record(2048)
+        sizer.record(4096)
+        self.assertEqual(4096, sizer.size)
+
+    def test_shrinks_after_two_small_reads(self):
+        sizer = channel.ReceiveSizer(4096, 512, 4096)
+        sizer.record(100)
+        self.assertEqual(4096, sizer.size)
+        sizer.record(100)
+        self.assertEqual(2048, sizer.size)
+        sizer.record(100)
+        sizer.record(100)
+        sizer.record(100)
+        sizer.record(100)
+        self.assertEqual(512, sizer.size)
+
+    def test_partial_reads_reset_shrinking(self):
+        sizer = channel.ReceiveSizer(4096, 512, 4096)
+        sizer.record(100)
+        sizer.record(3000)
+        sizer.record(100)
+        self.assertEqual(4096, sizer.size)
+
+    def test_rejects_bad_bounds(self):
+        self.assertRaises(ValueError, channel.ReceiveSizer, 64, 512, 4096)
+
+
+class WhenCreatingServerSockets(unittest.TestCase):
+
+    def test_reuse_port(self):
+        if channel.SO_REUSEPORT is None:
+            self.skipTest('SO_REUSEPORT is not supported on this platform.')
+        addr = channel.SocketINet4Address('127.0.0.1', 0)
+        first = channel.server_socket(addr, reuse_port=True)
+        try:
+            addr.port = first.getsockname()[1]
+            second = channel.server_socket(addr, reuse_port=True)
+            self.assertEqual(first.getsockname(), second.getsockname())
+            second.close()
+        finally:
+            first.close()
+
+    def test_socket_buffers(self):
+        addr = channel.SocketINet4Address('127.0.0.1', 0)
+        ssock = channel.server_socket(addr, rcvbuf=65536, sndbuf=65536)
+        try:
+            # Linux doubles the requested size for bookkeeping
+            self.assertTrue(ssock.getsockopt(
+                socket.SOL_SOCKET, socket.SO_RCVBUF) >= 65536)
+            self.assertTrue(ssock.getsockopt(
+                socket.SOL_SOCKET, socket.SO_SNDBUF) >= 65536)
+        finally:
+            ssock.close()
+
+
+class WhenBindingUnixSockets(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'log')
+        self.addr = channel.SocketUnixAddress(self.path, mode=0o660)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_stream_socket(self):
+        ssock = channel.server_socket(self.addr)
+        try:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(self.path)
+            client.close()
+            self.assertEqual(0o660, os.stat(self.path).st_mode & 0o777)
+        finally:
+            channel.close_socket(ssock, self.addr)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_stale_socket_is_removed(self):
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        stale.bind(self.path)
+        stale.close()
+        dsock = channel.datagram_socket(self.addr)
+        channel.close_socket(dsock, self.addr)
+
+    def test_socket_in_use(self):
+        ssock = channel.server_socket(self.addr)
+        try:
+            with self.assertRaises(IOError):
+                channel.server_socket(self.addr)
+            self.assertTrue(os.path.exists(self.path))
+        finally:
+            channel.close_socket(ssock, self.addr)
+
+    def test_other_files_are_left_alone(self):
+        open(self.path, 'w').close()
+        with self.assertRaises(IOError):
+            channel.server_socket(self.addr)
+        self.assertTrue(os.path.isfile(self.path))
+
+    def test_reuse_port(self):
+        with self.assertRaises(IOError):
+            channel.server_socket(self.addr, reuse_port=True)
+
 
 if __name__ == '__main__':
     unittest.main()
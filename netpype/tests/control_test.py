@@ -0,0 +1,170 @@
+import gc
+import os
+import select
+import shutil
+import tempfile
+import time
+import unittest
+
+from netpype.tests.support import EmptyPipelineFactory, wait_for
+from netpype import PersistentProcess, WorkerStateError
+from netpype.control import ControlBlock, REQUEST_STOP, REQUEST_DRAIN
+from netpype.channel import SocketUnixAddress
+from netpype.server.poll import PollSelectorServer
+from netpype.server.epoll import EdgeTriggeredEPollSelectorServer
+from netpype.server.datagram import DatagramServer
+
+try:
+    from netpype.server.aio import AsyncioSelectorServer
+except ImportError:
+    AsyncioSelectorServer = None
+
+
+class BlockingWorker(PersistentProcess):
+
+    def __init__(self):
+        super(BlockingWorker, self).__init__('BlockingWorker')
+
+    def on_start(self):
+        self._select_poll = select.poll()
+        self._select_poll.register(self.wakeup_fileno(), select.POLLIN)
+        self._control.stats[0] = 1
+
+    def process(self):
+        # Nothing but a control request ever wakes this worker
+        for fileno, event in self._select_poll.poll():
+            self._on_control()
+
+    def on_reload(self, generation):
+        self._control.stats[1] = generation
+
+
+class WhenSharingControlBlocks(unittest.TestCase):
+
+    def test_wakeups_drain(self):
+        control = ControlBlock()
+        poller = select.poll()
+        poller.register(control.wakeup_fileno(), select.POLLIN)
+        self.assertEqual([], poller.poll(0))
+        control.request_stop()
+        control.wake()
+        self.assertEqual(1, len(poller.poll(0)))
+        control.clear_wakeups()
+        self.assertEqual([], poller.poll(0))
+        self.assertEqual(REQUEST_STOP, control.request())
+        control.close()
+
+    def test_stops_win_over_drains(self):
+        control = ControlBlock()
+        control.request_drain(time.time() + 5)
+        self.assertEqual(REQUEST_DRAIN, control.request())
+        control.request_stop()
+        control.request_drain(time.time() + 5)
+        self.assertEqual(REQUEST_STOP, control.request())
+        control.close()
+
+    def test_heartbeats(self):
+        control = ControlBlock()
+        self.assertIsNone(control.heartbeat())
+        control.beat(1234.5)
+        self.assertEqual(1234.5, control.heartbeat())
+        control.close()
+
+
+class WhenControllingWorkers(unittest.TestCase):
+
+    def test_blocked_workers_stop_and_reload(self):
+        worker = BlockingWorker()
+        worker.start()
+        try:
+            self.assertTrue(wait_for(lambda: worker.stats()[0] == 1))
+            self.assertIsNotNone(worker.heartbeat())
+
+            worker.reload()
+            self.assertTrue(wait_for(lambda: worker.stats()[1] == 1))
+
+            started = time.time()
+            worker.interrupt()
+            self.assertTrue(worker.join(2))
+            self.assertTrue(time.time() - started < 1)
+            self.assertEqual(0, worker.exitcode())
+        finally:
+            if worker.is_alive():
+                worker.terminate()
+
+    def _run_once(self):
+        worker = BlockingWorker()
+        worker.start()
+        worker.interrupt()
+        self.assertTrue(worker.join(2))
+        # Requests to a worker that has gone are ignored
+        worker.interrupt()
+
+    def _descriptors(self):
+        # Processes give their own descriptors back once collected
+        gc.collect()
+        return len(os.listdir('/proc/self/fd'))
+
+    def test_exited_workers_close_their_descriptors(self):
+        # The first worker maps the shared memory every later one uses
+        self._run_once()
+        descriptors = self._descriptors()
+        self._run_once()
+        self._run_once()
+        self.assertEqual(descriptors, self._descriptors())
+
+    def test_workers_start_once(self):
+        worker = BlockingWorker()
+        worker.start()
+        worker.interrupt()
+        worker.join(2)
+        with self.assertRaises(WorkerStateError):
+            worker.start()
+
+
+class WhenStoppingIdleServers(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _stop(self, server_class, **kwargs):
+        path = os.path.join(self.directory, 'idle.sock')
+        server = server_class(
+            SocketUnixAddress(path), EmptyPipelineFactory(), **kwargs)
+        server.start()
+        try:
+            deadline = time.time() + 5
+            while server.heartbeat() is None and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertIsNotNone(server.heartbeat())
+
+            started = time.time()
+            server.interrupt()
+            self.assertTrue(server.join(2))
+            self.assertTrue(time.time() - started < 0.5)
+            # The worker halts itself, which removes its socket file
+            self.assertFalse(os.path.exists(path))
+        finally:
+            if server.is_alive():
+                server.terminate()
+
+    def test_poll(self):
+        self._stop(PollSelectorServer)
+
+    def test_edge_triggered_epoll(self):
+        if hasattr(select, 'epoll'):
+            self._stop(EdgeTriggeredEPollSelectorServer)
+
+    def test_asyncio(self):
+        if AsyncioSelectorServer is not None:
+            self._stop(AsyncioSelectorServer)
+
+    def test_datagrams(self):
+        self._stop(DatagramServer)
+
+
+if __name__ == '__main__':
+    unittest.main()
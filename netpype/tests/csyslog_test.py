@@ -2,15 +2,18 @@ import unittest
 import time
 
 from  netpype.csyslog import SyslogMessageAccumulator, SyslogParser, SyslogLexer
+from netpype.csyslog import SyslogBulkParser, SyslogFramingError
+from netpype.csyslog import FRAMING_OCTET_COUNTED, FRAMING_NON_TRANSPARENT
+from netpype.batch import SyslogBatch
 
 
-HAPPY_PATH_MESSAGE = bytearray('263 <46>1 2012-12-11T15:48:23.217459-06:00 tohru ' +
-                      'rsyslogd 6611 12512 [origin_1 software="rsyslogd" ' +
-                      'swVersion="7.2.2" x-pid="12297" ' +
-                      'x-info="http://www.rsyslog.com"]' +
-                      '[origin_2 software="rsyslogd" swVersion="7.2.2" ' +
-                      'x-pid="12297" x-info="http://www.rsyslog.com"] ' +
-                      'start')
+HAPPY_PATH_MESSAGE = bytearray(b'263 <46>1 2012-12-11T15:48:23.217459-06:00 tohru ' +
+                      b'rsyslogd 6611 12512 [origin_1 software="rsyslogd" ' +
+                      b'swVersion="7.2.2" x-pid="12297" ' +
+                      b'x-info="http://www.rsyslog.com"]' +
+                      b'[origin_2 software="rsyslogd" swVersion="7.2.2" ' +
+                      b'x-pid="12297" x-info="http://www.rsyslog.com"] ' +
+                      b'start')
 
 
 def chunk(data, limit, chunk_size=10):
@@ -45,6 +48,170 @@ class WhenParsingSyslog(unittest.TestCase):
         self.assertEqual('12512', self.parser.message.messageid)
 
 
+BULK_MESSAGE = (b'<46>1 2012-12-11T15:48:23.217459-06:00 tohru rsyslogd ' +
+                b'6611 12512 [origin_1 software="rsyslogd" ' +
+                b'swVersion="7.2.2"][origin_2 x-info="a \\"quoted\\" ]"] ' +
+                b'start')
+
+
+def octet_frame(message):
+    return str(len(message)).encode() + b' ' + message
+
+
+class WhenBulkParsingSyslog(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = SyslogBulkParser()
+        self.stream = octet_frame(BULK_MESSAGE) * 3
+
+    def test_parses_every_frame_in_a_read(self):
+        messages = self.parser.parse(self.stream)
+        self.assertEqual(3, len(messages))
+        message = messages[0]
+        self.assertEqual(b'46', message.priority)
+        self.assertEqual(b'1', message.version)
+        self.assertEqual(b'2012-12-11T15:48:23.217459-06:00', message.timestamp)
+        self.assertEqual(b'tohru', message.hostname)
+        self.assertEqual(b'rsyslogd', message.appname)
+        self.assertEqual(b'6611', message.processid)
+        self.assertEqual(b'12512', message.messageid)
+        self.assertEqual(b'start', message.message)
+        self.assertEqual(
+            {b'software': b'rsyslogd', b'swVersion': b'7.2.2'},
+            message.sd[b'origin_1'])
+        self.assertEqual(
+            {b'x-info': b'a \\"quoted\\" ]'}, message.sd[b'origin_2'])
+
+    def test_frames_split_across_reads(self):
+        for chunk_size in (1, 2, 7, 50):
+            messages = list()
+            for data in chunk(self.stream, len(self.stream), chunk_size):
+                messages.extend(self.parser.parse(data))
+            self.assertEqual(3, len(messages))
+            self.assertEqual(b'start', messages[2].message)
+            self.assertEqual(0, self.parser.pending())
+
+    def test_parses_up_to_length(self):
+        frame = octet_frame(BULK_MESSAGE)
+        buffer = bytearray(frame + b'junk')
+        self.assertEqual(1, len(self.parser.parse(buffer, len(frame))))
+        self.assertEqual(0, self.parser.pending())
+
+    def test_nil_structured_data_and_message(self):
+        messages = self.parser.parse(octet_frame(b'<13>1 - host app - - -'))
+        self.assertEqual({}, messages[0].sd)
+        self.assertEqual(b'', messages[0].message)
+
+    def test_malformed_frames_are_skipped(self):
+        stream = (octet_frame(b'not syslog') +
+                  octet_frame(b'<13>1 - host app - - [unclosed') +
+                  octet_frame(BULK_MESSAGE))
+        messages = self.parser.parse(stream)
+        self.assertEqual(1, len(messages))
+        self.assertEqual(2, self.parser.malformed)
+
+    def test_parses_into_a_batch(self):
+        batch = SyslogBatch()
+        stream = octet_frame(b'not syslog') + self.stream
+        for data in chunk(stream, len(stream), 7):
+            self.parser.parse_into(batch, data)
+        self.assertEqual(3, len(batch))
+        self.assertEqual(1, self.parser.malformed)
+        expected = self.parser.parse(self.stream)
+        for message, view in zip(expected, batch):
+            self.assertEqual(message.timestamp, view.timestamp)
+            self.assertEqual(message.messageid, view.messageid)
+            self.assertEqual(message.message, view.message)
+            self.assertEqual(message.sd, view.sd)
+
+    def test_bad_octet_count(self):
+        with self.assertRaises(SyslogFramingError):
+            self.parser.parse(b'12a <13>1 -')
+        with self.assertRaises(SyslogFramingError):
+            SyslogBulkParser().parse(b'1234567890')
+
+
+BSD_MESSAGES = (b'<34>Oct 11 22:14:15 mymachine su: failed for lonvick\n' +
+                b'<13>Feb  5 17:32:18 10.0.0.99 myproc[8710]: Use the BFG!\r\n' +
+                b'\n' +
+                b'<13>no timestamp\n')
+
+
+class WhenParsingNonTransparentSyslog(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = SyslogBulkParser()
+
+    def test_framing_detected(self):
+        self.parser.parse(BSD_MESSAGES)
+        self.assertEqual(FRAMING_NON_TRANSPARENT, self.parser.framing())
+        parser = SyslogBulkParser()
+        parser.parse(octet_frame(BULK_MESSAGE))
+        self.assertEqual(FRAMING_OCTET_COUNTED, parser.framing())
+
+    def test_unknown_framing(self):
+        with self.assertRaises(SyslogFramingError):
+            self.parser.parse(b'hello')
+
+    def test_rfc3164_fields(self):
+        messages = self.parser.parse(BSD_MESSAGES)
+        self.assertEqual(3, len(messages))
+        message = messages[1]
+        self.assertEqual(b'13', message.priority)
+        self.assertIsNone(message.version)
+        self.assertEqual(b'Feb  5 17:32:18', message.timestamp)
+        self.assertEqual(b'10.0.0.99', message.hostname)
+        self.assertEqual(b'myproc', message.appname)
+        self.assertEqual(b'8710', message.processid)
+        self.assertEqual(b'Use the BFG!', message.message)
+        self.assertEqual(b'su', messages[0].appname)
+        self.assertIsNone(messages[0].processid)
+        self.assertIsNone(messages[2].timestamp)
+        self.assertEqual(b'no timestamp', messages[2].message)
+
+    def test_rfc5424_lines(self):
+        messages = self.parser.parse(BULK_MESSAGE + b'\n')
+        self.assertEqual(b'1', messages[0].version)
+        self.assertEqual(b'start', messages[0].message)
+
+    def test_lines_split_across_reads(self):
+        batch = SyslogBatch()
+        for data in chunk(BSD_MESSAGES * 2, len(BSD_MESSAGES) * 2, 3):
+            self.parser.parse_into(batch, data)
+        self.assertEqual(6, len(batch))
+        self.assertEqual(b'8710', batch[4].processid)
+        self.assertIsNone(batch[4].messageid)
+        self.assertEqual(0, self.parser.pending())
+
+    def test_forced_framing(self):
+        parser = SyslogBulkParser(framing=FRAMING_OCTET_COUNTED)
+        with self.assertRaises(SyslogFramingError):
+            parser.parse(BSD_MESSAGES)
+
+
+class WhenParsingSyslogDatagrams(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = SyslogBulkParser()
+
+    def test_one_message_per_datagram(self):
+        messages = self.parser.parse_datagram(BULK_MESSAGE + b'\n\x00')
+        self.assertEqual(1, len(messages))
+        self.assertEqual(b'start', messages[0].message)
+        self.assertEqual(0, self.parser.pending())
+
+    def test_bsd_datagram(self):
+        messages = self.parser.parse_datagram(BSD_MESSAGES.split(b'\n')[1])
+        self.assertEqual(b'myproc', messages[0].appname)
+
+    def test_datagrams_into_a_batch(self):
+        batch = SyslogBatch()
+        self.parser.parse_datagram_into(batch, BULK_MESSAGE)
+        self.parser.parse_datagram_into(batch, bytearray(BULK_MESSAGE), 10)
+        self.assertEqual(1, len(batch))
+        self.assertEqual(1, self.parser.malformed)
+        self.assertEqual(b'start', batch[0].message)
+
 
 def performance(duration=10, print_output=True):
     lexer = SyslogLexer()
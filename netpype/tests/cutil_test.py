@@ -1,7 +1,7 @@
 import unittest
 
 try:
-    from netpype.cutil import CyclicBuffer
+    from netpype.cutil import CyclicBuffer, SEEK_LIMIT_REACHED
     
     class WhenManipulatingCyclicBuffers(unittest.TestCase):
 
@@ -76,6 +76,53 @@ try:
             buff = CyclicBuffer(size_hint=10)
             buff.put(bytearray('More than you can handle.'), 0, 25)
             self.assertEqual(25, buff.available())
+
+        def test_put_memoryview(self):
+            buff = CyclicBuffer(size_hint=10)
+            buff.put(memoryview(b'test'))
+            self.assertEqual(4, buff.available())
+
+        def test_writable_view(self):
+            buff = CyclicBuffer(size_hint=8)
+            view = buff.writable_view(4)
+            self.assertEqual(8, len(view))
+            view[0:4] = b'test'
+            buff.commit(4)
+            self.assertEqual(4, buff.available())
+            self.assertEqual(b'test', buff.readable_view().tobytes())
+
+        def test_writable_view_grows(self):
+            buff = CyclicBuffer(size_hint=8)
+            buff.put(bytearray(b'abcdef'))
+            view = buff.writable_view(16)
+            self.assertTrue(len(view) >= 16)
+            view[0:2] = b'gh'
+            buff.commit(2)
+            self.assertEqual(b'abcdefgh', buff.readable_view().tobytes())
+
+        def test_grow_refused_while_viewed(self):
+            buff = CyclicBuffer(size_hint=8)
+            buff.put(bytearray(b'abcdef'))
+            view = buff.readable_view()
+            self.assertRaises(BufferError, buff.grow, 16)
+            view.release()
+            buff.grow(16)
+            self.assertEqual(6, buff.available())
+
+        def test_seek_several_delimiters(self):
+            buff = CyclicBuffer(size_hint=16)
+            buff.put(bytearray(b'key=value; next'))
+            data = bytearray(16)
+            self.assertEqual(3, buff.get_until(b';=', data))
+            self.assertEqual(b'key', bytes(data[:3]))
+
+        def test_seek_limit(self):
+            buff = CyclicBuffer(size_hint=16)
+            buff.put(bytearray(b'abcdefgh'))
+            data = bytearray(16)
+            self.assertEqual(SEEK_LIMIT_REACHED,
+                             buff.get_until(b'e', data, 0, 4))
+            self.assertEqual(4, buff.get_until(b'e', data, 0, 5))
 except ImportError:
     print('C extensions have not been built.')
 
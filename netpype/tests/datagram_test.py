@@ -0,0 +1,134 @@
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from netpype.selector import events as selection_events, new_datagram_server
+from netpype.channel import SocketINet4Address, SocketUnixAddress
+from netpype.channel import datagram_socket
+from netpype.channel import NetworkEventHandler, PipelineFactory
+
+
+class EchoHandler(NetworkEventHandler):
+
+    def __init__(self):
+        self.reads = list()
+
+    def on_read(self, message):
+        self.reads.append(message)
+        return (selection_events.REQUEST_WRITE, message.upper())
+
+
+class SharedPipelineFactory(PipelineFactory):
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def upstream_pipeline(self):
+        return [self.handler]
+
+    def downstream_pipeline(self):
+        return [self.handler]
+
+
+class WhenServingDatagrams(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = EchoHandler()
+        self.server = new_datagram_server(
+            SocketINet4Address('127.0.0.1', 0),
+            SharedPipelineFactory(self.handler),
+            batch_size=4,
+            max_datagram=16)
+        # Run the server in this process so that its reads can be driven
+        self.server.on_start()
+        self.address = self.server._socket.getsockname()
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.settimeout(1.0)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.on_halt()
+
+    def _send(self, *datagrams):
+        for datagram in datagrams:
+            self.client.sendto(datagram, self.address)
+
+    def test_each_datagram_is_one_read(self):
+        self._send(b'one', b'two', b'three')
+        self.server.process()
+        self.assertEqual([b'one', b'two', b'three'], self.handler.reads)
+
+    def test_reads_are_batched(self):
+        self._send(*[str(index).encode() for index in range(6)])
+        self.server.process()
+        self.assertEqual(4, len(self.handler.reads))
+        self.server.process()
+        self.assertEqual(6, len(self.handler.reads))
+
+    def test_writes_reply_to_the_peer(self):
+        self._send(b'hello')
+        self.server.process()
+        reply, address = self.client.recvfrom(16)
+        self.assertEqual(b'HELLO', reply)
+        self.assertEqual(self.address, address)
+
+    def test_large_datagrams_are_truncated(self):
+        self._send(b'x' * 32)
+        self.server.process()
+        self.assertEqual([b'x' * 16], self.handler.reads)
+
+    def test_bad_batch_size(self):
+        with self.assertRaises(ValueError):
+            new_datagram_server(
+                SocketINet4Address('127.0.0.1', 0),
+                SharedPipelineFactory(self.handler),
+                batch_size=0)
+
+
+class WhenServingUnixDatagrams(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'log')
+        self.handler = EchoHandler()
+        self.server = new_datagram_server(
+            SocketUnixAddress(self.path), SharedPipelineFactory(self.handler))
+        self.server.on_start()
+        self.client = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.client.settimeout(1.0)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.on_halt()
+        shutil.rmtree(self.directory)
+
+    def test_unbound_peers(self):
+        self.client.sendto(b'<13>hello', self.path)
+        self.server.process()
+        self.assertEqual([b'<13>hello'], self.handler.reads)
+
+    def test_bound_peers_are_answered(self):
+        self.client.bind(os.path.join(self.directory, 'client'))
+        self.client.sendto(b'hello', self.path)
+        self.server.process()
+        self.assertEqual(b'HELLO', self.client.recv(16))
+
+
+class WhenBindingDatagramSockets(unittest.TestCase):
+
+    def test_reuse_port(self):
+        address = SocketINet4Address('127.0.0.1', 0)
+        first = datagram_socket(address, reuse_port=True)
+        try:
+            port = first.getsockname()[1]
+            second = datagram_socket(
+                SocketINet4Address('127.0.0.1', port), reuse_port=True)
+            second.close()
+        finally:
+            first.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import select
+import unittest
+
+from netpype.dispatch import DispatchPool, THREAD_POOL, PROCESS_POOL
+
+
+def double(message):
+    return ('doubled', message * 2)
+
+
+def explode(message):
+    raise ValueError(message)
+
+
+def _wait(pool):
+    select.select([pool.fileno()], [], [], 5)
+    return list(pool.completions())
+
+
+class WhenDispatching(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = DispatchPool(THREAD_POOL, workers=1, max_pending=1)
+        self.pool.start()
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_results_return_to_owner(self):
+        self.assertTrue(self.pool.submit('owner', (double, 2)))
+        completions = _wait(self.pool)
+        self.assertEqual([('owner', ('doubled', 4))], completions)
+        self.assertEqual(0, self.pool.pending())
+
+    def test_submit_refused_when_full(self):
+        self.assertTrue(self.pool.submit('owner', (double, 2)))
+        self.assertTrue(self.pool.full())
+        self.assertFalse(self.pool.submit('owner', (double, 3)))
+        _wait(self.pool)
+        self.assertFalse(self.pool.full())
+
+    def test_failures_complete_without_result(self):
+        self.pool.submit('owner', (explode, 'boom'))
+        self.assertEqual([('owner', None)], _wait(self.pool))
+
+    def test_unpicklable_tasks_complete_without_result(self):
+        pool = DispatchPool(PROCESS_POOL, workers=1)
+        pool.start()
+        try:
+            pool.submit('owner', (lambda message: message, 'unpicklable'))
+            self.assertEqual([('owner', None)], _wait(pool))
+            self.assertEqual(0, pool.pending())
+        finally:
+            pool.close()
+
+    def test_unknown_pool_type(self):
+        with self.assertRaises(ValueError):
+            DispatchPool('fiber')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,290 @@
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from netpype.tests.support import HandlerPipelineFactory
+from netpype.tests.support import free_port, connect, stop, wait_for
+from netpype.selector import events as selection_events
+from netpype.channel import SocketINet4Address, SocketUnixAddress
+from netpype.channel import HandlerPipeline, ChannelPipeline
+from netpype.channel import NetworkEventHandler
+from netpype.control import STATE_STOPPED
+from netpype.dispatch import DispatchPool, THREAD_POOL
+from netpype.server.cluster import SelectorServerCluster
+from netpype.server.datagram import DatagramServer
+from netpype.server.poll import PollSelectorServer
+
+try:
+    from netpype.server.aio import AsyncioSelectorServer
+except ImportError:
+    AsyncioSelectorServer = None
+
+
+class LineHandler(NetworkEventHandler):
+
+    def __init__(self):
+        self.partial = b''
+
+    def buffered(self):
+        return len(self.partial)
+
+    def on_connect(self, message):
+        return (selection_events.REQUEST_READ, None)
+
+    def on_read(self, message):
+        self.partial += bytes(message)
+        if not self.partial.endswith(b'\n'):
+            return None
+        line = self.partial
+        self.partial = b''
+        return (selection_events.REQUEST_WRITE, line)
+
+    def on_write(self, message):
+        return None
+
+    def on_close(self, message):
+        return None
+
+
+def slow_reply(message):
+    time.sleep(0.5)
+    return (selection_events.REQUEST_WRITE, message)
+
+
+class SlowHandler(LineHandler):
+
+    def on_read(self, message):
+        return (selection_events.DISPATCH, (slow_reply, bytes(message)))
+
+
+class SlowPipelineFactory(HandlerPipelineFactory):
+
+    def __init__(self):
+        super(SlowPipelineFactory, self).__init__(SlowHandler)
+
+    def dispatch_pool(self):
+        return DispatchPool(THREAD_POOL, workers=1)
+
+
+class SilentServer(PollSelectorServer):
+
+    def on_drain(self, deadline):
+        # Drains without handing its listener off
+        self._control.send_listener = lambda listener: None
+        super(SilentServer, self).on_drain(deadline)
+
+
+class WhenDrainingChannels(unittest.TestCase):
+
+    def setUp(self):
+        self.server = PollSelectorServer(
+            SocketINet4Address('127.0.0.1', 0),
+            HandlerPipelineFactory(LineHandler))
+        self.server.on_start()
+        self.sockets = list()
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+        self.server.on_halt()
+
+    def _channel(self):
+        channel, peer = socket.socketpair()
+        self.sockets.extend((channel, peer))
+        channel_handler = ChannelPipeline(
+            channel,
+            HandlerPipeline(HandlerPipelineFactory(LineHandler)),
+            None)
+        self.server._register(channel_handler.fileno)
+        self.server._connected(channel_handler)
+        return channel_handler, channel_handler.pipeline.downstream[0]
+
+    def test_finished_channels_close(self):
+        idle, _ = self._channel()
+        busy, handler = self._channel()
+        handler.partial = b'half a li'
+        self.server.on_drain(time.time() + 60)
+        self.assertFalse(self.server._is_active(idle))
+        self.assertTrue(self.server._is_active(busy))
+
+        handler.partial = b''
+        self.server._check_drain()
+        self.assertFalse(self.server._is_active(busy))
+        self.assertEqual(STATE_STOPPED, self.server._control.state())
+
+    def test_deadlines_close_everything(self):
+        busy, handler = self._channel()
+        handler.partial = b'half a li'
+        self.server.on_drain(time.time() - 1)
+        self.assertFalse(self.server._is_active(busy))
+        self.assertEqual(STATE_STOPPED, self.server._control.state())
+
+    def test_accepting_stays_off(self):
+        self.server.on_drain(time.time() + 60)
+        self.server._resume_accepting()
+        self.assertTrue(self.server._accept_paused)
+
+
+class WhenDrainingServers(unittest.TestCase):
+
+    def _partial_frames_finish(self, server_class):
+        port = free_port()
+        server = server_class(
+            SocketINet4Address('127.0.0.1', port),
+            HandlerPipelineFactory(LineHandler))
+        server.start()
+        try:
+            client = connect(('127.0.0.1', port))
+            client.sendall(b'<13>half a li')
+            time.sleep(0.1)
+            server.drain(5)
+            time.sleep(0.1)
+            self.assertTrue(server.is_alive())
+
+            client.sendall(b'ne\n')
+            self.assertEqual(b'<13>half a line\n', client.recv(64))
+            # Drained channels are closed by the server
+            self.assertEqual(b'', client.recv(64))
+            self.assertTrue(server.join(2))
+            client.close()
+        finally:
+            stop(server)
+
+    def test_partial_frames_finish(self):
+        self._partial_frames_finish(PollSelectorServer)
+
+    def test_partial_frames_finish_over_asyncio(self):
+        if AsyncioSelectorServer is not None:
+            self._partial_frames_finish(AsyncioSelectorServer)
+
+    def test_dispatched_replies_finish(self):
+        port = free_port()
+        server = PollSelectorServer(
+            SocketINet4Address('127.0.0.1', port), SlowPipelineFactory())
+        server.start()
+        try:
+            client = connect(('127.0.0.1', port))
+            client.sendall(b'<13>dispatched\n')
+            time.sleep(0.1)
+            server.drain(5)
+            self.assertEqual(b'<13>dispatched\n', client.recv(64))
+            self.assertEqual(b'', client.recv(64))
+            self.assertTrue(server.join(2))
+            client.close()
+        finally:
+            stop(server)
+
+
+class WhenHandingOff(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _handoff(self, socket_addr, address, family):
+        first = PollSelectorServer(
+            socket_addr, HandlerPipelineFactory(LineHandler))
+        second = None
+        first.start()
+        try:
+            old_client = connect(address, family)
+            old_client.sendall(b'old\n')
+            self.assertEqual(b'old\n', old_client.recv(64))
+
+            # Connections made while the old generation drains are served
+            waiting = socket.socket(family, socket.SOCK_STREAM)
+            second = first.handoff(
+                PollSelectorServer(
+                    socket_addr, HandlerPipelineFactory(LineHandler)))
+            waiting.settimeout(5)
+            waiting.connect(address)
+            waiting.sendall(b'waiting\n')
+            self.assertEqual(b'waiting\n', waiting.recv(64))
+
+            # The old generation closes its idle channels and exits
+            self.assertEqual(b'', old_client.recv(64))
+            self.assertTrue(first.join(2))
+
+            new_client = connect(address, family)
+            new_client.sendall(b'new\n')
+            self.assertEqual(b'new\n', new_client.recv(64))
+            for client in (old_client, waiting, new_client):
+                client.close()
+        finally:
+            stop(first)
+            if second is not None:
+                stop(second)
+
+    def test_inet_listeners(self):
+        port = free_port()
+        self._handoff(SocketINet4Address('127.0.0.1', port),
+                      ('127.0.0.1', port), socket.AF_INET)
+
+    def test_unix_listeners_keep_their_path(self):
+        path = os.path.join(self.directory, 'handoff.sock')
+        self._handoff(SocketUnixAddress(path), path, socket.AF_UNIX)
+
+
+class WhenRestartingClusters(unittest.TestCase):
+
+    def _restart(self, server_class, serve, hold=None, **restart_kwargs):
+        port = free_port()
+        cluster = SelectorServerCluster(
+            server_class, SocketINet4Address('127.0.0.1', port),
+            HandlerPipelineFactory(LineHandler), workers=2)
+        cluster.start()
+        try:
+            old = cluster.workers()
+            self.assertTrue(wait_for(lambda: all(
+                worker.heartbeat() is not None for worker in old)))
+            held = hold(port) if hold else None
+
+            cluster.restart(60, **restart_kwargs)
+            new = cluster.workers()
+            self.assertFalse(set(old) & set(new))
+            self.assertTrue(all(worker.is_alive() for worker in new))
+            serve(port)
+        finally:
+            cluster.stop(2)
+        if held:
+            held.close()
+        # Replaced workers are stopped along with the rest
+        for worker in old + new:
+            self.assertFalse(worker.is_alive())
+
+    def _serve_streams(self, port):
+        client = connect(('127.0.0.1', port))
+        client.sendall(b'restarted\n')
+        self.assertEqual(b'restarted\n', client.recv(64))
+        client.close()
+
+    def test_streams(self):
+        def hold(port):
+            # Keeps an old worker draining until it is stopped
+            client = connect(('127.0.0.1', port))
+            client.sendall(b'half a li')
+            time.sleep(0.1)
+            return client
+        self._restart(PollSelectorServer, self._serve_streams, hold)
+
+    def test_failed_handoffs(self):
+        self._restart(
+            SilentServer, self._serve_streams, handoff_timeout=0.5)
+
+    def test_datagrams(self):
+        def serve(port):
+            client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            client.settimeout(5)
+            client.sendto(b'restarted\n', ('127.0.0.1', port))
+            self.assertEqual(b'restarted\n', client.recv(64))
+            client.close()
+        self._restart(DatagramServer, serve)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,11 +2,13 @@ import unittest
 import time
 
 from netpype.examples.syslog import SyslogLexer, lexer_states
+from netpype.selector import events as selection_events
+from netpype.batch import SyslogBatch
 
 
 #HAPPY_PATH_MESSAGE = bytearray('158 <46>1 2013-03-20T23:01:23.425602-05:00 tohru rsyslogd - - - [origin software="rsyslogd" swVersion="7.2.5" x-pid="24902" x-info="http://www.rsyslog.com"] start')
 
-HAPPY_PATH_MESSAGE = bytearray(b'263 <46>1 2012-12-11T15:48:23.217459-06:00 tohru ' +
+HAPPY_PATH_MESSAGE = bytearray(b'259 <46>1 2012-12-11T15:48:23.217459-06:00 tohru ' +
                       b'rsyslogd 6611 12512 [origin_1 software="rsyslogd" ' +
                       b'swVersion="7.2.2" x-pid="12297" ' +
                       b'x-info="http://www.rsyslog.com"]' +
@@ -134,6 +136,50 @@ class WhenLexingSyslogHead(unittest.TestCase):
             chunk(HAPPY_PATH_MESSAGE, len(HAPPY_PATH_MESSAGE)))
         self.assertEqual(
             lexer_states.START, self.lexer.get_state())
+
+
+class WhenLexingSyslogIntoABatch(unittest.TestCase):
+
+    def setUp(self):
+        self.batch = SyslogBatch()
+        self.lexer = SyslogLexer(self.batch)
+
+    def test_messages_fill_the_batch(self):
+        stream = HAPPY_PATH_MESSAGE * 2
+        for data in chunk(stream, len(stream), 7):
+            self.lexer.on_read(data)
+        self.assertEqual(2, len(self.batch))
+        message = self.batch[1]
+        self.assertEqual(b'46', message.priority)
+        self.assertEqual(b'tohru', message.hostname)
+        self.assertEqual(b'12512', message.messageid)
+        self.assertEqual(b'start', message.message)
+        self.assertEqual(
+            b'http://www.rsyslog.com', message.sd[b'origin_2'][b'x-info'])
+
+
+class WhenLexingOversizedTokens(unittest.TestCase):
+
+    def setUp(self):
+        self.batch = SyslogBatch()
+        self.lexer = SyslogLexer(self.batch)
+
+    def test_frame_is_skipped(self):
+        body = b'<46>1 - tohru rsyslogd - - [a b="' + b'x' * 300 + b'"] big'
+        frame = str(len(body)).encode() + b' ' + body
+        stream = frame + HAPPY_PATH_MESSAGE
+        for data in chunk(stream, len(stream), 64):
+            self.lexer.on_read(data)
+        self.assertEqual(lexer_states.START, self.lexer.get_state())
+        self.assertEqual(0, self.lexer.buffered())
+        self.assertEqual(1, len(self.batch))
+        self.assertEqual(b'start', self.batch[0].message)
+
+    def test_octet_count_closes(self):
+        self.assertEqual(
+            (selection_events.REQUEST_CLOSE, None),
+            self.lexer.on_read(b'12345678901 <46>1 -'))
+
         
 def performance(duration=10, print_output=True):
     lexer = SyslogLexer()
@@ -0,0 +1,197 @@
+import select
+import socket
+import time
+import unittest
+
+from netpype.tests.support import HandlerPipelineFactory
+from netpype.tests.support import free_port, connect, stop
+from netpype.selector import events as selection_events
+from netpype.channel import SocketINet4Address, HandlerPipeline
+from netpype.channel import ChannelPipeline, NetworkEventHandler
+from netpype.server.poll import PollSelectorServer
+from netpype.server.epoll import EdgeTriggeredEPollSelectorServer
+
+
+class HoldingHandler(NetworkEventHandler):
+
+    def __init__(self):
+        self.held = 0
+
+    def buffered(self):
+        return self.held
+
+    def on_connect(self, message):
+        return (selection_events.REQUEST_READ, None)
+
+    def on_read(self, message):
+        self.held += len(message)
+        return None
+
+    def on_close(self, message):
+        return None
+
+
+class WhenMeasuringChannels(unittest.TestCase):
+
+    def setUp(self):
+        self.server = PollSelectorServer(
+            SocketINet4Address('127.0.0.1', 0),
+            HandlerPipelineFactory(HoldingHandler),
+            read_high_watermark=100,
+            read_low_watermark=10,
+            memory_budget=150)
+        self.server.on_start()
+        self.sockets = list()
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+        self.server.on_halt()
+
+    def _channel(self):
+        channel, peer = socket.socketpair()
+        self.sockets.extend((channel, peer))
+        channel_handler = ChannelPipeline(
+            channel,
+            HandlerPipeline(HandlerPipelineFactory(HoldingHandler)),
+            None)
+        channel_handler.read_interest = True
+        self.server._register(channel_handler.fileno)
+        self.server._active_channels[channel_handler.fileno] = channel_handler
+        return channel_handler, channel_handler.pipeline.downstream[0]
+
+    def test_reads_pause_over_the_high_watermark(self):
+        channel_handler, handler = self._channel()
+        handler.held = 100
+        self.server._measure(channel_handler)
+        self.assertFalse(channel_handler.reading())
+
+        handler.held = 50
+        self.server._measure(channel_handler)
+        self.assertFalse(channel_handler.reading())
+
+        handler.held = 10
+        self.server._measure(channel_handler)
+        self.assertTrue(channel_handler.reading())
+        stats = self.server.flow_stats()
+        self.assertEqual(1, stats['read_buffer_pauses'])
+        self.assertEqual(1, stats['read_buffer_resumes'])
+
+    def test_memory_budget_spans_channels(self):
+        first, first_handler = self._channel()
+        second, second_handler = self._channel()
+        first_handler.held = 90
+        self.server._measure(first)
+        second_handler.held = 5
+        self.server._measure(second)
+        self.assertTrue(first.reading())
+
+        second_handler.held = 70
+        self.server._measure(second)
+        self.assertFalse(second.reading())
+        self.assertTrue(first.reading())
+        self.assertEqual(160, self.server.flow_stats()['buffered'])
+
+        # Channels that hold little keep reading to finish their messages
+        first_handler.held = 5
+        self.server._measure(first)
+        self.assertTrue(second.reading())
+        stats = self.server.flow_stats()
+        self.assertEqual(1, stats['memory_pauses'])
+        self.assertEqual(1, stats['memory_resumes'])
+        self.assertEqual(75, stats['buffered'])
+
+    def test_bad_watermarks(self):
+        with self.assertRaises(ValueError):
+            PollSelectorServer(
+                SocketINet4Address('127.0.0.1', 0),
+                HandlerPipelineFactory(HoldingHandler),
+                read_high_watermark=10,
+                read_low_watermark=100)
+
+
+class WhenHandlersFallBehind(unittest.TestCase):
+
+    def test_reads_stop_and_are_counted(self):
+        port = free_port()
+        server = PollSelectorServer(
+            SocketINet4Address('127.0.0.1', port),
+            HandlerPipelineFactory(HoldingHandler),
+            read_high_watermark=4096,
+            read_low_watermark=1024)
+        server.start()
+        try:
+            deadline = time.time() + 5
+            client = connect(('127.0.0.1', port))
+            client.sendall(b'x' * 8192)
+            while (server.flow_stats()['read_buffer_pauses'] == 0 and
+                    time.time() < deadline):
+                time.sleep(0.05)
+            self.assertEqual(1, server.flow_stats()['read_buffer_pauses'])
+            client.close()
+        finally:
+            stop(server)
+
+
+class WhenDrainingEdgeTriggeredChannels(unittest.TestCase):
+
+    def _server(self, **kwargs):
+        server = EdgeTriggeredEPollSelectorServer(
+            SocketINet4Address('127.0.0.1', 0),
+            HandlerPipelineFactory(HoldingHandler),
+            recv_size=256, min_recv_size=256, max_recv_size=256,
+            # Timers keep the polls from blocking
+            idle_timeout=1, timer_tick=0.01,
+            **kwargs)
+        server.on_start()
+        client = socket.create_connection(server._socket.getsockname(), 5)
+        # Accept, then pick the new channel up from the ready queue
+        server.process()
+        server.process()
+        channel_handler = list(server._active_channels.values())[0]
+        return server, client, channel_handler
+
+    def test_reads_are_capped_per_wakeup(self):
+        if not hasattr(select, 'epoll'):
+            return
+        server, client, channel_handler = self._server()
+        try:
+            client.sendall(b'x' * 65536)
+            time.sleep(0.1)
+            handler = channel_handler.pipeline.downstream[0]
+            # The rest waits for the next turn
+            server.process()
+            self.assertEqual(server._drain_limit, handler.held)
+            self.assertIn(channel_handler, server._ready)
+            server.process()
+            self.assertEqual(2 * server._drain_limit, handler.held)
+
+            for _ in range(100):
+                if handler.held == 65536:
+                    break
+                server.process()
+            self.assertEqual(65536, handler.held)
+            client.close()
+        finally:
+            server.on_halt()
+
+    def test_draining_stops_once_reads_pause(self):
+        if not hasattr(select, 'epoll'):
+            return
+        server, client, channel_handler = self._server(
+            read_high_watermark=1024, read_low_watermark=256)
+        try:
+            client.sendall(b'x' * 65536)
+            time.sleep(0.1)
+            handler = channel_handler.pipeline.downstream[0]
+            server.process()
+            self.assertEqual(1024, handler.held)
+            self.assertEqual(0, channel_handler.read_buffer.available())
+            self.assertFalse(channel_handler.reading())
+            client.close()
+        finally:
+            server.on_halt()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import time
+import unittest
+
+from netpype.tests.support import EchoHandler, HandlerPipelineFactory
+from netpype.tests.support import free_port, connect, stop
+from netpype.channel import SocketINet4Address
+from netpype.metrics import ServerMetrics, Histogram, percentile
+from netpype.server.poll import PollSelectorServer
+
+
+class WhenRecordingHistograms(unittest.TestCase):
+
+    def test_power_of_two_buckets(self):
+        counts = [0] * 8
+        histogram = Histogram(counts, 0, 8)
+        for value in (0, 0.5, 1, 3, 4, 1000):
+            histogram.record(value)
+        self.assertEqual([2, 1, 1, 1, 0, 0, 0, 1], counts)
+
+    def test_percentiles(self):
+        self.assertIsNone(percentile([0, 0, 0], 0.5))
+        self.assertEqual(2, percentile([0, 9, 1], 0.5))
+        self.assertEqual(4, percentile([0, 9, 1], 0.99))
+
+    def test_handler_slots(self):
+        metrics = ServerMetrics(buckets=4, handler_slots=1)
+        histogram = metrics.handler(EchoHandler)
+        histogram.record(2)
+        self.assertIs(histogram, metrics.handler(EchoHandler))
+        self.assertIsNone(metrics.handler(HandlerPipelineFactory))
+        self.assertEqual(
+            {'EchoHandler': [0, 0, 1, 0]}, metrics.snapshot()['handler_ns'])
+
+
+class WhenServing(unittest.TestCase):
+
+    def test_metrics_are_read_from_the_parent(self):
+        port = free_port()
+        server = PollSelectorServer(
+            SocketINet4Address('127.0.0.1', port),
+            HandlerPipelineFactory(EchoHandler),
+            dispatch_sample=1)
+        server.start()
+        try:
+            deadline = time.time() + 5
+            client = connect(('127.0.0.1', port))
+            client.sendall(b'metrics')
+            self.assertEqual(b'metrics', client.recv(64))
+            client.close()
+
+            while (server.metrics()['counters']['closes'] == 0 and
+                    time.time() < deadline):
+                time.sleep(0.05)
+            snapshot = server.metrics()
+            counters = snapshot['counters']
+            self.assertEqual(1, counters['accepts'])
+            self.assertEqual(1, counters['closes'])
+            self.assertEqual(0, counters['active_channels'])
+            self.assertEqual(7, counters['bytes_read'])
+            self.assertEqual(7, counters['bytes_written'])
+            self.assertTrue(counters['events'] > 0)
+            self.assertEqual(counters['polls'],
+                             sum(snapshot['events_per_poll']))
+            self.assertTrue(sum(snapshot['loop_ns']) > 0)
+            self.assertTrue(sum(snapshot['handler_ns']['EchoHandler']) > 0)
+            self.assertIn('memory_pauses', snapshot['flow'])
+        finally:
+            stop(server)
+
+
+if __name__ == '__main__':
+    unittest.main()
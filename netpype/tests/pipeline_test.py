@@ -0,0 +1,106 @@
+import unittest
+
+from netpype.selector import events as selection_events
+from netpype.server import network_event, _run_pipeline
+from netpype.channel import HandlerPipeline, NetworkEventHandler
+from netpype.channel import PipelineFactory
+
+try:
+    from netpype.cutil import run_pipeline as native_run_pipeline
+except ImportError:
+    native_run_pipeline = None
+
+
+class Forwarder(NetworkEventHandler):
+
+    def on_read(self, message):
+        return (selection_events.FORWARD, message + b'>')
+
+    def on_close(self, message):
+        self.closed = message
+
+
+class Writer(NetworkEventHandler):
+
+    def on_read(self, message):
+        return (selection_events.REQUEST_WRITE, message)
+
+
+class Failing(NetworkEventHandler):
+
+    def on_read(self, message):
+        raise ValueError('Bad read.')
+
+
+class Defaults(NetworkEventHandler):
+    pass
+
+
+class ListPipelineFactory(PipelineFactory):
+
+    def __init__(self, *handlers):
+        self.handlers = list(handlers)
+
+    def upstream_pipeline(self):
+        return self.handlers
+
+    def downstream_pipeline(self):
+        return self.handlers
+
+
+class WhenDispatchingPipelineEvents(unittest.TestCase):
+
+    def _pipeline(self, *handlers):
+        return HandlerPipeline(ListPipelineFactory(*handlers))
+
+    def test_handler_defaults_are_skipped(self):
+        forwarder = Forwarder()
+        pipeline = self._pipeline(Defaults(), forwarder, Writer())
+        self.assertEqual(2, len(pipeline.methods['on_read']))
+        self.assertEqual((), pipeline.methods['on_write'])
+        self.assertEqual(
+            [forwarder.on_close], list(pipeline.methods['on_close']))
+
+    def test_forwarding_chain(self):
+        pipeline = self._pipeline(Forwarder(), Forwarder(), Writer())
+        self.assertEqual(
+            (selection_events.REQUEST_WRITE, 7, b'x>>'),
+            network_event(selection_events.READ_AVAILABLE, 7, pipeline, b'x'))
+
+    def test_forwarding_off_the_end(self):
+        pipeline = self._pipeline(Forwarder())
+        self.assertIsNone(
+            network_event(selection_events.READ_AVAILABLE, 7, pipeline, b'x'))
+
+    def test_failing_handlers_end_the_event(self):
+        pipeline = self._pipeline(Failing(), Writer())
+        self.assertIsNone(
+            network_event(selection_events.READ_AVAILABLE, 7, pipeline, b'x'))
+
+    def test_close_reaches_every_handler(self):
+        first = Forwarder()
+        second = Forwarder()
+        pipeline = self._pipeline(first, second)
+        self.assertEqual(
+            (selection_events.RECLAIM_CHANNEL, 7, None),
+            network_event(selection_events.CHANNEL_CLOSED, 7, pipeline, 'a'))
+        self.assertEqual('a', first.closed)
+        self.assertEqual('a', second.closed)
+
+    def test_unknown_events(self):
+        with self.assertRaises(Exception):
+            network_event(-1, 7, self._pipeline(), None)
+
+    def test_native_dispatch_matches(self):
+        if native_run_pipeline is None:
+            return
+        for handlers in ((Forwarder(), Writer()), (Forwarder(),), ()):
+            methods = self._pipeline(*handlers).methods['on_read']
+            self.assertEqual(
+                _run_pipeline(methods, 3, b'x', selection_events.FORWARD),
+                native_run_pipeline(
+                    methods, 3, b'x', selection_events.FORWARD))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import os
+import pstats
+import select
+import shutil
+import socket
+import tempfile
+import unittest
+
+from netpype.tests.support import EchoHandler, HandlerPipelineFactory
+from netpype.selector import events as selection_events
+from netpype.channel import SocketINet4Address
+from netpype.profiler import SamplingProfiler
+from netpype.server.poll import PollSelectorServer
+
+
+class WhenSamplingHandlers(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _profiler(self, **kwargs):
+        return SamplingProfiler(
+            directory=self.directory, dump_signal=None, **kwargs)
+
+    def test_one_in_sample_calls(self):
+        profiler = self._profiler(sample=3)
+        self.assertEqual([False, False, True, False, False, True],
+                         [profiler.sample() for _ in range(6)])
+
+    def test_pstats_dumps(self):
+        profiler = self._profiler(sample=2)
+        handler = EchoHandler()
+        record = profiler.recorder(selection_events.READ_AVAILABLE)
+        record(handler.on_read, 0.25)
+        record(handler.on_read, 0.25)
+        profiler.record_syscall('epoll', 'poll', 1.0)
+
+        stats = pstats.Stats(profiler.dump()).stats
+        on_read = [function for function in stats
+                   if function[2] == 'EchoHandler.on_read'][0]
+        self.assertTrue(on_read[0].endswith('support.py'))
+        calls, _, own, total, callers = stats[on_read]
+        self.assertEqual((4, 1.0, 1.0), (calls, own, total))
+        self.assertEqual([('~', 0, '<READ_AVAILABLE>')], list(callers))
+        self.assertEqual(2.0, stats[('~', 0, '<epoll.poll>')][2])
+
+    def test_collapsed_dumps(self):
+        profiler = self._profiler(sample=1, dump_format='collapsed')
+        handler = EchoHandler()
+        profiler.recorder(selection_events.CHANNEL_CONNECTED)(
+            handler.on_connect, 0.001)
+        with open(profiler.dump()) as dump_file:
+            self.assertEqual(
+                ['netpype;CHANNEL_CONNECTED;EchoHandler.on_connect 1000\n'],
+                dump_file.readlines())
+
+    def test_dumps_start_over(self):
+        profiler = self._profiler(interval=5)
+        profiler.start(100)
+        self.assertFalse(profiler.dump_due(104))
+        self.assertTrue(profiler.dump_due(105))
+        profiler.record_syscall('poll', 'poll', 1.0)
+        self.assertIsNotNone(profiler.dump(105))
+        self.assertFalse(profiler.dump_due(106))
+        self.assertIsNone(profiler.dump())
+
+        profiler.request_dump()
+        self.assertTrue(profiler.dump_due(106))
+
+    def test_selector_calls(self):
+        profiler = self._profiler(sample=1, dump_format='collapsed')
+        selector = profiler.selector(select.poll(), 'poll')
+        self.assertEqual([], selector.poll(0))
+        self.assertEqual(
+            ['netpype;selector;poll.poll'],
+            [line.split(' ')[0] for line in profiler.collapsed()])
+
+    def test_bad_formats(self):
+        with self.assertRaises(ValueError):
+            self._profiler(dump_format='json')
+
+
+class WhenProfilingServers(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_handlers_are_attributed(self):
+        server = PollSelectorServer(
+            SocketINet4Address('127.0.0.1', 0),
+            HandlerPipelineFactory(EchoHandler),
+            # Timers keep the polls from blocking
+            idle_timeout=1, timer_tick=0.01,
+            profiler=SamplingProfiler(
+                sample=1, directory=self.directory, dump_signal=None,
+                dump_format='collapsed'))
+        server.on_start()
+        try:
+            client = socket.create_connection(
+                server._socket.getsockname(), 5)
+            client.sendall(b'profiled')
+            client.setblocking(0)
+            echoed = b''
+            for _ in range(100):
+                server.process()
+                try:
+                    echoed += client.recv(64)
+                except socket.error:
+                    continue
+                break
+            self.assertEqual(b'profiled', echoed)
+            client.close()
+        finally:
+            server.on_halt()
+
+        dumps = os.listdir(self.directory)
+        self.assertEqual(1, len(dumps))
+        with open(os.path.join(self.directory, dumps[0])) as dump_file:
+            stacks = [line.split(' ')[0] for line in dump_file]
+        self.assertIn('netpype;CHANNEL_CONNECTED;EchoHandler.on_connect',
+                      stacks)
+        self.assertIn('netpype;READ_AVAILABLE;EchoHandler.on_read', stacks)
+        self.assertIn('netpype;selector;poll.poll', stacks)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import socket
+import time
+
+from netpype.selector import events as selection_events
+from netpype.channel import NetworkEventHandler, PipelineFactory
+
+
+"""
+Handlers, pipeline factories and socket helpers shared by the tests that run
+servers.
+"""
+
+
+class EchoHandler(NetworkEventHandler):
+
+    def on_connect(self, message):
+        return (selection_events.REQUEST_READ, None)
+
+    def on_read(self, message):
+        return (selection_events.REQUEST_WRITE, bytes(message))
+
+    def on_write(self, message):
+        return None
+
+    def on_close(self, message):
+        return None
+
+
+"""
+A HandlerPipelineFactory builds upstream and downstream pipelines of one new
+handler of the given class each.
+"""
+
+
+class HandlerPipelineFactory(PipelineFactory):
+
+    def __init__(self, handler_class):
+        self._handler_class = handler_class
+
+    def upstream_pipeline(self):
+        return [self._handler_class()]
+
+    def downstream_pipeline(self):
+        return [self._handler_class()]
+
+
+class EmptyPipelineFactory(PipelineFactory):
+
+    def upstream_pipeline(self):
+        return []
+
+    def downstream_pipeline(self):
+        return []
+
+
+def free_port():
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def connect(address, family=socket.AF_INET, timeout=5):
+    # The server binds once its process has started
+    deadline = time.time() + timeout
+    while True:
+        client = socket.socket(family, socket.SOCK_STREAM)
+        client.settimeout(timeout)
+        try:
+            client.connect(address)
+            return client
+        except socket.error:
+            client.close()
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def stop(server):
+    if server.is_alive():
+        server.interrupt()
+        if not server.join(2):
+            server.terminate()
@@ -0,0 +1,107 @@
+import unittest
+
+try:
+    from netpype.syslog import SyslogLexer, SyslogLexerError
+    from netpype.syslog import SyslogMessage, SyslogMessagePool
+
+    MESSAGE = (b'<46>1 2012-12-11T15:48:23.217459-06:00 tohru rsyslogd ' +
+               b'6611 12512 [origin_1 software="rsyslogd" ' +
+               b'swVersion="7.2.2"][origin_2 x-info="a \\"quoted\\" ]"]' +
+               b'[empty] start')
+
+    def octet_frame(message):
+        return str(len(message)).encode() + b' ' + message
+
+    def chunk(data, chunk_size):
+        for index in range(0, len(data), chunk_size):
+            yield data[index:index + chunk_size]
+
+    class WhenLexingNativeSyslog(unittest.TestCase):
+
+        def setUp(self):
+            self.lexer = SyslogLexer(size_hint=16)
+
+        def test_message_fields(self):
+            messages = self.lexer.on_read(octet_frame(MESSAGE))
+            self.assertEqual(1, len(messages))
+            message = messages[0]
+            self.assertEqual(b'46', message.priority)
+            self.assertEqual(b'1', message.version)
+            self.assertEqual(
+                b'2012-12-11T15:48:23.217459-06:00', message.timestamp)
+            self.assertEqual(b'tohru', message.hostname)
+            self.assertEqual(b'rsyslogd', message.appname)
+            self.assertEqual(b'6611', message.processid)
+            self.assertEqual(b'12512', message.messageid)
+            self.assertEqual(b'start', message.message)
+
+        def test_structured_data(self):
+            message = self.lexer.on_read(octet_frame(MESSAGE))[0]
+            self.assertEqual({
+                b'origin_1': {b'software': b'rsyslogd',
+                              b'swVersion': b'7.2.2'},
+                b'origin_2': {b'x-info': b'a \\"quoted\\" ]'},
+                b'empty': {},
+            }, message.sd)
+
+        def test_frames_split_across_reads(self):
+            stream = octet_frame(MESSAGE) * 3
+            for chunk_size in (1, 3, 64):
+                messages = list()
+                for data in chunk(stream, chunk_size):
+                    messages.extend(self.lexer.on_read(data))
+                self.assertEqual(3, len(messages))
+                self.assertEqual(b'start', messages[2].message)
+                for message in messages:
+                    self.lexer.release(message)
+
+        def test_nil_structured_data_without_message(self):
+            message = self.lexer.on_read(
+                octet_frame(b'<13>1 - host app - - -'))[0]
+            self.assertEqual({}, message.sd)
+            self.assertEqual(b'-', message.timestamp)
+            self.assertIsNone(message.message)
+
+        def test_bad_frames(self):
+            with self.assertRaises(SyslogLexerError):
+                SyslogLexer().on_read(b'12a <13>1 -')
+            with self.assertRaises(SyslogLexerError):
+                SyslogLexer().on_read(octet_frame(b'13>1 - h a - - -'))
+            with self.assertRaises(SyslogLexerError):
+                SyslogLexer().on_read(octet_frame(b'<13>1 - h a - - x'))
+
+    class WhenPoolingSyslogMessages(unittest.TestCase):
+
+        def test_released_messages_are_reused_and_reset(self):
+            pool = SyslogMessagePool(max_size=1)
+            lexer = SyslogLexer(pool=pool)
+            first = lexer.on_read(octet_frame(MESSAGE))[0]
+            lexer.release(first)
+            self.assertEqual(1, len(pool))
+            self.assertIsNone(first.hostname)
+            self.assertEqual({}, first.sd)
+
+            second = lexer.on_read(octet_frame(b'<13>1 - h a - - -'))[0]
+            self.assertIs(first, second)
+            self.assertEqual(b'h', second.hostname)
+
+        def test_pool_is_bounded(self):
+            pool = SyslogMessagePool(max_size=1)
+            pool.release(SyslogMessage())
+            pool.release(SyslogMessage())
+            self.assertEqual(1, len(pool))
+
+        def test_arena_grows_for_large_messages(self):
+            lexer = SyslogLexer(pool=SyslogMessagePool(size_hint=16))
+            body = b'x' * 5000
+            message = lexer.on_read(
+                octet_frame(b'<13>1 - h a - - - ' + body))[0]
+            self.assertEqual(body, message.message)
+            self.assertTrue(message.arena_size() >= 5000)
+
+except ImportError:
+    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
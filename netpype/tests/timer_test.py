@@ -0,0 +1,132 @@
+import select
+import time
+import unittest
+
+from netpype.tests.support import EchoHandler, HandlerPipelineFactory
+from netpype.tests.support import free_port, connect, stop
+from netpype.channel import SocketINet4Address
+from netpype.server.poll import PollSelectorServer
+from netpype.server.epoll import EdgeTriggeredEPollSelectorServer
+from netpype.timer import TimerWheel
+
+try:
+    from netpype.server.aio import AsyncioSelectorServer
+except ImportError:
+    AsyncioSelectorServer = None
+
+
+class PatientHandler(EchoHandler):
+
+    def on_timeout(self, message):
+        return None
+
+
+class WhenSchedulingTimers(unittest.TestCase):
+
+    def setUp(self):
+        self.fired = list()
+        self.wheel = TimerWheel(tick=1, slot_bits=2, levels=2, now=0)
+
+    def _fire(self, timer):
+        self.fired.append(timer.payload)
+
+    def test_timer_fires_once_due(self):
+        self.wheel.schedule(3, self._fire, 'a', now=0)
+        self.assertEqual(0, self.wheel.expire(2.9))
+        self.assertEqual(1, self.wheel.expire(3))
+        self.assertEqual(['a'], self.fired)
+        self.assertEqual(0, len(self.wheel))
+
+    def test_timers_cascade_from_upper_wheels(self):
+        self.wheel.schedule(9, self._fire, 'near', now=0)
+        self.wheel.schedule(14, self._fire, 'far', now=0)
+        for now in range(14):
+            self.wheel.expire(now)
+            if now < 9:
+                self.assertEqual([], self.fired)
+        self.assertEqual(['near'], self.fired)
+        self.wheel.expire(14)
+        self.assertEqual(['near', 'far'], self.fired)
+
+    def test_timers_beyond_the_wheels_are_held(self):
+        self.wheel.schedule(40, self._fire, 'a', now=0)
+        self.wheel.expire(39)
+        self.assertEqual([], self.fired)
+        self.wheel.expire(40)
+        self.assertEqual(['a'], self.fired)
+
+    def test_cancelled_timers_do_not_fire(self):
+        timer = self.wheel.schedule(2, self._fire, 'a', now=0)
+        self.assertTrue(timer.pending())
+        self.wheel.cancel(timer)
+        self.assertFalse(timer.pending())
+        self.assertEqual(0, len(self.wheel))
+        self.wheel.expire(5)
+        self.assertEqual([], self.fired)
+
+    def test_timeout_until_next_timer(self):
+        self.assertEqual(-1, self.wheel.timeout(0))
+        self.wheel.schedule(2, self._fire, 'a', now=0)
+        self.assertEqual(1.5, self.wheel.timeout(0.5))
+
+    def test_timeout_stops_at_cascade(self):
+        self.wheel.schedule(9, self._fire, 'a', now=0)
+        self.assertEqual(4, self.wheel.timeout(0))
+
+    def test_callbacks_may_reschedule(self):
+        def again(timer):
+            self.fired.append(timer.payload)
+            if timer.payload < 3:
+                self.wheel.schedule(1, again, timer.payload + 1, now=now)
+        self.wheel.schedule(1, again, 1, now=0)
+        for now in range(5):
+            self.wheel.expire(now)
+        self.assertEqual([1, 2, 3], self.fired)
+
+    def test_bad_tick(self):
+        with self.assertRaises(ValueError):
+            TimerWheel(tick=0)
+
+
+class WhenChannelsIdle(unittest.TestCase):
+
+    def _idle(self, server_class, handler_class):
+        port = free_port()
+        server = server_class(
+            SocketINet4Address('127.0.0.1', port),
+            HandlerPipelineFactory(handler_class),
+            idle_timeout=0.3, timer_tick=0.01)
+        server.start()
+        try:
+            client = connect(('127.0.0.1', port))
+            client.sendall(b'ping')
+            self.assertEqual(b'ping', client.recv(64))
+            started = time.time()
+            readable = select.select([client], [], [], 1.5)[0]
+            closed = bool(readable) and client.recv(64) == b''
+            client.close()
+            return closed, time.time() - started
+        finally:
+            stop(server)
+
+    def test_unhandled_deadlines_close_channels(self):
+        closed, waited = self._idle(PollSelectorServer, EchoHandler)
+        self.assertTrue(closed)
+        self.assertTrue(waited < 1)
+
+    def test_unhandled_deadlines_close_edge_triggered_channels(self):
+        if hasattr(select, 'epoll'):
+            self.assertTrue(self._idle(
+                EdgeTriggeredEPollSelectorServer, EchoHandler)[0])
+
+    def test_unhandled_deadlines_close_asyncio_channels(self):
+        if AsyncioSelectorServer is not None:
+            self.assertTrue(
+                self._idle(AsyncioSelectorServer, EchoHandler)[0])
+
+    def test_handled_deadlines_leave_channels_open(self):
+        self.assertFalse(self._idle(PollSelectorServer, PatientHandler)[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,293 @@
+import errno
+import select
+import socket
+import time
+import unittest
+
+from netpype.tests.support import free_port, connect, stop
+from netpype.selector import events as selection_events, new_server
+from netpype.channel import SocketINet4Address, Upstream
+from netpype.channel import NetworkEventHandler, PipelineFactory
+from netpype.server.poll import PollSelectorServer
+from netpype.server.epoll import EPollSelectorServer
+from netpype.server.upstream import ConnectionPool
+from netpype.timer import TimerWheel
+
+try:
+    from netpype.server.aio import AsyncioSelectorServer
+except ImportError:
+    AsyncioSelectorServer = None
+
+
+class FakeChannel(object):
+
+    def __init__(self, fileno):
+        self.fileno = fileno
+        self.last_write = 0
+
+
+class FakeServer(object):
+
+    def __init__(self):
+        self.channels = list()
+        self.results = list()
+        self.refuse = False
+        self._now = 0
+        self._timers = TimerWheel(tick=0.01, now=0)
+
+    def connect(self, socket_addr, pipeline_factory, pool=None, rcvbuf=None,
+                sndbuf=None):
+        if self.refuse:
+            raise IOError(errno.ECONNREFUSED, 'Connection refused')
+        channel_handler = FakeChannel(len(self.channels))
+        self.channels.append(channel_handler)
+        return channel_handler
+
+    def writes(self, channel_handler):
+        return [result[2] for result in self.results
+                if result[0] == selection_events.REQUEST_WRITE and
+                result[1] == channel_handler.fileno]
+
+    def _handle_result(self, result):
+        self.results.append(result)
+
+    def _schedule(self, delay, callback, payload):
+        return self._timers.schedule(delay, callback, payload, self._now)
+
+    def _is_active(self, channel_handler):
+        return True
+
+    def advance(self, seconds):
+        self._now += seconds
+        self._timers.expire(self._now)
+
+
+class WhenPoolingUpstreamConnections(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+
+    def _pool(self, **kwargs):
+        upstream = Upstream(SocketINet4Address('127.0.0.1', 5140), **kwargs)
+        return ConnectionPool(self.server, 'collector', upstream)
+
+    def test_messages_wait_for_a_connection(self):
+        pool = self._pool()
+        pool.send(b'a')
+        pool.send(b'b')
+        self.assertEqual(1, len(self.server.channels))
+        self.assertEqual(2, pool.backlog())
+
+        channel = self.server.channels[0]
+        pool.connected(channel)
+        self.assertEqual([b'a', b'b'], self.server.writes(channel))
+        self.assertEqual(0, pool.backlog())
+
+    def test_pipelining_limits_messages_in_flight(self):
+        pool = self._pool(pipelining=2, connections=2)
+        pool.send(b'a')
+        first = self.server.channels[0]
+        pool.connected(first)
+        pool.send(b'b')
+        pool.send(b'c')
+        self.assertEqual([b'a', b'b'], self.server.writes(first))
+        self.assertEqual(2, len(self.server.channels))
+
+        second = self.server.channels[1]
+        pool.connected(second)
+        self.assertEqual([b'c'], self.server.writes(second))
+        pool.drained(first)
+        pool.send(b'd')
+        self.assertEqual([b'a', b'b', b'd'], self.server.writes(first))
+
+    def test_connections_are_reused(self):
+        pool = self._pool()
+        pool.send(b'a')
+        channel = self.server.channels[0]
+        pool.connected(channel)
+        pool.drained(channel)
+        pool.send(b'b')
+        self.assertEqual(1, len(self.server.channels))
+        self.assertEqual([b'a', b'b'], self.server.writes(channel))
+
+    def test_reconnects_back_off(self):
+        self.server.refuse = True
+        pool = self._pool(min_backoff=1, max_backoff=3)
+        pool.send(b'a')
+        self.server.advance(1)
+        self.server.advance(1.5)
+        self.assertEqual(0, len(self.server.channels))
+        self.server.advance(0.5)
+        self.server.advance(4)
+        self.server.refuse = False
+        self.assertEqual(0, len(self.server.channels))
+        self.server.advance(3)
+        self.assertEqual(1, len(self.server.channels))
+
+    def test_lost_connections_are_replaced(self):
+        pool = self._pool(min_backoff=1)
+        pool.send(b'a')
+        channel = self.server.channels[0]
+        pool.connected(channel)
+        pool.closed(channel)
+        pool.send(b'b')
+        self.assertEqual(1, len(self.server.channels))
+        self.server.advance(1)
+        self.assertEqual(2, len(self.server.channels))
+
+    def test_full_backlog_drops_oldest(self):
+        self.server.refuse = True
+        pool = self._pool(backlog=2)
+        for message in (b'a', b'b', b'c'):
+            pool.send(message)
+        self.assertEqual(1, pool.dropped)
+        self.server.refuse = False
+        self.server.advance(1)
+        pool.connected(self.server.channels[0])
+        self.assertEqual([b'b', b'c'], self.server.writes(
+            self.server.channels[0]))
+
+    def test_idle_connections_are_closed(self):
+        pool = self._pool(keepalive=2)
+        pool.send(b'a')
+        channel = self.server.channels[0]
+        pool.connected(channel)
+        pool.drained(channel)
+        self.server.advance(2)
+        self.assertEqual(
+            (selection_events.REQUEST_CLOSE, channel.fileno, None),
+            self.server.results[-1])
+        pool.closed(channel)
+        self.server.advance(5)
+        self.assertEqual(1, len(self.server.channels))
+
+    def test_connect_timeout(self):
+        pool = self._pool(connect_timeout=1)
+        pool.send(b'a')
+        self.server.advance(1)
+        self.assertEqual(selection_events.REQUEST_CLOSE,
+                         self.server.results[-1][0])
+
+
+class RelayHandler(NetworkEventHandler):
+
+    def on_connect(self, message):
+        return (selection_events.REQUEST_READ, None)
+
+    def on_read(self, message):
+        return (selection_events.SEND_UPSTREAM, ('collector', bytes(message)))
+
+    def on_close(self, message):
+        return None
+
+
+class RelayPipelineFactory(PipelineFactory):
+
+    def __init__(self, collector_port):
+        self.collector_port = collector_port
+
+    def upstream_pipeline(self):
+        return [RelayHandler()]
+
+    def downstream_pipeline(self):
+        return [RelayHandler()]
+
+    def upstreams(self):
+        return {'collector': Upstream(
+            SocketINet4Address('127.0.0.1', self.collector_port),
+            min_backoff=0.05)}
+
+
+def _listen(port):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', port))
+    listener.listen(8)
+    listener.settimeout(5)
+    return listener
+
+
+def _read(channel, expected, timeout=5):
+    data = b''
+    deadline = time.time() + timeout
+    while len(data) < len(expected) and time.time() < deadline:
+        if select.select([channel], [], [], 0.1)[0]:
+            read = channel.recv(1024)
+            if not read:
+                break
+            data += read
+    return data
+
+
+class WhenRelayingToUpstreams(unittest.TestCase):
+
+    def _relay(self, collector_first=True, server_class=new_server,
+               **kwargs):
+        collector_port = free_port()
+        relay_port = free_port()
+        collector = _listen(collector_port) if collector_first else None
+        server = server_class(
+            SocketINet4Address('127.0.0.1', relay_port),
+            RelayPipelineFactory(collector_port), **kwargs)
+        server.start()
+        try:
+            client = connect(('127.0.0.1', relay_port))
+            client.sendall(b'<13>relayed')
+            if collector is None:
+                time.sleep(0.2)
+                collector = _listen(collector_port)
+            upstream, _ = collector.accept()
+            self.assertEqual(b'<13>relayed', _read(upstream, b'<13>relayed'))
+            client.sendall(b'<13>reused')
+            self.assertEqual(b'<13>reused', _read(upstream, b'<13>reused'))
+            upstream.close()
+            client.close()
+        finally:
+            stop(server)
+            if collector is not None:
+                collector.close()
+
+    def test_relay(self):
+        self._relay()
+
+    def test_relay_over_poll(self):
+        self._relay(server_class=PollSelectorServer)
+
+    def test_relay_over_edge_triggered_epoll(self):
+        if hasattr(select, 'epoll'):
+            self._relay(edge_triggered=True)
+
+    def test_relay_over_asyncio(self):
+        if AsyncioSelectorServer is not None:
+            self._relay(use_asyncio=True)
+
+    def test_relay_waits_for_the_upstream(self):
+        self._relay(collector_first=False)
+
+
+class WhenChannelsCloseMidBatch(unittest.TestCase):
+
+    def _stale_event(self, server_class, dispatch, event):
+        server = server_class(
+            SocketINet4Address('127.0.0.1', 0), RelayPipelineFactory(0))
+        server.on_start()
+        try:
+            channel, peer = socket.socketpair()
+            # The channel was retired by an earlier event of the same batch
+            getattr(server, dispatch)(event, channel.fileno())
+            channel.close()
+            peer.close()
+        finally:
+            server.on_halt()
+
+    def test_poll(self):
+        self._stale_event(PollSelectorServer, '_on_poll', select.POLLIN)
+
+    def test_epoll(self):
+        if hasattr(select, 'epoll'):
+            self._stale_event(
+                EPollSelectorServer, '_on_epoll', select.EPOLLIN)
+
+
+if __name__ == '__main__':
+    unittest.main()
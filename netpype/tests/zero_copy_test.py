@@ -0,0 +1,116 @@
+import select
+import time
+import unittest
+
+from netpype.tests.support import EchoHandler, HandlerPipelineFactory
+from netpype.tests.support import free_port, connect, stop
+from netpype.selector import events as selection_events
+from netpype.channel import SocketINet4Address
+from netpype.dispatch import DispatchPool, THREAD_POOL
+from netpype.server.poll import PollSelectorServer
+from netpype.server.epoll import EPollSelectorServer
+from netpype.server.epoll import EdgeTriggeredEPollSelectorServer
+
+try:
+    from netpype.server.aio import AsyncioSelectorServer
+except ImportError:
+    AsyncioSelectorServer = None
+
+
+class ViewEchoHandler(EchoHandler):
+
+    def on_read(self, message):
+        # Hands the view over the read buffer straight back
+        return (selection_events.REQUEST_WRITE, message)
+
+
+def late_echo(message):
+    # Reads the message once the server has read into its buffer again
+    time.sleep(0.2)
+    return (selection_events.REQUEST_WRITE, bytes(message))
+
+
+class DispatchingHandler(EchoHandler):
+
+    def on_read(self, message):
+        return (selection_events.DISPATCH, (late_echo, message))
+
+
+class DispatchingPipelineFactory(HandlerPipelineFactory):
+
+    def __init__(self):
+        super(DispatchingPipelineFactory, self).__init__(DispatchingHandler)
+
+    def dispatch_pool(self):
+        return DispatchPool(THREAD_POOL, workers=1)
+
+
+class WhenEchoingWithZeroCopy(unittest.TestCase):
+
+    def _echo(self, server_class):
+        port = free_port()
+        server = server_class(
+            SocketINet4Address('127.0.0.1', port),
+            HandlerPipelineFactory(ViewEchoHandler),
+            zero_copy=True,
+            recv_size=64, min_recv_size=64, max_recv_size=64)
+        server.start()
+        try:
+            client = connect(('127.0.0.1', port))
+            # Every read lands where the one before it was queued from
+            sent = b''.join(bytes([ord('a') + index % 26]) * 64
+                            for index in range(1024))
+            client.sendall(sent)
+            echoed = b''
+            while len(echoed) < len(sent):
+                read = client.recv(65536)
+                if not read:
+                    break
+                echoed += read
+            self.assertEqual(sent, echoed)
+            client.close()
+        finally:
+            stop(server)
+
+    def test_poll(self):
+        self._echo(PollSelectorServer)
+
+    def test_epoll(self):
+        if hasattr(select, 'epoll'):
+            self._echo(EPollSelectorServer)
+
+    def test_edge_triggered_epoll(self):
+        if hasattr(select, 'epoll'):
+            self._echo(EdgeTriggeredEPollSelectorServer)
+
+    def test_asyncio(self):
+        if AsyncioSelectorServer is not None:
+            self._echo(AsyncioSelectorServer)
+
+    def test_dispatched_views(self):
+        port = free_port()
+        server = PollSelectorServer(
+            SocketINet4Address('127.0.0.1', port),
+            DispatchingPipelineFactory(),
+            zero_copy=True,
+            recv_size=64, min_recv_size=64, max_recv_size=64)
+        server.start()
+        try:
+            client = connect(('127.0.0.1', port))
+            client.sendall(b'a' * 64)
+            time.sleep(0.05)
+            client.sendall(b'b' * 64)
+            echoed = b''
+            while len(echoed) < 128:
+                read = client.recv(128)
+                if not read:
+                    break
+                echoed += read
+            self.assertEqual(b'a' * 64 + b'b' * 64, echoed)
+            client.close()
+        finally:
+            stop(server)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import math
+import time
+
+
+# Wheel defaults
+DEFAULT_TICK = 0.1
+DEFAULT_SLOT_BITS = 8
+DEFAULT_LEVELS = 4
+
+
+class Timer(object):
+
+    __slots__ = ('deadline', 'callback', 'payload', '_bucket')
+
+    def __init__(self, deadline, callback, payload=None):
+        self.deadline = deadline
+        self.callback = callback
+        self.payload = payload
+        self._bucket = None
+
+    def pending(self):
+        return self._bucket is not None
+
+    def __repr__(self):
+        return 'Timer due at tick {}'.format(self.deadline)
+
+
+"""
+A TimerWheel schedules timers on a hierarchy of wheels. Every wheel has the
+same number of slots and each slot of a wheel spans a whole revolution of the
+wheel below it. Time advances in ticks; timers are placed in the lowest wheel
+that can hold their deadline and are moved down a wheel every time the wheel
+below them completes a revolution.
+
+Scheduling and cancelling a timer are O(1). Timers never fire early but may
+fire up to a tick late, and timers further out than the wheels can hold are
+parked in the outermost wheel until they come into range.
+
+Every method takes the current time so that a loop can share one clock reading
+between its I/O and its timers. The clock is only read when no time is given.
+"""
+
+
+class TimerWheel(object):
+
+    def __init__(self, tick=DEFAULT_TICK, slot_bits=DEFAULT_SLOT_BITS,
+                 levels=DEFAULT_LEVELS, now=None):
+        if tick <= 0:
+            raise ValueError('Timer tick must be positive, got {}.'.format(
+                tick))
+        if slot_bits < 1 or levels < 1:
+            raise ValueError('Timer wheels need at least one level and slot.')
+        self._tick = tick
+        self._slot_bits = slot_bits
+        self._slot_mask = (1 << slot_bits) - 1
+        self._max_delta = (1 << (slot_bits * levels)) - 1
+        self._wheels = [[set() for _ in range(1 << slot_bits)]
+                        for _ in range(levels)]
+        self._current = self._to_tick(time.time() if now is None else now)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def schedule(self, delay, callback, payload=None, now=None):
+        """
+        Schedules callback to be called with the timer once delay seconds
+        have passed.
+        """
+        if now is None:
+            now = time.time()
+        deadline = int(math.ceil((now + delay) / self._tick))
+        timer = Timer(max(deadline, self._current + 1), callback, payload)
+        self._place(timer)
+        self._count += 1
+        return timer
+
+    def cancel(self, timer):
+        bucket = timer._bucket
+        if bucket is not None:
+            bucket.discard(timer)
+            timer._bucket = None
+            self._count -= 1
+
+    def timeout(self, now=None):
+        """
+        Returns the number of seconds until the wheel next needs to advance
+        or -1 when there is nothing scheduled.
+        """
+        if self._count == 0:
+            return -1
+        if now is None:
+            now = time.time()
+
+        # Anything in the upper wheels comes down once the lowest wraps
+        wheel = self._wheels[0]
+        current = self._current
+        wrap = (current | self._slot_mask) + 1
+        due = wrap
+        for tick in range(current + 1, wrap):
+            if wheel[tick & self._slot_mask]:
+                due = tick
+                break
+        return max(0.0, due * self._tick - now)
+
+    def expire(self, now=None):
+        """
+        Advances the wheel to now and calls back every timer that is due.
+        Returns the number of timers that fired.
+        """
+        if now is None:
+            now = time.time()
+        target = self._to_tick(now)
+        expired = list()
+
+        while self._current < target:
+            if self._count == len(expired):
+                # Nothing left to turn the wheels for
+                self._current = target
+                break
+            self._current += 1
+            if self._current & self._slot_mask == 0:
+                self._cascade()
+            bucket = self._wheels[0][self._current & self._slot_mask]
+            if bucket:
+                for timer in bucket:
+                    timer._bucket = None
+                expired.extend(bucket)
+                bucket.clear()
+
+        # Callbacks run once the wheel is settled since they may reschedule
+        self._count -= len(expired)
+        for timer in expired:
+            timer.callback(timer)
+        return len(expired)
+
+    def _to_tick(self, now):
+        return int(now / self._tick)
+
+    def _place(self, timer):
+        delta = min(timer.deadline - self._current, self._max_delta)
+        level = max(0, (delta.bit_length() - 1) // self._slot_bits)
+        slot = ((self._current + delta) >> (self._slot_bits * level) &
+                self._slot_mask)
+        bucket = self._wheels[level][slot]
+        bucket.add(timer)
+        timer._bucket = bucket
+
+    def _cascade(self):
+        for level in range(1, len(self._wheels)):
+            index = self._current >> (self._slot_bits * level) & self._slot_mask
+            bucket = self._wheels[level][index]
+            if bucket:
+                timers = list(bucket)
+                bucket.clear()
+                for timer in timers:
+                    self._place(timer)
+            if index != 0:
+                break
@@ -21,6 +21,9 @@ setup(
                   extra_compile_args=COMPILER_ARGS),
         Extension("netpype.csyslog",
                   ["netpype/csyslog.pxd", "netpype/csyslog.pyx"],
+                  extra_compile_args=COMPILER_ARGS),
+        Extension("netpype.syslog",
+                  ["netpype/syslog.pyx"],
                   extra_compile_args=COMPILER_ARGS)
     ]
 )